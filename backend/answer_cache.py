@@ -0,0 +1,156 @@
+"""
+Cache of /api/query answers, so near-duplicate questions asked from the same
+area in the same weather skip the model call.
+
+A key is (normalized query, location cell, weather bucket):
+
+  query     lowercase words with filler ("me", "near", "please", ...) and
+            punctuation dropped, so "Best biryani near me?" and "best
+            biryani nearby" share an entry.
+  location  a geohash cell of the user's coordinates, else the location
+            name they sent.
+  weather   a coarse condition plus a 5 °C temperature band.
+
+Each query also falls into a category with its own TTL: weather questions
+expire within minutes, time-sensitive ones ("open now", "tonight") within
+the half hour, and place recommendations last for hours. Entries keep how
+long the model took to produce them, so every hit adds to the model time
+saved.
+"""
+import re
+from threading import Lock
+
+from cache import TTLCache
+from geo import geohash_encode
+from metrics import REGISTRY
+
+TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+FILLER_WORDS = {
+    "a", "an", "the", "me", "my", "i", "im", "we", "us", "please", "pls", "can", "could", "would",
+    "you", "any", "some", "near", "nearby", "around", "here", "close", "closest", "nearest",
+    "to", "in", "at", "for", "of", "is", "are", "it", "there", "find", "show", "tell", "suggest",
+    "recommend", "whats", "what", "where", "which",
+}
+WEATHER_WORDS = {
+    "weather", "rain", "raining", "rainy", "umbrella", "temperature", "hot", "cold", "humid",
+    "humidity", "wind", "windy", "sunny", "forecast", "storm", "snow", "snowing", "fog", "foggy",
+}
+TIMELY_WORDS = {"now", "open", "tonight", "today", "currently", "traffic", "event", "events", "live", "late"}
+CATEGORIES = ("weather", "timely", "places")
+DEFAULT_TTLS = {"weather": 600.0, "timely": 1800.0, "places": 21600.0}
+
+SAVED_SECONDS = REGISTRY.counter(
+    "answer_cache_saved_model_seconds_total",
+    "Model time not spent because /api/query was answered from the answer cache.",
+    ("category",),
+)
+
+
+def normalize_query(text):
+    """The query's meaningful words, lowercase, in order, each once."""
+    return " ".join(dict.fromkeys(
+        token for token in TOKEN_RE.findall((text or "").lower()) if token not in FILLER_WORDS
+    ))
+
+
+def query_category(normalized):
+    words = set(normalized.split())
+    if words & WEATHER_WORDS:
+        return "weather"
+    if words & TIMELY_WORDS:
+        return "timely"
+    return "places"
+
+
+def weather_condition(code):
+    if code is None:
+        return "unknown"
+    if code <= 1:
+        return "clear"
+    if code <= 3:
+        return "cloudy"
+    if code <= 48:
+        return "fog"
+    if 71 <= code <= 77:
+        return "snow"
+    if code >= 95:
+        return "storm"
+    return "rain"
+
+
+def weather_bucket(live_weather):
+    """Coarse condition and 5 °C band, e.g. "rain:25"; "none" without weather."""
+    if not live_weather:
+        return "none"
+    temperature = live_weather.get("temperature_c")
+    band = int(temperature // 5 * 5) if isinstance(temperature, (int, float)) else "na"
+    return f"{weather_condition(live_weather.get('code'))}:{band}"
+
+
+class AnswerCache:
+    def __init__(self, ttls=None, max_entries=2000, precision=5):
+        ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.precision = precision
+        self.caches = {category: TTLCache(max_entries=max_entries, ttl=ttls[category]) for category in CATEGORIES}
+        self.saved_seconds = {category: 0.0 for category in CATEGORIES}
+        self._lock = Lock()
+
+    def key(self, query, lat=None, lng=None, location=None, live_weather=None):
+        """(category, cache key) for a question, or None when nothing in it is cacheable."""
+        normalized = normalize_query(query)
+        if not normalized:
+            return None
+        if lat is not None and lng is not None:
+            cell = geohash_encode(float(lat), float(lng), self.precision)
+        else:
+            cell = "@" + " ".join((location or "").lower().split())
+        return query_category(normalized), (normalized, cell, weather_bucket(live_weather))
+
+    def get(self, key):
+        """The cached {"answer_text", "locations"} for a key from key(), else None."""
+        if key is None:
+            return None
+        category, cache_key = key
+        entry = self.caches[category].get(cache_key)
+        if entry is None:
+            return None
+        with self._lock:
+            self.saved_seconds[category] += entry["model_s"]
+        SAVED_SECONDS.inc(entry["model_s"], category=category)
+        return {"answer_text": entry["answer_text"], "locations": entry["locations"]}
+
+    def set(self, key, answer_text, locations, model_s):
+        if key is None:
+            return
+        category, cache_key = key
+        self.caches[category].set(cache_key, {
+            "answer_text": answer_text,
+            "locations": locations,
+            "model_s": model_s,
+        })
+
+    def stats(self):
+        categories = {}
+        for category, cache in self.caches.items():
+            stats = cache.stats()
+            categories[category] = {
+                "ttl": cache.ttl,
+                "entries": stats["entries"],
+                "hits": stats["hits"],
+                "misses": stats["misses"],
+                "evictions": stats["evictions"],
+                "hit_ratio": stats["hit_ratio"],
+                "saved_model_seconds": round(self.saved_seconds[category], 3),
+            }
+        hits = sum(c["hits"] for c in categories.values())
+        misses = sum(c["misses"] for c in categories.values())
+        return {
+            "entries": sum(c["entries"] for c in categories.values()),
+            "hits": hits,
+            "misses": misses,
+            "evictions": sum(c["evictions"] for c in categories.values()),
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "saved_model_calls": hits,
+            "saved_model_seconds": round(sum(self.saved_seconds.values()), 3),
+            "categories": categories,
+        }
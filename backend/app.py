@@ -4,19 +4,73 @@ import math
 import time
 import uuid
 import hashlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
 from functools import wraps
-from flask import Flask, jsonify, request, g
+from flask import Flask, Response, jsonify, request, g
 from flask_cors import CORS
 from dotenv import load_dotenv
 import google.generativeai as genai
-import requests  # Make sure you have run "pip install requests"
 from pathlib import Path
-from threading import Lock
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer  # type: ignore
+import numpy as np
+from answer_cache import CATEGORIES as ANSWER_CATEGORIES, DEFAULT_TTLS as ANSWER_DEFAULT_TTLS, AnswerCache
+from cache import TTLCache
+from geo import (
+    GridIndex,
+    geohash_center,
+    geohash_encode,
+    haversine_distance_m,
+    radius_bbox,
+    within_radius_mask,
+)
+from gems import GemCatalog
+from geocache import STATUS_HIT, STATUS_MISS, STATUS_REJECTED, GeocodeCache
+from heatmap import LAYERS as HEATMAP_LAYERS, SafetyHeatmap
+from query_stream import POI_MARKER, AnswerStreamSplitter, parse_poi_entry, sse_event
+from place_index import PlaceNameIndex
+from polyline import encode as encode_polyline, simplify as simplify_route, tolerance_for_zoom
+from metrics import REGISTRY, fallback
+from overpass_planner import OVERPASS_URL, SOURCE_PARTIAL, SOURCE_UNAVAILABLE, OverpassPlanner
+from router import WalkingRouter
+from vibes import VibeIndex, load_aggregates, place_key
+from upstream import Upstream, track_call
+from leaderboard import WINDOWS as LEADERBOARD_WINDOWS, Leaderboards
+from sessions import MemorySessions, SignedTokens, SQLiteSessions, start_sweeper
+from storage import EmailTaken, JsonStorage, SQLiteStorage, load_json
+from scoring import (
+    AREA_RADIUS_M,
+    SEGMENT_RADIUS_M,
+    area_label,
+    area_score,
+    segment_label,
+    segment_score,
+)
+from feature_store import (
+    KIND_BAD_ROAD,
+    KIND_HOSPITAL,
+    KIND_LAMP,
+    KIND_PHARMACY,
+    KIND_POLICE,
+    TILE_EPSILON,
+    FeatureStore,
+)
+
+# One pooled client per third-party API; see upstream.py for retry and
+# circuit-breaker behaviour. Overpass queries are slow by nature, so they
+# get fewer retries than the quick lookups.
+UPSTREAMS = {
+    "overpass": Upstream("overpass", retries=1),
+    "overpass_mirror": Upstream("overpass_mirror", retries=1),
+    "ors": Upstream("ors", retries=1),
+    "photon": Upstream("photon"),
+    "open_meteo": Upstream("open_meteo"),
+}
+
 
 # Import your safety score function
-def get_safety_score(lat, lng):
-    overpass_url = "https://maps.mail.ru/osm/tools/overpass/api/interpreter"
+def count_safety_points(lat, lng):
+    """Street lamps + police within 500m, from the local store when it covers the point."""
+    if feature_store.covers(*radius_bbox(lat, lng, AREA_RADIUS_M)):
+        return feature_store.count_near(lat, lng, AREA_RADIUS_M, {KIND_LAMP, KIND_POLICE})
     overpass_query = f"""
     [out:json];
     (
@@ -25,86 +79,294 @@ def get_safety_score(lat, lng):
     );
     out count;
     """
+    response = UPSTREAMS["overpass_mirror"].get(OVERPASS_MIRROR_ENDPOINT, params={'data': overpass_query}, timeout=12)
+    data = response.json()
+    return int(data['elements'][0]['tags']['total'])
+
+
+def get_safety_score(lat, lng):
+    """
+    Safety score for the point. Mapped areas are answered straight from the
+    precomputed heatmap. Elsewhere scores are computed at the center of the
+    point's geohash cell and cached per cell; the "Estimated" fallback is
+    never cached so the next request retries the real lookup.
+    """
+    mapped = safety_heatmap.lookup(float(lat), float(lng), "area")
+    if mapped is not None:
+        return mapped_safety_result(mapped)
+    cell = geohash_encode(float(lat), float(lng), SAFETY_CACHE_PRECISION)
+    return safety_cache.get_or_compute(
+        cell,
+        lambda: compute_safety_score(*geohash_center(cell)),
+        should_cache=lambda result: result.get("analysis") != "Estimated",
+    )
+
+
+def mapped_safety_result(score):
+    return {
+        "score": score,
+        "analysis": area_label(score),
+        "details": "Scored from the precomputed city safety map."
+    }
+
+
+def counted_safety_result(element_count):
+    score = area_score(element_count)
+    return {
+        "score": score,
+        "analysis": area_label(score),
+        "details": f"Found {element_count} street lights & safety points."
+    }
+
+
+def estimated_safety_result():
+    fallback("safety_estimated")
+    return {
+        "score": 55,
+        "analysis": "Estimated",
+        "details": "Live safety data unavailable; showing baseline score."
+    }
+
+
+def compute_safety_score(lat, lng):
     try:
-        response = requests.get(overpass_url, params={'data': overpass_query}, timeout=12)
-        data = response.json()
-        element_count = int(data['elements'][0]['tags']['total'])
-        base_score = 20
-        safety_points = min(element_count * 1.5, 75)
-        score = int(base_score + safety_points)
-        
-        if score > 85: analysis = "Very Well Lit"
-        elif score > 60: analysis = "Well Lit"
-        elif score > 40: analysis = "Moderately Lit"
-        else: analysis = "Poorly Lit"
-
-        return {
-            "score": score,
-            "analysis": analysis,
-            "details": f"Found {element_count} street lights & safety points."
-        }
+        return counted_safety_result(count_safety_points(lat, lng))
     except Exception as e:
         print(f"Safety API Error: {e}")
-        return {
-            "score": 55,
-            "analysis": "Estimated",
-            "details": "Live safety data unavailable; showing baseline score."
-        }
+        return estimated_safety_result()
 
 
-def get_live_weather(lat, lng):
-    weather_url = "https://api.open-meteo.com/v1/forecast"
-    params = {
+def get_safety_scores(points):
+    """
+    get_safety_score for many (lat, lng) points, in order. Points in the
+    same geohash cell share one result, and every cell that needs live data
+    is counted from one shared Overpass tile fetch instead of a query each.
+    That fetch is capped at SAFETY_BATCH_MAX_OVERPASS_BATCHES queries and
+    SAFETY_BATCH_DEADLINE_S seconds; cells it does not reach are "Estimated".
+    """
+    results = [None] * len(points)
+    pending = {}
+    for i, (lat, lng) in enumerate(points):
+        mapped = safety_heatmap.lookup(lat, lng, "area")
+        if mapped is not None:
+            results[i] = mapped_safety_result(mapped)
+        else:
+            pending.setdefault(geohash_encode(lat, lng, SAFETY_CACHE_PRECISION), []).append(i)
+
+    remote = []
+    for cell, indexes in pending.items():
+        result = safety_cache.get(cell)
+        if result is None:
+            center = geohash_center(cell)
+            if not feature_store.covers(*radius_bbox(*center, AREA_RADIUS_M)):
+                remote.append(cell)
+                continue
+            result = compute_safety_score(*center)
+            if result.get("analysis") != "Estimated":
+                safety_cache.set(cell, result)
+        for i in indexes:
+            results[i] = result
+
+    if remote:
+        centers = [geohash_center(cell) for cell in remote]
+        per_point, found = overpass_planner.tiles_near(
+            centers,
+            AREA_RADIUS_M,
+            max_batches=SAFETY_BATCH_MAX_OVERPASS_BATCHES,
+            deadline_s=SAFETY_BATCH_DEADLINE_S,
+        )
+        for cell, (lat, lng), tiles in zip(remote, centers, per_point):
+            if all(tile in found for tile in tiles):
+                features = np.concatenate([found[tile] for tile in tiles])
+                features = features[np.isin(features[:, 0], (KIND_LAMP, KIND_POLICE))]
+                count = int(within_radius_mask(lat, lng, features[:, 1], features[:, 2], AREA_RADIUS_M).sum())
+                result = counted_safety_result(count)
+                safety_cache.set(cell, result)
+            else:
+                result = estimated_safety_result()
+            for i in pending[cell]:
+                results[i] = result
+    return results
+
+
+WEATHER_ENDPOINT = os.getenv("WEATHER_ENDPOINT", "https://api.open-meteo.com/v1/forecast")
+WEATHER_CODES = {
+    0: "Clear sky",
+    1: "Mainly clear",
+    2: "Partly cloudy",
+    3: "Overcast",
+    45: "Fog",
+    48: "Depositing rime fog",
+    51: "Light drizzle",
+    53: "Moderate drizzle",
+    55: "Dense drizzle",
+    61: "Light rain",
+    63: "Moderate rain",
+    65: "Heavy rain",
+    71: "Light snow",
+    73: "Moderate snow",
+    75: "Heavy snow",
+    80: "Rain showers",
+    81: "Heavy rain showers",
+    95: "Thunderstorm",
+    99: "Hail thunderstorm"
+}
+
+
+def weather_params(lat, lng):
+    return {
         "latitude": lat,
         "longitude": lng,
         "current": "temperature_2m,relative_humidity_2m,weather_code,wind_speed_10m"
     }
-    weather_codes = {
-        0: "Clear sky",
-        1: "Mainly clear",
-        2: "Partly cloudy",
-        3: "Overcast",
-        45: "Fog",
-        48: "Depositing rime fog",
-        51: "Light drizzle",
-        53: "Moderate drizzle",
-        55: "Dense drizzle",
-        61: "Light rain",
-        63: "Moderate rain",
-        65: "Heavy rain",
-        71: "Light snow",
-        73: "Moderate snow",
-        75: "Heavy snow",
-        80: "Rain showers",
-        81: "Heavy rain showers",
-        95: "Thunderstorm",
-        99: "Hail thunderstorm"
-    }
-    resp = requests.get(weather_url, params=params, timeout=8)
-    resp.raise_for_status()
-    current = resp.json().get("current", {})
+
+
+def parse_live_weather(data):
+    current = data.get("current", {})
     code = current.get("weather_code")
     return {
         "temperature_c": current.get("temperature_2m"),
         "humidity_pct": current.get("relative_humidity_2m"),
         "wind_kmh": current.get("wind_speed_10m"),
         "code": code,
-        "description": weather_codes.get(code, "Latest weather data")
+        "description": WEATHER_CODES.get(code, "Latest weather data")
     }
 
+
+def fetch_live_weather(lat, lng):
+    resp = UPSTREAMS["open_meteo"].get(WEATHER_ENDPOINT, params=weather_params(lat, lng), timeout=8)
+    resp.raise_for_status()
+    return parse_live_weather(resp.json())
+
+
+def weather_tile(lat, lng):
+    """Index of the coarse WEATHER_TILE_DEG tile containing the point."""
+    return (
+        math.floor(float(lat) / WEATHER_TILE_DEG + TILE_EPSILON),
+        math.floor(float(lng) / WEATHER_TILE_DEG + TILE_EPSILON),
+    )
+
+
+def weather_tile_center(tile):
+    row, col = tile
+    return round((row + 0.5) * WEATHER_TILE_DEG, 4), round((col + 0.5) * WEATHER_TILE_DEG, 4)
+
+
+def get_live_weather(lat, lng):
+    """
+    Current conditions for the tile containing (lat, lng), fetched at the
+    tile center. Everyone in a tile shares one cached observation, and
+    concurrent misses for a tile share one upstream request.
+    """
+    tile = weather_tile(lat, lng)
+    return weather_cache.get_or_compute(tile, lambda: fetch_live_weather(*weather_tile_center(tile)))
+
 # --- Flask App Setup ---
 load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to produce a response, by route, method and status.",
+    ("route", "method", "status"),
+)
+HTTP_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "Requests currently being handled.")
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Streaming responses are timed to their first byte, not to the end of the stream.
+    started = g.pop("request_started", None)
+    if started is not None:
+        HTTP_IN_FLIGHT.dec()
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_LATENCY.observe(
+            time.perf_counter() - started, route=route, method=request.method, status=response.status_code
+        )
+    return response
+
+
+@app.teardown_request
+def settle_request_metrics(exc):
+    # Safety net: after_request normally settles the gauge, even for errors
+    # Flask turns into responses; this catches anything that skipped it.
+    if g.pop("request_started", None) is not None:
+        HTTP_IN_FLIGHT.dec()
+
+
 BASE_DIR = Path(__file__).resolve().parent
-DATA_DIR = BASE_DIR / "data"
-DATA_DIR.mkdir(exist_ok=True)
+DATA_DIR = Path(os.getenv("DATA_DIR", BASE_DIR / "data"))
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 REVIEW_FILE = DATA_DIR / "review_samples.json"
+VIBE_AGGREGATES_FILE = Path(os.getenv("VIBE_AGGREGATES_FILE", DATA_DIR / "vibe_aggregates.json"))
+REVIEW_APPENDS_FILE = Path(os.getenv("REVIEW_APPENDS_FILE", DATA_DIR / "review_appends.jsonl"))
+VIBE_SCORE_WORKERS = int(os.getenv("VIBE_SCORE_WORKERS", "1"))
+VIBE_CACHE_TTL = float(os.getenv("VIBE_CACHE_TTL", "900"))
+VIBE_CACHE_MAX_ENTRIES = int(os.getenv("VIBE_CACHE_MAX_ENTRIES", "5000"))
+VIBE_APPEND_MAX_REVIEWS = 50
+VIBE_BATCH_MAX = int(os.getenv("VIBE_BATCH_MAX", "100"))
+VIBE_REVIEW_MAX_CHARS = 2000
 GEMS_FILE = DATA_DIR / "hidden_gems.json"
+GEMS_RELOAD_CHECK_S = float(os.getenv("GEMS_RELOAD_CHECK_S", "30"))
+GEMS_PAGE_MAX = int(os.getenv("GEMS_PAGE_MAX", "100"))
+GEMS_NEARBY_MAX_RADIUS_M = float(os.getenv("GEMS_NEARBY_MAX_RADIUS_M", "50000"))
 PROGRESS_FILE = DATA_DIR / "gem_progress.json"
 USERS_FILE = DATA_DIR / "users.json"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+STORAGE_DB_FILE = Path(os.getenv("STORAGE_DB_FILE", DATA_DIR / "app.sqlite3"))
+# "sqlite" is shared by every worker on the host; "signed" needs SESSION_SECRET
+# set identically on every worker and verifies tokens without any lookup.
+# Signed tokens survive logout until they expire, hence their own short TTL.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite")
+SESSION_DB_FILE = Path(os.getenv("SESSION_DB_FILE", DATA_DIR / "sessions.sqlite3"))
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(7 * 86400)))
+SIGNED_TOKEN_TTL = float(os.getenv("SIGNED_TOKEN_TTL", "900"))
+SESSION_SWEEP_INTERVAL_S = float(os.getenv("SESSION_SWEEP_INTERVAL_S", "300"))
 AUTH_SALT = os.getenv("AUTH_SALT", "kyc-default-salt")
+FEATURE_STORE_DIR = Path(os.getenv("FEATURE_STORE_DIR", DATA_DIR / "osm_store"))
+HEATMAP_DIR = Path(os.getenv("HEATMAP_DIR", DATA_DIR / "heatmap"))
+WALK_GRAPH_FILE = Path(os.getenv("WALK_GRAPH_FILE", DATA_DIR / "walk_graph.npz"))
+ROUTE_CACHE_PRECISION = int(os.getenv("ROUTE_CACHE_PRECISION", "7"))
+ROUTE_CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", "21600"))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "5000"))
+ROUTE_CACHE_MAX_BYTES = int(os.getenv("ROUTE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+ROUTE_FORMATS = {"full", "polyline"}
+ROUTE_POLYLINE_PRECISIONS = {5, 6}
+SAFETY_CACHE_PRECISION = int(os.getenv("SAFETY_CACHE_PRECISION", "7"))
+SAFETY_CACHE_TTL = float(os.getenv("SAFETY_CACHE_TTL", "3600"))
+SAFETY_CACHE_STALE_TTL = float(os.getenv("SAFETY_CACHE_STALE_TTL", "600"))
+SAFETY_CACHE_MAX_ENTRIES = int(os.getenv("SAFETY_CACHE_MAX_ENTRIES", "20000"))
+SAFETY_BATCH_MAX = int(os.getenv("SAFETY_BATCH_MAX", "100"))
+# Bounds the live Overpass work of one batch call; unreached cells are "Estimated".
+SAFETY_BATCH_MAX_OVERPASS_BATCHES = int(os.getenv("SAFETY_BATCH_MAX_OVERPASS_BATCHES", "8"))
+SAFETY_BATCH_DEADLINE_S = float(os.getenv("SAFETY_BATCH_DEADLINE_S", "20"))
+# Open-Meteo "current" values update every 15 minutes.
+WEATHER_TILE_DEG = float(os.getenv("WEATHER_TILE_DEG", "0.1"))
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "900"))
+WEATHER_CACHE_MAX_ENTRIES = int(os.getenv("WEATHER_CACHE_MAX_ENTRIES", "2000"))
+WEATHER_REFRESH_AHEAD = float(os.getenv("WEATHER_REFRESH_AHEAD", "0")) or None
+OVERPASS_ENDPOINT = os.getenv("OVERPASS_ENDPOINT", OVERPASS_URL)
+OVERPASS_MIRROR_ENDPOINT = os.getenv(
+    "OVERPASS_MIRROR_ENDPOINT", "https://maps.mail.ru/osm/tools/overpass/api/interpreter"
+)
+OVERPASS_TILE_DEG = float(os.getenv("OVERPASS_TILE_DEG", "0.01"))
+OVERPASS_CORRIDOR_M = float(os.getenv("OVERPASS_CORRIDOR_M", "200"))
+OVERPASS_MAX_BATCH_TILES = int(os.getenv("OVERPASS_MAX_BATCH_TILES", "16"))
+# Staggered corridor rows may share one query over up to this many times the wanted tiles.
+OVERPASS_MAX_OVERFETCH = float(os.getenv("OVERPASS_MAX_OVERFETCH", "2"))
+# Bounds the live Overpass work of one route; unreached tiles make it "partial".
+OVERPASS_ROUTE_MAX_BATCHES = int(os.getenv("OVERPASS_ROUTE_MAX_BATCHES", "4"))
+OVERPASS_ROUTE_DEADLINE_S = float(os.getenv("OVERPASS_ROUTE_DEADLINE_S", "12"))
+OVERPASS_TILE_CACHE_TTL = float(os.getenv("OVERPASS_TILE_CACHE_TTL", "86400"))
+OVERPASS_TILE_CACHE_MAX_ENTRIES = int(os.getenv("OVERPASS_TILE_CACHE_MAX_ENTRIES", "20000"))
 
 
 def load_json_file(path: Path, default):
@@ -120,22 +382,82 @@ def load_json_file(path: Path, default):
     return default
 
 
-review_samples = load_json_file(REVIEW_FILE, {})
-hidden_gems = load_json_file(GEMS_FILE, [])
-progress_data = load_json_file(PROGRESS_FILE, {"users": {}})
-users_data = load_json_file(USERS_FILE, {"users": []})
-progress_lock = Lock()
-sentiment_analyzer = SentimentIntensityAnalyzer()
-VIBE_CACHE_SECONDS = 900
-vibe_cache = {}
-hidden_gems_map = {gem["id"]: gem for gem in hidden_gems}
-active_sessions = {}
-user_index = {user["id"]: user for user in users_data.get("users", [])}
+vibe_index = VibeIndex(
+    load_aggregates(REVIEW_FILE, VIBE_AGGREGATES_FILE, workers=VIBE_SCORE_WORKERS),
+    REVIEW_APPENDS_FILE,
+)
+vibe_index.sync()
+place_names = PlaceNameIndex(vibe_index.aggregates)
+vibe_cache = TTLCache(max_entries=VIBE_CACHE_MAX_ENTRIES, ttl=VIBE_CACHE_TTL)
+gem_catalog = GemCatalog(load_json_file(GEMS_FILE, []))
+gems_checked_at = time.monotonic()
+gems_mtime = GEMS_FILE.stat().st_mtime
+feature_store = FeatureStore(FEATURE_STORE_DIR)
+safety_heatmap = SafetyHeatmap(HEATMAP_DIR)
+# Routes are weighed by their JSON size so the budget tracks payload bytes.
+route_cache = TTLCache(
+    max_entries=ROUTE_CACHE_MAX_ENTRIES,
+    ttl=ROUTE_CACHE_TTL,
+    max_weight=ROUTE_CACHE_MAX_BYTES,
+    weigher=lambda payload: len(json.dumps(payload)),
+)
+safety_cache = TTLCache(
+    max_entries=SAFETY_CACHE_MAX_ENTRIES,
+    ttl=SAFETY_CACHE_TTL,
+    stale_ttl=SAFETY_CACHE_STALE_TTL,
+)
+weather_cache = TTLCache(
+    max_entries=WEATHER_CACHE_MAX_ENTRIES,
+    ttl=WEATHER_CACHE_TTL,
+    refresh_ahead=WEATHER_REFRESH_AHEAD,
+)
+# Street features change slowly; tiles hold (n, 3) arrays of kind, lat, lng.
+overpass_tile_cache = TTLCache(
+    max_entries=OVERPASS_TILE_CACHE_MAX_ENTRIES,
+    ttl=OVERPASS_TILE_CACHE_TTL,
+)
+overpass_planner = OverpassPlanner(
+    UPSTREAMS["overpass"],
+    overpass_tile_cache,
+    tile_deg=OVERPASS_TILE_DEG,
+    buffer_m=OVERPASS_CORRIDOR_M,
+    max_batch_tiles=OVERPASS_MAX_BATCH_TILES,
+    max_overfetch=OVERPASS_MAX_OVERFETCH,
+    url=OVERPASS_ENDPOINT,
+)
+
+
+def open_storage():
+    """
+    The configured user / progress store. A brand-new SQLite database is
+    seeded from users.json and gem_progress.json when they exist.
+    """
+    if STORAGE_BACKEND == "json":
+        return JsonStorage(USERS_FILE, PROGRESS_FILE)
+    fresh = not STORAGE_DB_FILE.exists()
+    store = SQLiteStorage(STORAGE_DB_FILE)
+    if fresh and (USERS_FILE.exists() or PROGRESS_FILE.exists()):
+        users, unlocks = store.import_json(
+            load_json(USERS_FILE, {"users": []}),
+            load_json(PROGRESS_FILE, {"users": {}}),
+        )
+        print(f"Migrated {users} users and {unlocks} unlocks from JSON into {STORAGE_DB_FILE}.")
+    return store
 
 
-def save_users_file():
-    with USERS_FILE.open("w", encoding="utf-8") as fh:
-        json.dump(users_data, fh, indent=2)
+storage = open_storage()
+
+
+def open_sessions():
+    if SESSION_BACKEND == "signed":
+        return SignedTokens(SESSION_SECRET, ttl=SIGNED_TOKEN_TTL)
+    if SESSION_BACKEND == "memory":
+        return MemorySessions(ttl=SESSION_TTL)
+    return SQLiteSessions(SESSION_DB_FILE, ttl=SESSION_TTL)
+
+
+sessions = open_sessions()
+start_sweeper(sessions, SESSION_SWEEP_INTERVAL_S)
 
 
 def hash_password(password: str) -> str:
@@ -148,19 +470,11 @@ def verify_password(password: str, hashed: str) -> bool:
 
 
 def get_user_by_email(email: str):
-    if not email:
-        return None
-    cleaned = email.lower().strip()
-    for user in users_data.get("users", []):
-        if user.get("email", "").lower() == cleaned:
-            return user
-    return None
+    return storage.get_user_by_email(email)
 
 
 def get_user_by_id(user_id: str):
-    if not user_id:
-        return None
-    return user_index.get(user_id)
+    return storage.get_user_by_id(user_id)
 
 
 def create_user(name: str, email: str, password: str):
@@ -170,20 +484,18 @@ def create_user(name: str, email: str, password: str):
         "email": email.lower().strip(),
         "password_hash": hash_password(password),
     }
-    users_data.setdefault("users", []).append(user)
-    user_index[user["id"]] = user
-    save_users_file()
-    return user
+    return storage.create_user(user)
 
 
-def create_session(user_id: str):
-    token = str(uuid.uuid4())
-    active_sessions[token] = user_id
-    return token
+def create_session(user):
+    return sessions.create(user)
 
 
 def extract_token():
-    auth_header = request.headers.get("Authorization", "")
+    return token_from_header(request.headers.get("Authorization", ""))
+
+
+def token_from_header(auth_header):
     if not auth_header:
         return None
     if auth_header.lower().startswith("bearer "):
@@ -191,14 +503,21 @@ def extract_token():
     return auth_header.strip()
 
 
+def user_for_token(token):
+    if not token:
+        return None
+    session = sessions.resolve(token)
+    if session is None:
+        return None
+    # Signed tokens carry the profile themselves; no lookup needed.
+    return session if sessions.self_contained else get_user_by_id(session)
+
+
 def require_auth(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         token = extract_token()
-        if not token:
-            return jsonify({"error": "Unauthorized"}), 401
-        user_id = active_sessions.get(token)
-        user = get_user_by_id(user_id)
+        user = user_for_token(token)
         if not user:
             return jsonify({"error": "Unauthorized"}), 401
         g.current_user = user
@@ -216,10 +535,11 @@ def register_user_route():
     password = data.get("password") or ""
     if not name or not email or not password:
         return jsonify({"error": "Name, email, and password are required."}), 400
-    if get_user_by_email(email):
+    try:
+        user = create_user(name, email, password)
+    except EmailTaken:
         return jsonify({"error": "Email already registered."}), 409
-    user = create_user(name, email, password)
-    token = create_session(user["id"])
+    token = create_session(user)
     return jsonify({
         "token": token,
         "user": {"id": user["id"], "name": user["name"], "email": user["email"]},
@@ -236,7 +556,7 @@ def login_user_route():
     user = get_user_by_email(email)
     if not user or not verify_password(password, user.get("password_hash", "")):
         return jsonify({"error": "Invalid credentials."}), 401
-    token = create_session(user["id"])
+    token = create_session(user)
     return jsonify({
         "token": token,
         "user": {"id": user["id"], "name": user["name"], "email": user["email"]},
@@ -253,14 +573,21 @@ def get_profile():
 @app.route("/api/auth/logout", methods=["POST"])
 @require_auth
 def logout_user():
+    # With SESSION_BACKEND=signed this is a no-op: the token stays valid
+    # until it expires (SIGNED_TOKEN_TTL).
     token = g.get("current_token")
-    if token and token in active_sessions:
-        active_sessions.pop(token, None)
+    if token:
+        sessions.revoke(token)
     return jsonify({"status": "ok"})
 
 # --- AI CONFIGURATION ---
 GEMINI_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_KEY:
+# Points the SDK at another host (e.g. the benchmark stand-ins) over plain REST.
+GEMINI_ENDPOINT = os.getenv("GEMINI_ENDPOINT")
+if GEMINI_KEY and GEMINI_ENDPOINT:
+    genai.configure(api_key=GEMINI_KEY, transport="rest", client_options={"api_endpoint": GEMINI_ENDPOINT})
+    model = genai.GenerativeModel('gemini-2.0-flash')
+elif GEMINI_KEY:
     genai.configure(api_key=GEMINI_KEY)
     model = genai.GenerativeModel('gemini-2.0-flash')  # Verified model
 else:
@@ -268,9 +595,52 @@ else:
 
 GEOCODER_ENDPOINT = os.getenv("GEOCODER_ENDPOINT", "https://photon.komoot.io/api")
 ORS_API_KEY = os.getenv("ORS_API_KEY")
+ORS_ENDPOINT = os.getenv("ORS_ENDPOINT", "https://api.openrouteservice.org/v2/directions/foot-walking")
+GEOCODE_CACHE_FILE = Path(os.getenv("GEOCODE_CACHE_FILE", DATA_DIR / "geocode_cache.sqlite3"))
+geocode_cache = GeocodeCache(
+    GEOCODE_CACHE_FILE,
+    hit_ttl=float(os.getenv("GEOCODE_HIT_TTL", str(30 * 86400))),
+    miss_ttl=float(os.getenv("GEOCODE_MISS_TTL", "86400")),
+    precision=int(os.getenv("GEOCODE_CACHE_PRECISION", "5")),
+)
+# Answers keyed by normalized question, location cell and weather bucket.
+answer_cache = AnswerCache(
+    ttls={
+        category: float(os.getenv(f"ANSWER_CACHE_TTL_{category.upper()}", str(ANSWER_DEFAULT_TTLS[category])))
+        for category in ANSWER_CATEGORIES
+    },
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000")),
+    precision=int(os.getenv("ANSWER_CACHE_PRECISION", "5")),
+)
+WEATHER_WAIT_S = float(os.getenv("WEATHER_WAIT_S", "4"))
+GEOCODE_DEADLINE_S = float(os.getenv("GEOCODE_DEADLINE_S", "6"))
+upstream_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("UPSTREAM_WORKERS", "32")),
+    thread_name_prefix="upstream",
+)
 
 
 def geocode_place(name, lat=None, lng=None):
+    """
+    Resolves a place name near (lat, lng) through the persistent geocode
+    cache, falling back to Photon. Misses and places beyond 25km are cached
+    as negative entries; upstream errors are not cached.
+    """
+    cached, place = geocode_cache.get(name, lat, lng)
+    if cached:
+        return place
+    try:
+        resp = UPSTREAMS["photon"].get(GEOCODER_ENDPOINT, params=geocode_params(name, lat, lng), timeout=8)
+        resp.raise_for_status()
+        feature = (resp.json().get("features") or [None])[0]
+    except Exception as ge:
+        print(f"Geocoder failed for {name}: {ge}")
+        fallback("geocoder_failed")
+        return None
+    return store_geocode_result(name, lat, lng, feature)
+
+
+def geocode_params(name, lat=None, lng=None):
     params = {
         "q": name,
         "limit": 1,
@@ -279,42 +649,98 @@ def geocode_place(name, lat=None, lng=None):
     if lat is not None and lng is not None:
         params["lat"] = lat
         params["lon"] = lng
-    try:
-        resp = requests.get(GEOCODER_ENDPOINT, params=params, timeout=8)
-        resp.raise_for_status()
-        feature = (resp.json().get("features") or [None])[0]
-        if not feature:
+    return params
+
+
+def store_geocode_result(name, lat, lng, feature):
+    """Caches a Photon feature (or None) for the lookup and returns the accepted place."""
+    coords = (feature or {}).get("geometry", {}).get("coordinates", [])
+    if len(coords) < 2:
+        geocode_cache.put(name, lat, lng, STATUS_MISS)
+        return None
+    props = feature.get("properties", {})
+    place = {
+        "name": props.get("name") or name,
+        "lat": coords[1],
+        "lng": coords[0],
+        "address": props.get("street") or props.get("city") or props.get("state"),
+    }
+    if lat is not None and lng is not None:
+        distance = haversine_distance_m(lat, lng, place["lat"], place["lng"])
+        if distance > 25000:
+            geocode_cache.put(name, lat, lng, STATUS_REJECTED, place)
             return None
-        coords = feature.get("geometry", {}).get("coordinates", [])
-        if len(coords) < 2:
+    geocode_cache.put(name, lat, lng, STATUS_HIT, place)
+    return place
+
+
+def load_walking_router():
+    if not WALK_GRAPH_FILE.exists():
+        return None
+    try:
+        return WalkingRouter(WALK_GRAPH_FILE)
+    except Exception as exc:
+        print(f"Failed to load walking graph {WALK_GRAPH_FILE}: {exc}")
+        return None
+
+
+walking_router = load_walking_router()
+
+
+def compute_local_routes(origin, destination):
+    """
+    (fast_route, safe_route) from the in-process walking graph, or None when
+    no graph is loaded or either end is off it.
+    """
+    if walking_router is None:
+        return None
+    try:
+        fast_route = walking_router.route(origin, destination, "fast")
+        if fast_route is None:
             return None
-        props = feature.get("properties", {})
-        place = {
-            "name": props.get("name") or name,
-            "lat": coords[1],
-            "lng": coords[0],
-            "address": props.get("street") or props.get("city") or props.get("state"),
-        }
-        if lat is not None and lng is not None:
-            distance = haversine_distance_m(lat, lng, place["lat"], place["lng"])
-            if distance > 25000:
-                return None
-        return place
-    except Exception as ge:
-        print(f"Geocoder failed for {name}: {ge}")
+        safe_route = walking_router.route(origin, destination, "safe")
+        return fast_route, safe_route
+    except Exception as e:
+        print(f"Local router error: {e}")
+        fallback("local_router_error")
         return None
 
 
-def haversine_distance_m(lat1, lng1, lat2, lng2):
-    """Approximate distance in meters between two WGS84 points."""
-    R = 6371000.0
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lng2 - lng1)
-    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+def route_cache_key(origin, destination):
+    """
+    Direction-independent cache key for a route request plus whether the
+    request runs opposite to the key's stored direction. Endpoints snap to
+    the nearest walking-graph node when a graph is loaded, else to a geohash
+    cell of ROUTE_CACHE_PRECISION.
+    """
+    ends = []
+    for point in (origin, destination):
+        node = walking_router.snap(point["lat"], point["lng"]) if walking_router is not None else None
+        if node is not None:
+            ends.append(f"n{node}")
+        else:
+            ends.append(f"g{geohash_encode(point['lat'], point['lng'], ROUTE_CACHE_PRECISION)}")
+    a, b = ends
+    return (a, b) if a <= b else (b, a), a > b
+
+
+def reverse_route_payload(payload):
+    """The same /api/routes payload walked in the opposite direction."""
+    def reverse_route(route):
+        return {**route, "coordinates": route["coordinates"][::-1]}
+
+    last = len(payload["fastRoute"]["coordinates"]) - 1
+    safety = payload["safety"]
+    segments = [
+        {**seg, "start_index": last - seg["end_index"], "end_index": last - seg["start_index"]}
+        for seg in reversed(safety.get("segments", []))
+    ]
+    return {
+        **payload,
+        "fastRoute": reverse_route(payload["fastRoute"]),
+        "safeRoute": reverse_route(payload["safeRoute"]),
+        "safety": {**safety, "segments": segments},
+    }
 
 
 def fetch_fast_route(origin, destination):
@@ -322,10 +748,15 @@ def fetch_fast_route(origin, destination):
     Uses OpenRouteService (foot-walking) to get a baseline 'fast' route.
     origin / destination: dicts with lat, lng
     """
+    resp = UPSTREAMS["ors"].post(ORS_ENDPOINT, **ors_route_request(origin, destination))
+    resp.raise_for_status()
+    return parse_ors_route(resp.json())
+
+
+def ors_route_request(origin, destination):
+    """Keyword arguments for the ORS directions POST."""
     if not ORS_API_KEY:
         raise RuntimeError("ORS_API_KEY missing. Add it to your .env to enable routing.")
-
-    url = "https://api.openrouteservice.org/v2/directions/foot-walking"
     headers = {
         "Authorization": ORS_API_KEY,
         "Content-Type": "application/json",
@@ -337,9 +768,10 @@ def fetch_fast_route(origin, destination):
         ],
         "instructions": False,
     }
-    resp = requests.post(url, headers=headers, json=body, timeout=15)
-    resp.raise_for_status()
-    data = resp.json()
+    return {"headers": headers, "json": body, "timeout": 15}
+
+
+def parse_ors_route(data):
     feature = (data.get("features") or [None])[0]
     if not feature:
         raise RuntimeError("No route found between origin and destination.")
@@ -357,12 +789,25 @@ def fetch_fast_route(origin, destination):
 
 def analyze_route_safety(coords):
     """
-    Takes a list of [lng, lat] pairs and computes per-chunk safety using Overpass.
-    Returns overall score (0-100) and segment-level metrics for visualization.
+    Takes a list of [lng, lat] pairs and computes per-chunk safety using the
+    local feature store, or the tiled Overpass planner when the store does not
+    cover the route. Returns overall score (0-100) and segment-level metrics
+    for visualization, plus the feature source ("store", "overpass",
+    "partial" or "unavailable").
     """
     if len(coords) < 2:
         return {"route_score": 0, "segments": []}
+    result = store_route_safety(coords)
+    if result is not None:
+        return result
+    features, info = overpass_planner.features_along(
+        coords, max_batches=OVERPASS_ROUTE_MAX_BATCHES, deadline_s=OVERPASS_ROUTE_DEADLINE_S
+    )
+    return score_route_features(coords, features, info["source"])
+
 
+def store_route_safety(coords):
+    """Route safety from the local feature store, or None when it does not cover the route."""
     lats = [pt[1] for pt in coords]
     lngs = [pt[0] for pt in coords]
     min_lat, max_lat = min(lats), max(lats)
@@ -373,40 +818,43 @@ def analyze_route_safety(coords):
     south, west = min_lat - margin, min_lng - margin
     north, east = max_lat + margin, max_lng + margin
 
-    overpass_url = "http://overpass-api.de/api/interpreter"
-    overpass_query = f"""
-    [out:json];
-    (
-      node["highway"="street_lamp"]({south},{west},{north},{east});
-      node["amenity"~"police|hospital|pharmacy"]({south},{west},{north},{east});
-      way["highway"~"service|unclassified"]({south},{west},{north},{east});
-    );
-    out center;
-    """
-    lamps = []
-    amenities = []
-    bad_centers = []
+    if feature_store.covers(south, west, north, east):
+        bbox = (south, west, north, east)
+        result = score_route_segments(
+            coords,
+            feature_store.features_in_bbox(*bbox, {KIND_LAMP}),
+            feature_store.features_in_bbox(*bbox, {KIND_POLICE, KIND_HOSPITAL, KIND_PHARMACY}),
+            feature_store.features_in_bbox(*bbox, {KIND_BAD_ROAD}),
+        )
+        result["source"] = "store"
+        return result
+    return None
 
-    try:
-        r = requests.get(overpass_url, params={"data": overpass_query}, timeout=25)
-        r.raise_for_status()
-        data = r.json()
-        for el in data.get("elements", []):
-            etype = el.get("type")
-            tags = el.get("tags") or {}
-            if etype == "node":
-                lat = el.get("lat")
-                lng = el.get("lon")
-                if tags.get("highway") == "street_lamp":
-                    lamps.append((lat, lng))
-                elif tags.get("amenity") in {"police", "hospital", "pharmacy"}:
-                    amenities.append((lat, lng))
-            elif etype == "way":
-                center = el.get("center")
-                if center:
-                    bad_centers.append((center.get("lat"), center.get("lon")))
-    except Exception as e:
-        print(f"Route safety Overpass error: {e}")
+
+def score_route_features(coords, features, source):
+    """Scores a route against an (n, 3) array of kind, lat, lng features."""
+    if source in (SOURCE_PARTIAL, SOURCE_UNAVAILABLE):
+        fallback(f"route_safety_{source}")
+    kinds = features[:, 0]
+    result = score_route_segments(
+        coords,
+        features[kinds == KIND_LAMP, 1:],
+        features[np.isin(kinds, (KIND_POLICE, KIND_HOSPITAL, KIND_PHARMACY)), 1:],
+        features[kinds == KIND_BAD_ROAD, 1:],
+    )
+    result["source"] = source
+    return result
+
+
+def score_route_segments(coords, lamps, amenities, bad_centers):
+    """
+    Chunks the route and scores each chunk against the nearby features.
+    lamps / amenities / bad_centers: lists of (lat, lng) tuples.
+    """
+    radius_m = SEGMENT_RADIUS_M
+    lamp_index = GridIndex(lamps, cell_size_m=radius_m)
+    amenity_index = GridIndex(amenities, cell_size_m=radius_m)
+    bad_index = GridIndex(bad_centers, cell_size_m=radius_m)
 
     # Chunk route into small segments (approx every ~100–150m)
     segments = []
@@ -420,38 +868,19 @@ def analyze_route_safety(coords):
         mid_lng, mid_lat = group[mid_idx]
 
         # count features within radius
-        radius_m = 120.0
-        lamp_count = sum(
-            1
-            for (la, lo) in lamps
-            if haversine_distance_m(mid_lat, mid_lng, la, lo) <= radius_m
-        )
-        amenity_count = sum(
-            1
-            for (la, lo) in amenities
-            if haversine_distance_m(mid_lat, mid_lng, la, lo) <= radius_m
-        )
-        bad_here = any(
-            haversine_distance_m(mid_lat, mid_lng, la, lo) <= radius_m
-            for (la, lo) in bad_centers
-        )
+        lamp_count = lamp_index.count_within(mid_lat, mid_lng, radius_m)
+        amenity_count = amenity_index.count_within(mid_lat, mid_lng, radius_m)
+        bad_here = bad_index.any_within(mid_lat, mid_lng, radius_m)
 
-        # Scoring heuristic: base 50, reward lights/amenities, penalize bad roads
-        score = 50 + 10 * lamp_count + 20 * amenity_count - (30 if bad_here else 0)
-        score = max(0, min(100, score))
-        if score >= 75:
-            label = "safe"
-        elif score >= 45:
-            label = "moderate"
-        else:
-            label = "risky"
+        score = segment_score(lamp_count, amenity_count, bad_here)
+        label = segment_label(score)
 
         segments.append(
             {
                 "start_index": i,
                 "end_index": i + len(group) - 1,
                 "center": {"lat": mid_lat, "lng": mid_lng},
-                "score": int(score),
+                "score": score,
                 "label": label,
                 "lamp_count": lamp_count,
                 "amenity_count": amenity_count,
@@ -466,44 +895,59 @@ def analyze_route_safety(coords):
     return {"route_score": int(avg_score), "segments": segments}
 
 
-def save_progress_data():
-    with progress_lock:
-        with PROGRESS_FILE.open("w", encoding="utf-8") as fh:
-            json.dump(progress_data, fh, indent=2)
+def get_user_progress(user_id: str):
+    return storage.get_progress(user_id)
 
 
-def get_user_progress(user_id: str):
-    with progress_lock:
-        profile = progress_data["users"].setdefault(
-            user_id,
-            {"badges": [], "unlocked": []},
-        )
-        return profile
-
-
-def compute_leaderboard():
-    with progress_lock:
-        entries = []
-        for uid, data in progress_data.get("users", {}).items():
-            user = get_user_by_id(uid)
-            entries.append({
-                "userId": uid,
-                "name": user.get("name") if user else "Explorer",
-                "count": len(data.get("unlocked", []))
-            })
-    entries.sort(key=lambda item: item["count"], reverse=True)
-    return entries[:5]
-
-
-def fetch_sample_reviews(place_name: str):
-    key = place_name.lower()
-    if key in review_samples:
-        return review_samples[key]
-    # fallback: fuzzy contains
-    for stored_key, texts in review_samples.items():
-        if key in stored_key or stored_key in key:
-            return texts
-    return None
+def current_gems():
+    """
+    The gem catalog, rebuilt (index included) when hidden_gems.json has
+    changed; the file is checked at most every GEMS_RELOAD_CHECK_S.
+    """
+    global gem_catalog, gems_checked_at, gems_mtime
+    now = time.monotonic()
+    if now - gems_checked_at >= GEMS_RELOAD_CHECK_S:
+        gems_checked_at = now
+        try:
+            mtime = GEMS_FILE.stat().st_mtime
+            if mtime != gems_mtime:
+                gem_catalog = GemCatalog(load_json_file(GEMS_FILE, []))
+                gems_mtime = mtime
+                print(f"Reloaded {len(gem_catalog)} hidden gems from {GEMS_FILE}.")
+        except Exception as exc:
+            print(f"Failed to reload {GEMS_FILE}: {exc}")
+    return gem_catalog
+
+
+def gem_region(gem_id):
+    """Leaderboard region of a gem: its "city", else a ~20 km geohash cell."""
+    gem = gem_catalog.by_id.get(gem_id)
+    if gem is None:
+        return None
+    return gem.get("city") or geohash_encode(gem["lat"], gem["lng"], 4)
+
+
+leaderboards = Leaderboards(gem_region)
+
+
+def compute_leaderboard(limit=5, city=None, window=None):
+    leaderboards.sync(storage)
+    entries = []
+    for uid, count in leaderboards.top(limit, city=city, window=window):
+        user = get_user_by_id(uid)
+        entries.append({"userId": uid, "name": user.get("name") if user else "Explorer", "count": count})
+    return entries
+
+
+def find_review_place(place_name: str):
+    """The vibe_index key that best matches a place name, else None."""
+    return place_names.best(place_key(place_name))
+
+
+def sync_vibes():
+    """Applies reviews appended by any worker; new places become searchable."""
+    for key in vibe_index.sync():
+        place_names.add(key)
 
 
 def classify_vibe(score: float):
@@ -515,30 +959,23 @@ def classify_vibe(score: float):
         return "Mixed"
     return "Chaotic"
 
-# --- API ENDPOINT 1: THE AI BRAIN ---
-@app.route('/api/query', methods=['POST'])
-@require_auth
-def handle_query():
-    data = request.get_json()
-    user_query = data.get('query')
-    user_location = data.get('location', "Unknown Location")
-    coords = data.get('coordinates') or {}
-    lat = coords.get('lat')
-    lng = coords.get('lng')
-    
-    if not user_query:
-        return jsonify({"error": "Query is required"}), 400
+def wait_for_weather(future):
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=WEATHER_WAIT_S)
+    except FutureTimeout:
+        print(f"Weather fetch exceeded {WEATHER_WAIT_S}s; answering without it.")
+        fallback("weather_timeout")
+    except Exception as e:
+        print(f"Weather fetch failed: {e}")
+        fallback("weather_failed")
+    return None
 
-    live_weather = None
-    if lat is not None and lng is not None:
-        try:
-            live_weather = get_live_weather(lat, lng)
-        except Exception as e:
-            print(f"Weather fetch failed: {e}")
 
+def build_query_prompt(user_query, user_location, live_weather):
     weather_context = json.dumps(live_weather, indent=2) if live_weather else "null"
-
-    prompt = f"""
+    return f"""
     You are CityScout, a hyper-local AI concierge that helps users currently in {user_location}.
     User Question: "{user_query}"
 
@@ -554,56 +991,245 @@ def handle_query():
       POI_CANDIDATES: name|note; name|note
       Include up to three precise places that answer the query (use '-' if no note). If none, write 'POI_CANDIDATES: none'.
     """
+
+
+def parse_poi_candidates(raw_answer):
+    """Splits the model output into (answer_text, [{"name", "note"}, ...])."""
+    poi_candidates = []
+    answer_text = raw_answer
+    if POI_MARKER in raw_answer:
+        answer_text, poi_blob = raw_answer.split(POI_MARKER, 1)
+        lines = poi_blob.strip().splitlines()
+        first_line = lines[0] if lines else "none"
+        if first_line.strip().lower() != "none":
+            entries = [entry.strip() for entry in first_line.split(";") if entry.strip()]
+            poi_candidates = [parse_poi_entry(entry) for entry in entries]
+    return answer_text, poi_candidates
+
+
+def geocode_candidates(poi_candidates, lat, lng, deadline_s=None):
+    """
+    Geocodes every candidate concurrently and waits at most deadline_s for
+    the batch. Returns (locations in candidate order, partial) where partial
+    is True if any lookup was still running at the deadline.
+    """
+    if not poi_candidates:
+        return [], False
+    deadline_s = GEOCODE_DEADLINE_S if deadline_s is None else deadline_s
+    futures = [
+        upstream_pool.submit(geocode_place, candidate["name"], lat, lng)
+        for candidate in poi_candidates
+    ]
+    done, pending = wait(futures, timeout=deadline_s)
+    for future in pending:
+        future.cancel()
+    if pending:
+        print(f"Geocoding: {len(pending)} of {len(futures)} lookups missed the {deadline_s}s deadline.")
+        fallback("geocode_deadline")
+    locations = []
+    for candidate, future in zip(poi_candidates, futures):
+        if future not in done or future.exception() is not None:
+            continue
+        geo = future.result()
+        if geo:
+            geo["note"] = None if candidate["note"] == "-" else candidate["note"]
+            locations.append(geo)
+    return locations, bool(pending)
+
+def weather_fallback_answer(user_location, live_weather):
+    """Answer text shown when the model is unavailable but weather is known."""
+    return (
+        f"Live weather for {user_location}:\n"
+        f"- Condition: {live_weather.get('description', 'N/A')}\n"
+        f"- Temperature: {live_weather.get('temperature_c', 'N/A')}°C\n"
+        f"- Humidity: {live_weather.get('humidity_pct', 'N/A')}%\n"
+        f"- Wind: {live_weather.get('wind_kmh', 'N/A')} km/h\n\n"
+        "AI insights are temporarily unavailable (service limit reached). "
+        "Please try again in a moment."
+    )
+
+def parse_query_coordinates(data):
+    """(lat, lng, error) from a /api/query body; lat and lng are None when not given."""
+    coords = data.get('coordinates') or {}
+    if not isinstance(coords, dict):
+        return None, None, "coordinates must be an object with lat and lng"
+    lat, lng = coords.get('lat'), coords.get('lng')
+    if lat is None or lng is None:
+        return None, None, None
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None, None, "coordinates lat and lng must be numbers"
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None, None, "Coordinates out of range"
+    return lat, lng, None
+
+# --- API ENDPOINT 1: THE AI BRAIN ---
+@app.route('/api/query', methods=['POST'])
+@require_auth
+def handle_query():
+    data = request.get_json()
+    user_query = data.get('query')
+    user_location = data.get('location', "Unknown Location")
+    lat, lng, error = parse_query_coordinates(data)
+
+    if not user_query:
+        return jsonify({"error": "Query is required"}), 400
+    if error:
+        return jsonify({"error": error}), 400
     if model is None:
         return jsonify({"error": "GEMINI_API_KEY missing. Add it to a .env file and restart the backend."}), 500
 
+    # Weather is in flight while the rest of the request is prepared; the
+    # prompt only waits WEATHER_WAIT_S for it before going out without it.
+    weather_future = None
+    if lat is not None and lng is not None:
+        weather_future = upstream_pool.submit(get_live_weather, lat, lng)
+    live_weather = wait_for_weather(weather_future)
+    cache_key = answer_cache.key(user_query, lat, lng, user_location, live_weather)
+    cached = answer_cache.get(cache_key)
+    if cached is not None:
+        return jsonify({**cached, "weather": live_weather, "partial": False, "cached": True})
+    prompt = build_query_prompt(user_query, user_location, live_weather)
+
     try:
-        response = model.generate_content(prompt)
+        started = time.perf_counter()
+        with track_call("gemini"):
+            response = model.generate_content(prompt)
+        model_s = time.perf_counter() - started
         raw_answer = response.text or ""
-        poi_candidates = []
-        answer_text = raw_answer
-        if "POI_CANDIDATES:" in raw_answer:
-            answer_text, poi_blob = raw_answer.split("POI_CANDIDATES:", 1)
-            first_line = poi_blob.strip().splitlines()[0]
-            if first_line.strip().lower() != "none":
-                entries = [entry.strip() for entry in first_line.split(";") if entry.strip()]
-                for entry in entries:
-                    if "|" in entry:
-                        name, note = entry.split("|", 1)
-                    else:
-                        name, note = entry, "-"
-                    poi_candidates.append({"name": name.strip(), "note": note.strip()})
-        locations = []
-        for candidate in poi_candidates:
-            geo = geocode_place(candidate["name"], lat, lng)
-            if geo:
-                geo["note"] = None if candidate["note"] == "-" else candidate["note"]
-                locations.append(geo)
+        answer_text, poi_candidates = parse_poi_candidates(raw_answer)
+        locations, partial = geocode_candidates(poi_candidates, lat, lng)
+        if not partial:
+            answer_cache.set(cache_key, answer_text.strip(), locations, model_s)
         return jsonify({
             "answer_text": answer_text.strip(),
             "locations": locations,
-            "weather": live_weather
+            "weather": live_weather,
+            "partial": partial,
+            "cached": False,
         })
     except Exception as e:
         print(f"AI Error: {e}")
+        fallback("ai_error")
         if live_weather:
-            fallback = (
-                f"Live weather for {user_location}:\n"
-                f"- Condition: {live_weather.get('description', 'N/A')}\n"
-                f"- Temperature: {live_weather.get('temperature_c', 'N/A')}°C\n"
-                f"- Humidity: {live_weather.get('humidity_pct', 'N/A')}%\n"
-                f"- Wind: {live_weather.get('wind_kmh', 'N/A')} km/h\n\n"
-                "AI insights are temporarily unavailable (service limit reached). "
-                "Please try again in a moment."
-            )
             return jsonify({
-                "answer_text": fallback,
+                "answer_text": weather_fallback_answer(user_location, live_weather),
                 "locations": [],
                 "weather": live_weather,
                 "error": str(e)
             }), 503
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/query/stream', methods=['POST'])
+@require_auth
+def handle_query_stream():
+    """
+    Streaming variant of /api/query as server-sent events:
+      weather  - the live observation (or null), once known
+      token    - {"text": ...} markdown as the model produces it
+      location - {"index": i, "location": {...}} per geocoded POI candidate
+      done     - {"answer_text", "locations", "weather", "partial", "cached"}
+      error    - {"error": ...} if the model call fails
+    """
+    data = request.get_json() or {}
+    user_query = data.get('query')
+    user_location = data.get('location', "Unknown Location")
+    lat, lng, error = parse_query_coordinates(data)
+
+    if not user_query:
+        return jsonify({"error": "Query is required"}), 400
+    if error:
+        return jsonify({"error": error}), 400
+    if model is None:
+        return jsonify({"error": "GEMINI_API_KEY missing. Add it to a .env file and restart the backend."}), 500
+
+    weather_future = None
+    if lat is not None and lng is not None:
+        weather_future = upstream_pool.submit(get_live_weather, lat, lng)
+
+    def events():
+        # An SSE comment flushes headers right away, before any upstream wait.
+        yield ": stream open\n\n"
+        live_weather = wait_for_weather(weather_future)
+        yield sse_event("weather", live_weather)
+        cache_key = answer_cache.key(user_query, lat, lng, user_location, live_weather)
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            yield sse_event("token", {"text": cached["answer_text"]})
+            for index, geo in enumerate(cached["locations"]):
+                yield sse_event("location", {"index": index, "location": geo})
+            yield sse_event("done", {**cached, "weather": live_weather, "partial": False, "cached": True})
+            return
+        splitter = AnswerStreamSplitter()
+        candidates = []
+        futures = {}
+        sent = []
+
+        def start_geocoding(new_candidates):
+            for candidate in new_candidates:
+                index = len(candidates)
+                candidates.append(candidate)
+                futures[upstream_pool.submit(geocode_place, candidate["name"], lat, lng)] = index
+
+        def resolved(done):
+            for future in done:
+                index = futures.pop(future)
+                geo = future.result() if future.exception() is None else None
+                if geo:
+                    note = candidates[index]["note"]
+                    geo["note"] = None if note == "-" else note
+                    sent.append((index, geo))
+                    yield sse_event("location", {"index": index, "location": geo})
+
+        try:
+            started = time.perf_counter()
+            with track_call("gemini"):
+                for chunk in model.generate_content(
+                    build_query_prompt(user_query, user_location, live_weather), stream=True
+                ):
+                    delta, new_candidates = splitter.feed(chunk.text or "")
+                    if delta:
+                        yield sse_event("token", {"text": delta})
+                    start_geocoding(new_candidates)
+                    yield from resolved([f for f in list(futures) if f.done()])
+            delta, new_candidates = splitter.finish()
+            model_s = time.perf_counter() - started
+            if delta:
+                yield sse_event("token", {"text": delta})
+            start_geocoding(new_candidates)
+        except Exception as e:
+            print(f"AI Error: {e}")
+            fallback("ai_error")
+            yield sse_event("error", {"error": str(e), "weather": live_weather})
+            return
+
+        deadline = time.monotonic() + GEOCODE_DEADLINE_S
+        while futures:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, _ = wait(list(futures), timeout=remaining, return_when=FIRST_COMPLETED)
+            yield from resolved(done)
+        for future in futures:
+            future.cancel()
+        locations = [geo for _, geo in sorted(sent, key=lambda item: item[0])]
+        if not futures:
+            answer_cache.set(cache_key, splitter.answer.strip(), locations, model_s)
+        yield sse_event("done", {
+            "answer_text": splitter.answer.strip(),
+            "locations": locations,
+            "weather": live_weather,
+            "partial": bool(futures),
+            "cached": False,
+        })
+
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # --- API ENDPOINT 2: THE SAFETY SCORE ---
 @app.route('/api/safety', methods=['POST'])
 @require_auth
@@ -619,6 +1245,124 @@ def handle_safety():
     return jsonify(result)
 
 
+@app.route('/api/safety/batch', methods=['POST'])
+@require_auth
+def handle_safety_batch():
+    """
+    Safety for up to SAFETY_BATCH_MAX points: {"points": [{"lat", "lng", "id"?}]}.
+    Results come back in request order; invalid points get an "error" entry.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get("points")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "points must be a non-empty list"}), 400
+    if len(items) > SAFETY_BATCH_MAX:
+        return jsonify({"error": f"At most {SAFETY_BATCH_MAX} points per request"}), 400
+
+    results = [None] * len(items)
+    points = []
+    slots = {}
+    for i, item in enumerate(items):
+        try:
+            point = (float(item["lat"]), float(item["lng"]))
+        except (TypeError, KeyError, ValueError):
+            results[i] = {"error": "lat and lng are required"}
+            continue
+        if not (-90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+            results[i] = {"error": "Coordinates out of range"}
+            continue
+        if point not in slots:
+            slots[point] = len(points)
+            points.append(point)
+        results[i] = slots[point]
+
+    scores = get_safety_scores(points)
+    for i, item in enumerate(items):
+        if isinstance(results[i], int):
+            lat, lng = points[results[i]]
+            results[i] = {"lat": lat, "lng": lng, **scores[results[i]]}
+        if isinstance(item, dict) and "id" in item:
+            results[i] = {"id": item["id"], **results[i]}
+    return jsonify({"results": results})
+
+
+@app.route('/api/safety/heatmap', methods=['GET'])
+@require_auth
+def handle_safety_heatmap():
+    """
+    Precomputed safety raster tiles for a viewport.
+    Query: south, west, north, east, optional layer=area|segment.
+    """
+    try:
+        south, west, north, east = (
+            float(request.args[key]) for key in ("south", "west", "north", "east")
+        )
+    except (KeyError, ValueError):
+        return jsonify({"error": "south, west, north and east are required"}), 400
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        return jsonify({"error": "Viewport bounds out of range"}), 400
+    layer = request.args.get("layer", "area")
+    if layer not in HEATMAP_LAYERS:
+        return jsonify({"error": f"layer must be one of {', '.join(HEATMAP_LAYERS)}"}), 400
+    try:
+        tiles = safety_heatmap.viewport(south, west, north, east, layer)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"layer": layer, "encoding": "base64-uint8", "tiles": tiles})
+
+
+CACHES = {
+    "safety": safety_cache,
+    "routes": route_cache,
+    "geocode": geocode_cache,
+    "weather": weather_cache,
+    "overpass_tiles": overpass_tile_cache,
+    "vibe": vibe_cache,
+    "answers": answer_cache,
+}
+
+
+@app.route('/api/cache/stats', methods=['GET'])
+@require_auth
+def cache_stats():
+    return jsonify({name: cache.stats() for name, cache in CACHES.items()})
+
+
+def collect_cache_metrics():
+    """Cache counters and hit ratios, read from each cache's stats() at scrape time."""
+    stats = {name: cache.stats() for name, cache in CACHES.items()}
+    families = []
+    for field, kind in (("hits", "counter"), ("stale_hits", "counter"), ("negative_hits", "counter"),
+                        ("misses", "counter"), ("coalesced", "counter"), ("evictions", "counter")):
+        samples = [((name,), values[field]) for name, values in stats.items() if field in values]
+        families.append((f"cache_{field}_total", kind, f"Cache {field.replace('_', ' ')}.", ("cache",), samples))
+    entries = []
+    for name, values in stats.items():
+        count = values.get("entries", 0)
+        entries.append(((name,), sum(count.values()) if isinstance(count, dict) else count))
+    families.append(("cache_entries", "gauge", "Entries currently cached.", ("cache",), entries))
+    families.append(("cache_hit_ratio", "gauge", "Hits over lookups since start.", ("cache",),
+                     [((name,), values.get("hit_ratio", 0.0)) for name, values in stats.items()]))
+    return families
+
+
+REGISTRY.add_collector(collect_cache_metrics)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition; needs "Bearer METRICS_TOKEN" when that is set."""
+    if METRICS_TOKEN and request.headers.get("Authorization", "") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/api/upstreams', methods=['GET'])
+@require_auth
+def upstream_stats():
+    return jsonify({name: client.stats() for name, client in UPSTREAMS.items()})
+
+
 @app.route('/api/vibe', methods=['GET'])
 @require_auth
 def handle_vibe():
@@ -626,54 +1370,176 @@ def handle_vibe():
     place_name = request.args.get("name") or place_id
     if not place_name:
         return jsonify({"error": "placeId or name is required"}), 400
-    cache_key = (place_id or place_name).lower()
+    sync_vibes()
+    payload = lookup_vibe(place_id, place_name)
+    if payload is None:
+        return jsonify({"error": "No review samples available for this place."}), 404
+    return jsonify({"place": place_name, **payload})
+
+
+def lookup_vibe(place_id, place_name):
+    """The cached or freshly summarized vibe for a place, else None."""
+    cache_key = place_key(place_id or place_name)
     cached = vibe_cache.get(cache_key)
-    now = time.time()
-    if cached and cached["expires_at"] > now:
-        return jsonify(cached["payload"])
+    # Appended reviews bump the place's updated_at, which retires the entry.
+    if cached is not None and cached["refreshed_at"] == vibe_index.get(cached["matched"])["updated_at"]:
+        return cached
+    key = find_review_place(place_name)
+    summary = vibe_index.summary(key) if key else None
+    if not summary:
+        return None
+    payload = {"label": classify_vibe(summary["score"]), **summary, "matched": key}
+    vibe_cache.set(cache_key, payload)
+    return payload
 
-    reviews = fetch_sample_reviews(place_name)
-    if not reviews:
-        return jsonify({"error": "No review samples available for this place."}), 404
 
-    compounds = [
-        sentiment_analyzer.polarity_scores(text)["compound"] for text in reviews
-    ]
-    avg = sum(compounds) / len(compounds)
-    positive_pct = int(
-        (sum(1 for score in compounds if score >= 0.05) / len(compounds)) * 100
-    )
-    vibe_label = classify_vibe(avg)
-    payload = {
-        "place": place_name,
-        "score": round(avg, 3),
-        "label": vibe_label,
-        "positive_pct": positive_pct,
-        "snippets": reviews[:5],
-        "sample_size": len(reviews),
-        "refreshed_at": now,
-    }
-    vibe_cache[cache_key] = {"payload": payload, "expires_at": now + VIBE_CACHE_SECONDS}
-    return jsonify(payload)
+@app.route('/api/vibe/batch', methods=['POST'])
+@require_auth
+def handle_vibe_batch():
+    """
+    Vibes for up to VIBE_BATCH_MAX places: {"places": ["name" | {"name", "placeId"}]}.
+    Results come back in request order; places without reviews get an "error" entry.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get("places")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "places must be a non-empty list"}), 400
+    if len(items) > VIBE_BATCH_MAX:
+        return jsonify({"error": f"At most {VIBE_BATCH_MAX} places per request"}), 400
+
+    sync_vibes()
+    seen = {}
+    results = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"name": item}
+        if not isinstance(item, dict):
+            results.append({"error": "Each place must be a name or an object"})
+            continue
+        place_id = item.get("placeId")
+        place_name = item.get("name") or place_id
+        if not isinstance(place_name, str) or not place_name.strip():
+            results.append({"error": "placeId or name is required"})
+            continue
+        key = (place_id, place_key(place_name))
+        if key not in seen:
+            seen[key] = lookup_vibe(place_id, place_name)
+        payload = seen[key]
+        if payload is None:
+            results.append({"place": place_name, "error": "No review samples available for this place."})
+        else:
+            results.append({"place": place_name, **payload})
+    return jsonify({"results": results})
+
+
+@app.route('/api/vibe/reviews', methods=['POST'])
+@require_auth
+def append_reviews():
+    """Adds reviews for a place ({"name", "reviews": [text]}); its vibe updates right away."""
+    data = request.get_json(silent=True) or {}
+    name = (data.get("name") or data.get("placeId") or "").strip()
+    reviews = data.get("reviews")
+    if not name or not isinstance(reviews, list) or not reviews:
+        return jsonify({"error": "name and a non-empty reviews list are required"}), 400
+    if len(reviews) > VIBE_APPEND_MAX_REVIEWS:
+        return jsonify({"error": f"At most {VIBE_APPEND_MAX_REVIEWS} reviews per request"}), 400
+    texts = [text.strip() for text in reviews if isinstance(text, str) and text.strip()]
+    if len(texts) != len(reviews) or any(len(text) > VIBE_REVIEW_MAX_CHARS for text in texts):
+        return jsonify({"error": f"Reviews must be non-empty strings of at most {VIBE_REVIEW_MAX_CHARS} characters"}), 400
+    try:
+        key = vibe_index.append(name, texts)
+        place_names.add(key)
+    except OSError as e:
+        print(f"Review append error: {e}")
+        return jsonify({"error": "Could not store reviews"}), 500
+    summary = vibe_index.summary(key)
+    return jsonify({"place": key, "label": classify_vibe(summary["score"]), **summary})
 
 
 @app.route('/api/gems', methods=['GET'])
 @require_auth
 def list_gems():
+    """
+    The gem catalog plus the caller's progress. Pass limit / offset to page
+    through large catalogs; without them every gem is returned.
+    """
+    catalog = current_gems()
+    gems = catalog.gems
+    payload = {}
+    if "limit" in request.args or "offset" in request.args:
+        try:
+            limit, offset = parse_page_args(request.args)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        gems = gems[offset:offset + limit]
+        payload["total"] = len(catalog)
     profile = get_user_progress(g.current_user["id"])
     unlocked = profile.get("unlocked", [])
     badges = profile.get("badges", [])
     return jsonify({
-        "gems": hidden_gems,
+        "gems": gems,
         "unlocked": unlocked,
         "badges": badges,
+        **payload,
     })
 
 
+def parse_page_args(args, default_limit=20):
+    """(limit, offset) from query args; limit is capped at GEMS_PAGE_MAX."""
+    try:
+        limit = int(args.get("limit", default_limit))
+        offset = int(args.get("offset", 0))
+    except ValueError:
+        raise ValueError("limit and offset must be integers")
+    if limit < 1 or offset < 0:
+        raise ValueError("limit must be positive and offset non-negative")
+    return min(limit, GEMS_PAGE_MAX), offset
+
+
+@app.route('/api/gems/nearby', methods=['GET'])
+@require_auth
+def nearby_gems():
+    """
+    Gems nearest to ?lat=&lng=, closest first, with distance_m. Optional
+    radius_m limits the search (capped at GEMS_NEARBY_MAX_RADIUS_M);
+    limit / offset page through the results.
+    """
+    try:
+        lat = float(request.args["lat"])
+        lng = float(request.args["lng"])
+        radius_m = request.args.get("radius_m")
+        radius_m = float(radius_m) if radius_m is not None else None
+        limit, offset = parse_page_args(request.args)
+    except KeyError:
+        return jsonify({"error": "lat and lng are required"}), 400
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({"error": "Coordinates out of range"}), 400
+    if radius_m is not None:
+        if not 0 < radius_m < math.inf:
+            return jsonify({"error": "radius_m must be a positive number"}), 400
+        radius_m = min(radius_m, GEMS_NEARBY_MAX_RADIUS_M)
+    gems, total = current_gems().nearby(lat, lng, limit=limit, offset=offset, radius_m=radius_m)
+    next_offset = offset + len(gems) if offset + len(gems) < total else None
+    return jsonify({"gems": gems, "total": total, "nextOffset": next_offset})
+
+
 @app.route('/api/gems/leaderboard', methods=['GET'])
 @require_auth
 def gems_leaderboard():
-    return jsonify({"leaderboard": compute_leaderboard()})
+    """
+    Top explorers. Query: limit (default 5, max 50), and optionally city
+    (a gem region) or window ("week" / "month") for the current period.
+    """
+    window = request.args.get("window")
+    if window is not None and window not in LEADERBOARD_WINDOWS:
+        return jsonify({"error": f"window must be one of {sorted(LEADERBOARD_WINDOWS)}"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 5)), 1), 50)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    return jsonify({"leaderboard": compute_leaderboard(limit, request.args.get("city"), window)})
 
 
 @app.route('/api/gems/unlock', methods=['POST'])
@@ -681,30 +1547,21 @@ def gems_leaderboard():
 def unlock_gem():
     data = request.get_json() or {}
     coords = data.get("coords") or {}
-    lat = coords.get("lat")
-    lng = coords.get("lng")
-    if lat is None or lng is None:
-        return jsonify({"error": "coords.lat and coords.lng are required"}), 400
-
-    candidate = None
-    for gem in hidden_gems:
-        radius = gem.get("radius_m", 20)
-        distance = haversine_distance_m(lat, lng, gem["lat"], gem["lng"])
-        if distance <= radius:
-            candidate = gem
-            break
-
+    try:
+        lat = float(coords["lat"])
+        lng = float(coords["lng"])
+    except (TypeError, KeyError, ValueError):
+        return jsonify({"error": "coords.lat and coords.lng are required and must be numbers"}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({"error": "Coordinates out of range"}), 400
+
+    candidate = current_gems().unlockable_at(lat, lng)
     if not candidate:
         return jsonify({"error": "No hidden gem nearby"}), 404
 
-    profile = get_user_progress(g.current_user["id"])
-    already = candidate["id"] in profile.get("unlocked", [])
-    if not already:
-        profile["unlocked"].append(candidate["id"])
-        badge = candidate.get("badge")
-        if badge and badge not in profile.get("badges", []):
-            profile["badges"].append(badge)
-        save_progress_data()
+    user_id = g.current_user["id"]
+    already = not storage.unlock_gem(user_id, candidate["id"], candidate.get("badge"))
+    profile = get_user_progress(user_id)
     leaderboard = compute_leaderboard()
     return jsonify({
         "unlocked": not already,
@@ -720,46 +1577,182 @@ def unlock_gem():
 @require_auth
 def handle_routes():
     """
-    Computes a 'fast' walking route plus a safety analysis overlay.
+    Computes a 'fast' and a safety-weighted walking route plus a safety
+    analysis overlay of the fast route. Uses the local walking graph when it
+    covers both ends, else OpenRouteService for the fast route only.
     Body:
     {
       "origin": {"lat": ..., "lng": ...},
       "destination": {"lat": ..., "lng": ...}
     }
+    Query (optional): format=polyline for encoded, deduplicated geometry,
+    with zoom to simplify it for that map zoom and precision (5 or 6).
     """
-    data = request.get_json() or {}
+    encoding, error = parse_route_format(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    origin, dest, error = parse_route_request(request.get_json() or {})
+    if error:
+        return jsonify({"error": error}), 400
+
+    cache_key, flipped = route_cache_key(origin, dest)
+    cached = route_cache.get(cache_key)
+    if cached is not None:
+        return jsonify(format_route_payload(reverse_route_payload(cached) if flipped else cached, encoding))
+
+    try:
+        payload = compute_routes(origin, dest)
+    except Exception as e:
+        print(f"Route engine error: {e}")
+        fallback("route_engine_error")
+        return jsonify({"error": str(e)}), 500
+
+    store_route_payload(cache_key, flipped, payload)
+    return jsonify(format_route_payload(payload, encoding))
+
+
+def parse_route_request(data):
+    """(origin, destination, error) from a /api/routes body."""
     origin = data.get("origin") or {}
     dest = data.get("destination") or {}
+    if not isinstance(origin, dict) or not isinstance(dest, dict):
+        return None, None, "origin and destination must be objects with lat and lng"
     if origin.get("lat") is None or origin.get("lng") is None:
-        return jsonify({"error": "origin.lat and origin.lng are required"}), 400
+        return None, None, "origin.lat and origin.lng are required"
     if dest.get("lat") is None or dest.get("lng") is None:
-        return jsonify({"error": "destination.lat and destination.lng are required"}), 400
+        return None, None, "destination.lat and destination.lng are required"
+    try:
+        origin = {"lat": float(origin["lat"]), "lng": float(origin["lng"])}
+        dest = {"lat": float(dest["lat"]), "lng": float(dest["lng"])}
+    except (TypeError, ValueError):
+        return None, None, "origin and destination lat/lng must be numbers"
+    for point in (origin, dest):
+        if not (-90 <= point["lat"] <= 90 and -180 <= point["lng"] <= 180):
+            return None, None, "Coordinates out of range"
+    return origin, dest, None
 
+
+def parse_route_format(args):
+    """
+    (encoding, error) from the /api/routes query args; encoding is None for
+    the full format, else {"zoom": float or None, "precision": int}.
+    """
+    route_format = args.get("format", "full")
+    if route_format not in ROUTE_FORMATS:
+        return None, f"format must be one of {sorted(ROUTE_FORMATS)}"
+    if route_format == "full":
+        return None, None
     try:
-        fast_route = fetch_fast_route(
-            {"lat": float(origin["lat"]), "lng": float(origin["lng"])},
-            {"lat": float(dest["lat"]), "lng": float(dest["lng"])},
-        )
-    except Exception as e:
-        print(f"Route engine error: {e}")
-        return jsonify({"error": str(e)}), 500
+        zoom = args.get("zoom")
+        zoom = float(zoom) if zoom is not None else None
+        precision = int(args.get("precision", 5))
+    except ValueError:
+        return None, "zoom and precision must be numbers"
+    if precision not in ROUTE_POLYLINE_PRECISIONS:
+        return None, f"precision must be one of {sorted(ROUTE_POLYLINE_PRECISIONS)}"
+    return {"zoom": zoom, "precision": precision}, None
 
-    safety = analyze_route_safety(fast_route["coordinates"])
 
-    # For now, safeRoute shares geometry with fastRoute but the frontend
-    # will color each segment green/yellow/red based on safety.segments.
-    return jsonify(
+def format_route_payload(payload, encoding):
+    return payload if encoding is None else compact_route_payload(payload, **encoding)
+
+
+def route_vertices(coords, zoom, keep_indices=()):
+    """Indices of the coords to send: all of them, or those that matter at zoom."""
+    if zoom is None or len(coords) < 3:
+        return np.arange(len(coords))
+    mid_lat = coords[len(coords) // 2][1]
+    return simplify_route(coords, tolerance_for_zoom(zoom, mid_lat), keep_indices)
+
+
+def compact_route_payload(payload, zoom=None, precision=5):
+    """
+    The /api/routes payload with each route's coordinates replaced by an
+    encoded polyline, simplified for zoom when given. Segment boundaries are
+    always kept and safety.segments indices point into the simplified
+    fastRoute. A safeRoute on the same path as fastRoute gets
+    "sameGeometryAs": "fastRoute" instead of a second copy.
+    """
+    fast, safe, safety = payload["fastRoute"], payload["safeRoute"], payload["safety"]
+    segments = safety.get("segments", [])
+    bounds = {i for seg in segments for i in (seg["start_index"], seg["end_index"])}
+    kept = route_vertices(fast["coordinates"], zoom, bounds)
+
+    def encoded(route, indices):
+        coords = route["coordinates"]
+        meta = {key: value for key, value in route.items() if key != "coordinates"}
+        return {**meta, "polyline": encode_polyline([coords[i] for i in indices], precision), "points": len(indices)}
+
+    if safe["coordinates"] is fast["coordinates"] or safe["coordinates"] == fast["coordinates"]:
+        safe_out = {key: value for key, value in safe.items() if key != "coordinates"}
+        safe_out["sameGeometryAs"] = "fastRoute"
+    else:
+        safe_out = encoded(safe, route_vertices(safe["coordinates"], zoom))
+    remapped = [
         {
-            "fastRoute": fast_route,
-            "safeRoute": {
-                "coordinates": fast_route["coordinates"],
-                "distance_m": fast_route["distance_m"],
-                "duration_s": fast_route["duration_s"],
-                "safety_score": safety["route_score"],
-            },
-            "safety": safety,
+            **seg,
+            "start_index": int(np.searchsorted(kept, seg["start_index"])),
+            "end_index": int(np.searchsorted(kept, seg["end_index"])),
         }
-    )
+        for seg in segments
+    ]
+    return {
+        **payload,
+        "fastRoute": encoded(fast, kept),
+        "safeRoute": safe_out,
+        "safety": {**safety, "segments": remapped},
+        "encoding": {"format": "polyline", "precision": precision, "zoom": zoom},
+    }
+
+
+def store_route_payload(cache_key, flipped, payload):
+    """Caches a computed payload under its key unless either route was scored from partial or missing data."""
+    sources = (payload["safety"].get("source"), payload["safeRoute"].get("safety_source"))
+    if not any(source in (SOURCE_PARTIAL, SOURCE_UNAVAILABLE) for source in sources):
+        route_cache.set(cache_key, reverse_route_payload(payload) if flipped else payload)
+
+
+def compute_routes(origin, dest):
+    local = compute_local_routes(origin, dest)
+    if local:
+        fast_route, safe_route = local
+        safety = analyze_route_safety(fast_route["coordinates"])
+        safe_safety = analyze_route_safety(safe_route["coordinates"])
+        return local_routes_payload(fast_route, safe_route, safety, safe_safety)
+
+    fast_route = fetch_fast_route(origin, dest)
+    safety = analyze_route_safety(fast_route["coordinates"])
+    return ors_routes_payload(fast_route, safety)
+
+
+def local_routes_payload(fast_route, safe_route, safety, safe_safety):
+    return {
+        "fastRoute": fast_route,
+        "safeRoute": {
+            **safe_route,
+            "safety_score": safe_safety["route_score"],
+            "safety_source": safe_safety.get("source"),
+        },
+        "safety": safety,
+        "engine": "local",
+    }
+
+
+def ors_routes_payload(fast_route, safety):
+    # Without a local walking graph there is no safety-weighted alternative,
+    # so safeRoute shares geometry with fastRoute and the frontend colors
+    # each segment green/yellow/red based on safety.segments.
+    return {
+        "fastRoute": fast_route,
+        "safeRoute": {
+            "coordinates": fast_route["coordinates"],
+            "distance_m": fast_route["distance_m"],
+            "duration_s": fast_route["duration_s"],
+            "safety_score": safety["route_score"],
+        },
+        "safety": safety,
+        "engine": "ors",
+    }
 
 # --- RUN THE SERVER ---
 if __name__ == '__main__':
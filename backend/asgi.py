@@ -0,0 +1,345 @@
+"""
+Asyncio serving mode.
+
+    uvicorn asgi:app --port 5000
+
+/api/routes and /api/query spend nearly all their time waiting on ORS,
+Overpass, Photon, open-meteo and Gemini. Here they are served natively on
+the event loop with the same JSON contracts as the Flask views, so a
+waiting request costs a coroutine instead of a worker thread. Each native
+request is cut off with a 504 after ASYNC_REQUEST_TIMEOUT_S. Every other
+path goes to the Flask app unchanged, on a2wsgi's thread pool.
+
+Caches, the geocode store, sessions and the circuit breakers are the
+Flask module's own objects, so both modes share them in one process.
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import app as backend
+from metrics import fallback
+from upstream import AsyncUpstream, track_call
+
+ASYNC_REQUEST_TIMEOUT_S = float(os.getenv("ASYNC_REQUEST_TIMEOUT_S", "30"))
+ASYNC_MAX_CONNECTIONS = int(os.getenv("ASYNC_MAX_CONNECTIONS", "1000"))
+WSGI_WORKERS = int(os.getenv("WSGI_WORKERS", "32"))
+
+UPSTREAMS = {
+    name: AsyncUpstream(upstream, max_connections=ASYNC_MAX_CONNECTIONS)
+    for name, upstream in backend.UPSTREAMS.items()
+}
+_inflight = {}
+# Background refresh tasks, referenced until done so they are not collected.
+_refreshes = set()
+
+
+async def single_flight(cache, key, compute):
+    """
+    Async counterpart of TTLCache.get_or_compute: a miss starts one task
+    per key that stores its result, and concurrent callers await that task.
+    Stale entries and entries due for refresh-ahead are served at once while
+    one background task recomputes them, as the Flask path does in a thread.
+    """
+    value, refresh = cache.lookup(key)
+    if value is not None:
+        if refresh:
+            task = asyncio.ensure_future(refresh_entry(cache, key, compute))
+            _refreshes.add(task)
+            task.add_done_callback(_refreshes.discard)
+        return value
+    flight_key = (id(cache), key)
+    task = _inflight.get(flight_key)
+    if task is None:
+        async def run():
+            try:
+                result = await compute()
+                cache.set(key, result)
+                return result
+            finally:
+                _inflight.pop(flight_key, None)
+
+        task = asyncio.ensure_future(run())
+        _inflight[flight_key] = task
+    # A caller hitting its deadline must not cancel the shared fetch.
+    return await asyncio.shield(task)
+
+
+async def refresh_entry(cache, key, compute):
+    result = None
+    try:
+        result = await compute()
+    except Exception as exc:
+        print(f"Cache refresh failed for {key}: {exc}")
+    finally:
+        cache.finish_refresh(key, result)
+
+
+async def get_live_weather(lat, lng):
+    tile = backend.weather_tile(lat, lng)
+
+    async def fetch():
+        center_lat, center_lng = backend.weather_tile_center(tile)
+        resp = await UPSTREAMS["open_meteo"].get(
+            backend.WEATHER_ENDPOINT, params=backend.weather_params(center_lat, center_lng), timeout=8
+        )
+        resp.raise_for_status()
+        return backend.parse_live_weather(resp.json())
+
+    return await single_flight(backend.weather_cache, tile, fetch)
+
+
+async def wait_for_weather(task):
+    if task is None:
+        return None
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), backend.WEATHER_WAIT_S)
+    except asyncio.TimeoutError:
+        print(f"Weather fetch exceeded {backend.WEATHER_WAIT_S}s; answering without it.")
+        fallback("weather_timeout")
+    except Exception as e:
+        print(f"Weather fetch failed: {e}")
+        fallback("weather_failed")
+    return None
+
+
+async def geocode_place(name, lat=None, lng=None):
+    # The geocode cache and session store are SQLite; keep their I/O off the loop.
+    cached, place = await asyncio.to_thread(backend.geocode_cache.get, name, lat, lng)
+    if cached:
+        return place
+    try:
+        resp = await UPSTREAMS["photon"].get(
+            backend.GEOCODER_ENDPOINT, params=backend.geocode_params(name, lat, lng), timeout=8
+        )
+        resp.raise_for_status()
+        feature = (resp.json().get("features") or [None])[0]
+    except Exception as ge:
+        print(f"Geocoder failed for {name}: {ge}")
+        fallback("geocoder_failed")
+        return None
+    return await asyncio.to_thread(backend.store_geocode_result, name, lat, lng, feature)
+
+
+async def geocode_candidates(poi_candidates, lat, lng):
+    """Same contract as app.geocode_candidates: (locations, partial)."""
+    if not poi_candidates:
+        return [], False
+    deadline_s = backend.GEOCODE_DEADLINE_S
+    tasks = [
+        asyncio.ensure_future(geocode_place(candidate["name"], lat, lng))
+        for candidate in poi_candidates
+    ]
+    done, pending = await asyncio.wait(tasks, timeout=deadline_s)
+    for task in pending:
+        task.cancel()
+    if pending:
+        print(f"Geocoding: {len(pending)} of {len(tasks)} lookups missed the {deadline_s}s deadline.")
+        fallback("geocode_deadline")
+    locations = []
+    for candidate, task in zip(poi_candidates, tasks):
+        if task not in done or task.exception() is not None:
+            continue
+        geo = task.result()
+        if geo:
+            geo["note"] = None if candidate["note"] == "-" else candidate["note"]
+            locations.append(geo)
+    return locations, bool(pending)
+
+
+async def generate_content(prompt):
+    # The SDK's REST transport (used with GEMINI_ENDPOINT) has no async client.
+    if backend.GEMINI_ENDPOINT:
+        return await asyncio.to_thread(backend.model.generate_content, prompt)
+    return await backend.model.generate_content_async(prompt)
+
+
+async def analyze_route_safety(coords):
+    if len(coords) < 2:
+        return {"route_score": 0, "segments": []}
+    # Store reads touch mmapped tiles and build a GridIndex; run them in a thread.
+    result = await asyncio.to_thread(backend.store_route_safety, coords)
+    if result is not None:
+        return result
+    features, info = await backend.overpass_planner.features_along_async(
+        coords,
+        UPSTREAMS["overpass"],
+        max_batches=backend.OVERPASS_ROUTE_MAX_BATCHES,
+        deadline_s=backend.OVERPASS_ROUTE_DEADLINE_S,
+    )
+    return await asyncio.to_thread(backend.score_route_features, coords, features, info["source"])
+
+
+async def compute_routes(origin, dest):
+    local = None
+    if backend.walking_router is not None:
+        # A* is CPU work; keep it off the event loop.
+        local = await asyncio.to_thread(backend.compute_local_routes, origin, dest)
+    if local:
+        fast_route, safe_route = local
+        safety, safe_safety = await asyncio.gather(
+            analyze_route_safety(fast_route["coordinates"]),
+            analyze_route_safety(safe_route["coordinates"]),
+        )
+        return backend.local_routes_payload(fast_route, safe_route, safety, safe_safety)
+
+    resp = await UPSTREAMS["ors"].post(backend.ORS_ENDPOINT, **backend.ors_route_request(origin, dest))
+    resp.raise_for_status()
+    fast_route = backend.parse_ors_route(resp.json())
+    safety = await analyze_route_safety(fast_route["coordinates"])
+    return backend.ors_routes_payload(fast_route, safety)
+
+
+def native(handler):
+    """Auth check, the per-request deadline and request metrics for a native endpoint."""
+    async def endpoint(request):
+        started = time.perf_counter()
+        backend.HTTP_IN_FLIGHT.inc()
+        response = None
+        try:
+            response = await guarded(request)
+            return response
+        finally:
+            backend.HTTP_IN_FLIGHT.dec()
+            backend.HTTP_LATENCY.observe(
+                time.perf_counter() - started, route=request.url.path, method=request.method,
+                status=response.status_code if response is not None else 500,
+            )
+
+    async def guarded(request):
+        token = backend.token_from_header(request.headers.get("Authorization", ""))
+        user = await asyncio.to_thread(backend.user_for_token, token)
+        if not user:
+            return JSONResponse({"error": "Unauthorized"}, status_code=401)
+        try:
+            return await asyncio.wait_for(handler(request), ASYNC_REQUEST_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            return JSONResponse(
+                {"error": f"Request exceeded {ASYNC_REQUEST_TIMEOUT_S}s; upstream services are slow."},
+                status_code=504,
+            )
+
+    return endpoint
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+@native
+async def handle_routes(request):
+    encoding, error = backend.parse_route_format(request.query_params)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+    origin, dest, error = backend.parse_route_request(await read_json(request) or {})
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+
+    cache_key, flipped = backend.route_cache_key(origin, dest)
+    cached = backend.route_cache.get(cache_key)
+    if cached is not None:
+        payload = backend.reverse_route_payload(cached) if flipped else cached
+        return JSONResponse(backend.format_route_payload(payload, encoding))
+
+    try:
+        payload = await compute_routes(origin, dest)
+    except Exception as e:
+        print(f"Route engine error: {e}")
+        fallback("route_engine_error")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    backend.store_route_payload(cache_key, flipped, payload)
+    return JSONResponse(backend.format_route_payload(payload, encoding))
+
+
+@native
+async def handle_query(request):
+    data = await read_json(request) or {}
+    user_query = data.get('query')
+    user_location = data.get('location', "Unknown Location")
+    lat, lng, error = backend.parse_query_coordinates(data)
+
+    if not user_query:
+        return JSONResponse({"error": "Query is required"}, status_code=400)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+    if backend.model is None:
+        return JSONResponse(
+            {"error": "GEMINI_API_KEY missing. Add it to a .env file and restart the backend."},
+            status_code=500,
+        )
+
+    weather_task = None
+    if lat is not None and lng is not None:
+        weather_task = asyncio.ensure_future(get_live_weather(lat, lng))
+    live_weather = await wait_for_weather(weather_task)
+    cache_key = backend.answer_cache.key(user_query, lat, lng, user_location, live_weather)
+    cached = backend.answer_cache.get(cache_key)
+    if cached is not None:
+        return JSONResponse({**cached, "weather": live_weather, "partial": False, "cached": True})
+    prompt = backend.build_query_prompt(user_query, user_location, live_weather)
+
+    try:
+        started = time.perf_counter()
+        with track_call("gemini"):
+            response = await generate_content(prompt)
+        model_s = time.perf_counter() - started
+        raw_answer = response.text or ""
+        answer_text, poi_candidates = backend.parse_poi_candidates(raw_answer)
+        locations, partial = await geocode_candidates(poi_candidates, lat, lng)
+        if not partial:
+            backend.answer_cache.set(cache_key, answer_text.strip(), locations, model_s)
+        return JSONResponse({
+            "answer_text": answer_text.strip(),
+            "locations": locations,
+            "weather": live_weather,
+            "partial": partial,
+            "cached": False,
+        })
+    except Exception as e:
+        print(f"AI Error: {e}")
+        fallback("ai_error")
+        if live_weather:
+            return JSONResponse({
+                "answer_text": backend.weather_fallback_answer(user_location, live_weather),
+                "locations": [],
+                "weather": live_weather,
+                "error": str(e)
+            }, status_code=503)
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    yield
+    await asyncio.gather(*(client.aclose() for client in UPSTREAMS.values()))
+
+
+native_app = Starlette(
+    routes=[
+        Route("/api/routes", handle_routes, methods=["POST"]),
+        Route("/api/query", handle_query, methods=["POST"]),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
+NATIVE_PATHS = {"/api/routes", "/api/query"}
+flask_app = WSGIMiddleware(backend.app, workers=WSGI_WORKERS)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan" or scope.get("path") in NATIVE_PATHS:
+        await native_app(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
@@ -0,0 +1,217 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+
+class TTLCache:
+    """
+    Size-bounded LRU cache with per-entry TTL. Entries are bounded by count
+    and, when a weigher is given, by the total weight (e.g. bytes) of values.
+
+    Entries younger than ttl are served as hits. Entries past ttl but still
+    inside stale_ttl are served immediately while one background thread
+    recomputes them (stale-while-revalidate). Anything older is a miss.
+
+    get_or_compute coalesces concurrent misses for the same key into a single
+    compute call (single-flight). With refresh_ahead set (a fraction of ttl),
+    entries that have been hit at least refresh_min_hits times are refreshed
+    in the background once they pass that age, so popular keys never expire.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300.0, stale_ttl=0.0, clock=time.monotonic,
+                 max_weight=None, weigher=None, refresh_ahead=None, refresh_min_hits=3):
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self.weight = 0
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_ahead = refresh_ahead
+        self.refresh_min_hits = refresh_min_hits
+        self.clock = clock
+        # key -> [value, stored_at, weight, hits]
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self._refreshing = set()
+        self._inflight = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _lookup(self, key):
+        """
+        Returns (value, state) where state is 'fresh', 'due' (fresh, but a
+        popular entry due for refresh-ahead), 'stale' or None.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None, None
+        value, stored_at = entry[0], entry[1]
+        age = self.clock() - stored_at
+        if age <= self.ttl:
+            entry[3] += 1
+            state = "fresh"
+            if (
+                self.refresh_ahead is not None
+                and age >= self.ttl * self.refresh_ahead
+                and entry[3] >= self.refresh_min_hits
+            ):
+                state = "due"
+        elif age <= self.ttl + self.stale_ttl:
+            state = "stale"
+        else:
+            self._remove(key)
+            return None, None
+        self._data.move_to_end(key)
+        return value, state
+
+    def get(self, key, default=None):
+        with self._lock:
+            value, state = self._lookup(key)
+            if state in ("fresh", "due"):
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+        return entry
+
+    def set(self, key, value):
+        weight = self.weigher(value) if self.weigher else 0
+        if self.max_weight is not None and weight > self.max_weight:
+            return
+        with self._lock:
+            self._remove(key)
+            self._data[key] = [value, self.clock(), weight, 0]
+            self.weight += weight
+            while len(self._data) > self.max_entries or (
+                self.max_weight is not None and self.weight > self.max_weight
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._remove(key)
+        return entry[0] if entry else None
+
+    def _start_refresh(self, key, compute, should_cache):
+        # Caller holds self._lock.
+        if key not in self._refreshing:
+            self._refreshing.add(key)
+            Thread(target=self._refresh, args=(key, compute, should_cache), daemon=True).start()
+
+    def get_or_compute(self, key, compute, should_cache=None):
+        """
+        Returns the cached value for key, computing and storing it on a miss.
+        should_cache(value) can veto storing results such as fallbacks.
+        Callers that miss while another caller is computing the same key
+        wait for that result (or exception) instead of computing again.
+        """
+        with self._lock:
+            value, state = self._lookup(key)
+            if state in ("fresh", "due"):
+                self.hits += 1
+                if state == "due":
+                    self._start_refresh(key, compute, should_cache)
+                return value
+            if state == "stale":
+                self.stale_hits += 1
+                self._start_refresh(key, compute, should_cache)
+                return value
+            self.misses += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = Future()
+                self._inflight[key] = flight
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.result()
+
+        try:
+            value = compute()
+            if should_cache is None or should_cache(value):
+                self.set(key, value)
+            flight.set_result(value)
+            return value
+        except BaseException as exc:
+            flight.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def lookup(self, key):
+        """
+        (value, refresh) for callers that run compute themselves, such as
+        the async server. value is None on a miss. refresh is True when the
+        entry is stale or due for refresh-ahead and this caller should
+        recompute it in the background, then call finish_refresh; only one
+        caller at a time is told to.
+        """
+        with self._lock:
+            value, state = self._lookup(key)
+            if state is None:
+                self.misses += 1
+                return None, False
+            if state == "stale":
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            if state == "fresh" or key in self._refreshing:
+                return value, False
+            self._refreshing.add(key)
+            return value, True
+
+    def finish_refresh(self, key, value=None):
+        """Ends a refresh started through lookup, storing value unless it is None."""
+        if value is not None:
+            self.set(key, value)
+        with self._lock:
+            if value is not None:
+                self.refreshes += 1
+            self._refreshing.discard(key)
+
+    def _refresh(self, key, compute, should_cache):
+        try:
+            value = compute()
+            if should_cache is None or should_cache(value):
+                self.set(key, value)
+                with self._lock:
+                    self.refreshes += 1
+        except Exception as exc:
+            print(f"Cache refresh failed for {key}: {exc}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "weight": self.weight,
+                "max_weight": self.max_weight,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "refreshes": self.refreshes,
+                "evictions": self.evictions,
+                "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            }
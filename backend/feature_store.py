@@ -0,0 +1,321 @@
+"""
+Offline store of the OSM features the safety scorers look at: street lamps,
+police / hospital / pharmacy nodes and service / unclassified way centers.
+
+Features are partitioned into fixed lat/lng tiles. Each tile is one .npy
+file of fixed-point records that is opened memory-mapped, so lookups only
+touch the tiles they need. manifest.json lists every tile the store covers,
+including empty ones, so "no features here" and "not ingested" stay distinct.
+
+Build or extend a store from an extract:
+
+    python feature_store.py ingest belagavi.osm --out data/osm_store
+    python feature_store.py ingest dump.json --bbox 15.80,74.45,15.92,74.57
+    python feature_store.py info --out data/osm_store
+"""
+import argparse
+import json
+import math
+import re
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+
+from geo import radius_bbox, within_radius_mask
+
+KIND_LAMP = 0
+KIND_POLICE = 1
+KIND_HOSPITAL = 2
+KIND_PHARMACY = 3
+KIND_BAD_ROAD = 4
+
+AMENITY_KINDS = {"police": KIND_POLICE, "hospital": KIND_HOSPITAL, "pharmacy": KIND_PHARMACY}
+BAD_ROAD_PATTERN = re.compile("service|unclassified")
+
+RECORD_DTYPE = np.dtype([("lat_e7", "<i4"), ("lng_e7", "<i4"), ("kind", "u1")])
+FIXED_POINT = 1e7
+DEFAULT_TILE_DEG = 0.02
+MANIFEST_NAME = "manifest.json"
+TILE_EPSILON = 1e-9
+
+
+def classify_tags(element_type, tags):
+    """Maps an OSM element's tags to a feature kind, or None if it is not relevant."""
+    if element_type == "node":
+        if tags.get("highway") == "street_lamp":
+            return KIND_LAMP
+        return AMENITY_KINDS.get(tags.get("amenity"))
+    if element_type == "way" and BAD_ROAD_PATTERN.search(tags.get("highway") or ""):
+        return KIND_BAD_ROAD
+    return None
+
+
+def _bbox_center(points):
+    lats = [lat for lat, _ in points]
+    lngs = [lng for _, lng in points]
+    return (min(lats) + max(lats)) / 2, (min(lngs) + max(lngs)) / 2
+
+
+def parse_overpass_elements(elements):
+    """Yields (kind, lat, lng) from the elements of an Overpass `out center` response."""
+    for el in elements:
+        etype = el.get("type")
+        kind = classify_tags(etype, el.get("tags") or {})
+        if kind is None:
+            continue
+        if etype == "node":
+            lat, lng = el.get("lat"), el.get("lon")
+        else:
+            center = el.get("center") or {}
+            lat, lng = center.get("lat"), center.get("lon")
+        if lat is not None and lng is not None:
+            yield kind, float(lat), float(lng)
+
+
+def read_overpass_json(path):
+    """Yields (kind, lat, lng) from a saved Overpass `out center` JSON response."""
+    with Path(path).open("r", encoding="utf-8") as fh:
+        data = json.load(fh)
+    yield from parse_overpass_elements(data.get("elements", []))
+
+
+def read_osm_xml(path):
+    """
+    Yields (kind, lat, lng) from an .osm XML extract. Way centers are the
+    middle of the way's bounding box, matching Overpass `out center`.
+    Returns the file's <bounds> (south, west, north, east) via StopIteration.
+    """
+    node_coords = {}
+    bounds = None
+    for _, elem in ET.iterparse(str(path), events=("end",)):
+        if elem.tag == "bounds":
+            bounds = tuple(float(elem.get(k)) for k in ("minlat", "minlon", "maxlat", "maxlon"))
+        elif elem.tag == "node":
+            lat, lng = float(elem.get("lat")), float(elem.get("lon"))
+            node_coords[elem.get("id")] = (lat, lng)
+            tags = {t.get("k"): t.get("v") for t in elem.findall("tag")}
+            kind = classify_tags("node", tags)
+            if kind is not None:
+                yield kind, lat, lng
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in elem.findall("tag")}
+            if classify_tags("way", tags) is not None:
+                points = [node_coords[nd.get("ref")] for nd in elem.findall("nd") if nd.get("ref") in node_coords]
+                if points:
+                    yield (KIND_BAD_ROAD, *_bbox_center(points))
+            elem.clear()
+    return bounds
+
+
+def read_osm_pbf(path):
+    """Yields (kind, lat, lng) from an .osm.pbf extract. Needs the optional `osmium` package."""
+    try:
+        import osmium  # type: ignore
+    except ImportError as exc:
+        raise RuntimeError("Reading .pbf extracts needs `pip install osmium`.") from exc
+
+    found = []
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            kind = classify_tags("node", dict(n.tags))
+            if kind is not None and n.location.valid():
+                found.append((kind, n.location.lat, n.location.lon))
+
+        def way(self, w):
+            if classify_tags("way", dict(w.tags)) is None:
+                return
+            points = [(nd.lat, nd.lon) for nd in w.nodes if nd.location.valid()]
+            if points:
+                found.append((KIND_BAD_ROAD, *_bbox_center(points)))
+
+    Handler().apply_file(str(path), locations=True)
+    return iter(found)
+
+
+def read_extract(path):
+    """Returns (features, bounds) for any supported extract; bounds may be None."""
+    path = Path(path)
+    name = path.name.lower()
+    if name.endswith(".pbf"):
+        return list(read_osm_pbf(path)), None
+    if name.endswith(".json"):
+        return list(read_overpass_json(path)), None
+    features = []
+    reader = read_osm_xml(path)
+    while True:
+        try:
+            features.append(next(reader))
+        except StopIteration as stop:
+            return features, stop.value
+
+
+class FeatureStore:
+    def __init__(self, root, tile_deg=DEFAULT_TILE_DEG):
+        self.root = Path(root)
+        self.tile_deg = tile_deg
+        self.tiles = {}
+        self._open = {}
+        self._lock = Lock()
+        self.reload()
+
+    def reload(self):
+        manifest_path = self.root / MANIFEST_NAME
+        self.tiles = {}
+        self._open = {}
+        if not manifest_path.exists():
+            return
+        with manifest_path.open("r", encoding="utf-8") as fh:
+            manifest = json.load(fh)
+        self.tile_deg = manifest.get("tile_deg", self.tile_deg)
+        for key, count in manifest.get("tiles", {}).items():
+            ti, tj = (int(part) for part in key.split("_"))
+            self.tiles[(ti, tj)] = count
+
+    def __bool__(self):
+        return bool(self.tiles)
+
+    def tile_of(self, lat, lng):
+        # The epsilon keeps bounds like 15.80 on the tile they start, despite
+        # 15.80 / 0.02 landing a hair under 790 in floating point.
+        return (
+            int(math.floor(lat / self.tile_deg + TILE_EPSILON)),
+            int(math.floor(lng / self.tile_deg + TILE_EPSILON)),
+        )
+
+    def tiles_for_bbox(self, south, west, north, east):
+        ti0, tj0 = self.tile_of(south, west)
+        ti1, tj1 = self.tile_of(north, east)
+        return [(ti, tj) for ti in range(ti0, ti1 + 1) for tj in range(tj0, tj1 + 1)]
+
+    def covers(self, south, west, north, east):
+        """True when every tile touching the bbox has been ingested."""
+        if not self.tiles:
+            return False
+        return all(tile in self.tiles for tile in self.tiles_for_bbox(south, west, north, east))
+
+    def tile_path(self, tile):
+        return self.root / "tiles" / f"{tile[0]}_{tile[1]}.npy"
+
+    def _records(self, tile):
+        if not self.tiles.get(tile):
+            return None
+        with self._lock:
+            records = self._open.get(tile)
+            if records is None:
+                records = np.load(self.tile_path(tile), mmap_mode="r")
+                self._open[tile] = records
+        return records
+
+    def features_in_bbox(self, south, west, north, east, kinds):
+        """(n, 2) float array of (lat, lng) for features of the given kinds inside the bbox."""
+        chunks = []
+        lo_lat, hi_lat = math.floor(south * FIXED_POINT), math.ceil(north * FIXED_POINT)
+        lo_lng, hi_lng = math.floor(west * FIXED_POINT), math.ceil(east * FIXED_POINT)
+        kinds = np.array(sorted(kinds), dtype=np.uint8)
+        for tile in self.tiles_for_bbox(south, west, north, east):
+            records = self._records(tile)
+            if records is None:
+                continue
+            keep = (
+                np.isin(records["kind"], kinds)
+                & (records["lat_e7"] >= lo_lat) & (records["lat_e7"] <= hi_lat)
+                & (records["lng_e7"] >= lo_lng) & (records["lng_e7"] <= hi_lng)
+            )
+            hit = records[keep]
+            if len(hit):
+                chunks.append(np.stack([hit["lat_e7"], hit["lng_e7"]], axis=1) / FIXED_POINT)
+        if not chunks:
+            return np.empty((0, 2), dtype=np.float64)
+        return np.concatenate(chunks)
+
+    def count_near(self, lat, lng, radius_m, kinds):
+        points = self.features_in_bbox(*radius_bbox(lat, lng, radius_m), kinds)
+        if not len(points):
+            return 0
+        return int(within_radius_mask(lat, lng, points[:, 0], points[:, 1], radius_m).sum())
+
+    def ingest(self, features, bounds):
+        """
+        Writes the features into the store. Only tiles that lie completely
+        inside bounds are written and marked covered; partial edge tiles are
+        dropped so the store never claims coverage it does not have.
+        Returns (tiles_written, features_written).
+        """
+        south, west, north, east = bounds
+        covered = set()
+        slack = TILE_EPSILON * self.tile_deg
+        for ti, tj in self.tiles_for_bbox(south, west, north, east):
+            if (
+                ti * self.tile_deg >= south - slack and (ti + 1) * self.tile_deg <= north + slack
+                and tj * self.tile_deg >= west - slack and (tj + 1) * self.tile_deg <= east + slack
+            ):
+                covered.add((ti, tj))
+
+        by_tile = defaultdict(list)
+        for kind, lat, lng in features:
+            tile = self.tile_of(lat, lng)
+            if tile in covered:
+                by_tile[tile].append((int(round(lat * FIXED_POINT)), int(round(lng * FIXED_POINT)), kind))
+
+        (self.root / "tiles").mkdir(parents=True, exist_ok=True)
+        written = 0
+        for tile in covered:
+            rows = by_tile.get(tile, [])
+            path = self.tile_path(tile)
+            if rows:
+                records = np.array(sorted(rows), dtype=RECORD_DTYPE)
+                np.save(path, records)
+            elif path.exists():
+                path.unlink()
+            self.tiles[tile] = len(rows)
+            written += len(rows)
+
+        manifest = {
+            "tile_deg": self.tile_deg,
+            "tiles": {f"{ti}_{tj}": count for (ti, tj), count in sorted(self.tiles.items())},
+        }
+        with (self.root / MANIFEST_NAME).open("w", encoding="utf-8") as fh:
+            json.dump(manifest, fh, indent=2)
+        self._open = {}
+        return len(covered), written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the offline OSM safety feature store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest_cmd = sub.add_parser("ingest", help="Load an .osm / .osm.pbf / Overpass .json extract")
+    ingest_cmd.add_argument("extract")
+    ingest_cmd.add_argument("--out", default=str(Path(__file__).resolve().parent / "data" / "osm_store"))
+    ingest_cmd.add_argument("--bbox", help="south,west,north,east the extract fully covers")
+    ingest_cmd.add_argument("--tile-deg", type=float, default=DEFAULT_TILE_DEG)
+    info_cmd = sub.add_parser("info", help="Summarize an existing store")
+    info_cmd.add_argument("--out", default=str(Path(__file__).resolve().parent / "data" / "osm_store"))
+    args = parser.parse_args()
+
+    if args.command == "info":
+        store = FeatureStore(args.out)
+        print(f"{args.out}: {len(store.tiles)} tiles of {store.tile_deg}°, {sum(store.tiles.values())} features")
+        return
+
+    store = FeatureStore(args.out, tile_deg=args.tile_deg)
+    features, bounds = read_extract(args.extract)
+    if args.bbox:
+        bounds = tuple(float(v) for v in args.bbox.split(","))
+    if bounds is None:
+        if not features:
+            raise SystemExit("Extract has no relevant features and no bounds; pass --bbox.")
+        lats = [lat for _, lat, _ in features]
+        lngs = [lng for _, _, lng in features]
+        bounds = (min(lats), min(lngs), max(lats), max(lngs))
+        print("No bounds in extract; using the feature extent (pass --bbox to be explicit).")
+    tiles, count = store.ingest(features, bounds)
+    print(f"Wrote {count} of {len(features)} features into {tiles} tiles at {args.out}")
+
+
+if __name__ == "__main__":
+    main()
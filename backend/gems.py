@@ -0,0 +1,70 @@
+"""
+Hidden-gem catalog with a spatial index.
+
+Gems sit in a GridIndex sized to the largest unlock radius, so an unlock
+check only looks at gems in the cells around the user. Nearby queries
+widen their search ring until they have enough gems for the requested
+page.
+"""
+import numpy as np
+
+from geo import GridIndex, haversine_one_to_many
+
+DEFAULT_RADIUS_M = 20.0
+NEARBY_START_RADIUS_M = 500.0
+NEARBY_MAX_RADIUS_M = 50000.0
+
+
+class GemCatalog:
+    def __init__(self, gems):
+        self.gems = list(gems)
+        self.by_id = {gem["id"]: gem for gem in self.gems}
+        self.radii = np.array([gem.get("radius_m", DEFAULT_RADIUS_M) for gem in self.gems], dtype=np.float64)
+        self.max_radius_m = float(self.radii.max()) if len(self.radii) else DEFAULT_RADIUS_M
+        self.index = GridIndex(
+            [(gem["lat"], gem["lng"]) for gem in self.gems],
+            cell_size_m=max(self.max_radius_m, DEFAULT_RADIUS_M),
+        )
+
+    def __len__(self):
+        return len(self.gems)
+
+    def unlockable_at(self, lat, lng):
+        """
+        The gem whose unlock radius contains the point. When radii overlap
+        the closest gem wins, then the one with the tighter radius.
+        """
+        candidates = self.index.query_radius(lat, lng, self.max_radius_m)
+        if not len(candidates):
+            return None
+        dists = haversine_one_to_many(lat, lng, self.index.lats[candidates], self.index.lngs[candidates])
+        inside = dists <= self.radii[candidates]
+        if not inside.any():
+            return None
+        candidates, dists = candidates[inside], dists[inside]
+        best = np.lexsort((self.radii[candidates], dists))[0]
+        return self.gems[int(candidates[best])]
+
+    def nearby(self, lat, lng, limit=20, offset=0, radius_m=None):
+        """
+        (page, total) of gems ordered by distance, each with a distance_m.
+        With radius_m, only gems within it count; otherwise the search ring
+        doubles from NEARBY_START_RADIUS_M until it holds offset + limit
+        gems or reaches NEARBY_MAX_RADIUS_M, and total counts that ring.
+        """
+        if radius_m is None:
+            radius = NEARBY_START_RADIUS_M
+            while True:
+                hits = self.index.query_radius(lat, lng, radius)
+                if len(hits) >= offset + limit or radius >= NEARBY_MAX_RADIUS_M:
+                    break
+                radius = min(radius * 2, NEARBY_MAX_RADIUS_M)
+        else:
+            hits = self.index.query_radius(lat, lng, radius_m)
+        dists = haversine_one_to_many(lat, lng, self.index.lats[hits], self.index.lngs[hits])
+        order = np.argsort(dists, kind="stable")
+        page = [
+            {**self.gems[int(hits[i])], "distance_m": round(float(dists[i]), 1)}
+            for i in order[offset:offset + limit]
+        ]
+        return page, int(len(hits))
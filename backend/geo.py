@@ -0,0 +1,263 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+# The batched kernels use the same float64 formula as haversine_distance_m;
+# they agree with it to within this many meters anywhere on the globe.
+BATCH_TOLERANCE_M = 1e-6
+
+
+def haversine_distance_m(lat1, lng1, lat2, lng2):
+    """Approximate distance in meters between two WGS84 points."""
+    R = EARTH_RADIUS_M
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat, lng, precision=7):
+    """Standard base32 geohash of a point; precision 7 cells are roughly 150m across."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                value = (value << 1) | 1
+                lng_lo = mid
+            else:
+                value <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_lo = mid
+            else:
+                value <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def geohash_center(geohash):
+    """(lat, lng) at the middle of a geohash cell."""
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    even = True
+    for char in geohash:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lng_lo + lng_hi) / 2
+                if bit:
+                    lng_lo = mid
+                else:
+                    lng_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+    return (lat_lo + lat_hi) / 2, (lng_lo + lng_hi) / 2
+
+
+def radius_bbox(lat, lng, radius_m):
+    """(south, west, north, east) box that contains the circle of radius_m around a point."""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    dlng = dlat / max(math.cos(math.radians(lat)), 1e-6)
+    return lat - dlat, lng - dlng, lat + dlat, lng + dlng
+
+
+def polyline_distance_m(lats, lngs, path_lats, path_lngs):
+    """
+    Distance in meters from each point to the nearest segment of a path,
+    on a local equirectangular projection (accurate to well under 1% at
+    corridor scales of a few hundred meters).
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    path_lats = np.asarray(path_lats, dtype=np.float64)
+    path_lngs = np.asarray(path_lngs, dtype=np.float64)
+    cos_ref = max(math.cos(math.radians(float(path_lats.mean()))), 1e-6)
+    px = EARTH_RADIUS_M * np.radians(lngs) * cos_ref
+    py = EARTH_RADIUS_M * np.radians(lats)
+    vx = EARTH_RADIUS_M * np.radians(path_lngs) * cos_ref
+    vy = EARTH_RADIUS_M * np.radians(path_lats)
+    best = np.full(len(lats), np.inf)
+    if len(path_lats) == 1:
+        return np.hypot(px - vx[0], py - vy[0])
+    for i in range(len(path_lats) - 1):
+        ax, ay = vx[i], vy[i]
+        dx, dy = vx[i + 1] - ax, vy[i + 1] - ay
+        seg_len2 = dx * dx + dy * dy
+        if seg_len2 > 0:
+            t = np.clip(((px - ax) * dx + (py - ay) * dy) / seg_len2, 0.0, 1.0)
+        else:
+            t = 0.0
+        np.minimum(best, np.hypot(px - (ax + t * dx), py - (ay + t * dy)), out=best)
+    return best
+
+
+def _haversine(lat1, lng1, lat2, lng2):
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = np.radians(lat2 - lat1)
+    dlambda = np.radians(lng2 - lng1)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    a = np.clip(a, 0.0, 1.0)
+    return EARTH_RADIUS_M * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def haversine_one_to_many(lat, lng, lats, lngs):
+    """Distances in meters from one point to each of the given points."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    return _haversine(float(lat), float(lng), lats, lngs)
+
+
+def haversine_pairwise(lats1, lngs1, lats2, lngs2):
+    """Element-wise distances in meters between two equally long point arrays."""
+    return _haversine(
+        np.asarray(lats1, dtype=np.float64),
+        np.asarray(lngs1, dtype=np.float64),
+        np.asarray(lats2, dtype=np.float64),
+        np.asarray(lngs2, dtype=np.float64),
+    )
+
+
+def haversine_matrix(lats1, lngs1, lats2, lngs2):
+    """(len(lats1), len(lats2)) matrix of pairwise distances in meters."""
+    lats1 = np.asarray(lats1, dtype=np.float64)[:, None]
+    lngs1 = np.asarray(lngs1, dtype=np.float64)[:, None]
+    lats2 = np.asarray(lats2, dtype=np.float64)[None, :]
+    lngs2 = np.asarray(lngs2, dtype=np.float64)[None, :]
+    return _haversine(lats1, lngs1, lats2, lngs2)
+
+
+def within_radius_mask(lat, lng, lats, lngs, radius_m):
+    """
+    Boolean mask of points within radius_m of (lat, lng). radius_m may be a
+    scalar or an array with one radius per point.
+    """
+    return haversine_one_to_many(lat, lng, lats, lngs) <= np.asarray(radius_m)
+
+
+def within_radius_matrix(lats1, lngs1, lats2, lngs2, radius_m):
+    """Boolean (n, m) mask of which second-set points lie within radius_m of each first-set point."""
+    return haversine_matrix(lats1, lngs1, lats2, lngs2) <= np.asarray(radius_m)
+
+
+class GridIndex:
+    """
+    Uniform grid over (lat, lng) points, bucketed on a local equirectangular
+    projection in meters. A radius query only visits the handful of cells
+    around the query point and confirms candidates with haversine, so the
+    results are identical to a full scan.
+    """
+
+    def __init__(self, points, cell_size_m=120.0):
+        if not isinstance(points, np.ndarray):
+            points = list(points)
+        coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.lats = np.ascontiguousarray(coords[:, 0])
+        self.lngs = np.ascontiguousarray(coords[:, 1])
+        self.cell_size_m = float(cell_size_m)
+        self.ref_lat = float(self.lats.mean()) if len(self.lats) else 0.0
+        self._cos_ref = max(math.cos(math.radians(self.ref_lat)), 1e-6)
+        self._cells = {}
+        if len(self.lats):
+            cx, cy = self._cells_of(self.lats, self.lngs)
+            order = np.lexsort((cy, cx))
+            keys = np.stack([cx[order], cy[order]], axis=1)
+            breaks = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+            for chunk in np.split(order, breaks):
+                self._cells[(int(cx[chunk[0]]), int(cy[chunk[0]]))] = chunk
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _cells_of(self, lats, lngs):
+        x = EARTH_RADIUS_M * np.radians(lngs) * self._cos_ref
+        y = EARTH_RADIUS_M * np.radians(lats)
+        return (
+            np.floor(x / self.cell_size_m).astype(np.int64),
+            np.floor(y / self.cell_size_m).astype(np.int64),
+        )
+
+    def _candidates(self, lat, lng, radius_m):
+        if not len(self.lats):
+            return np.empty(0, dtype=np.int64)
+        x = EARTH_RADIUS_M * math.radians(lng) * self._cos_ref
+        y = EARTH_RADIUS_M * math.radians(lat)
+        cx = int(math.floor(x / self.cell_size_m))
+        cy = int(math.floor(y / self.cell_size_m))
+        # Projected x shrinks by cos(ref)/cos(lat) away from the reference
+        # latitude, so widen the x search to keep the scan exact.
+        cos_here = max(math.cos(math.radians(lat)), 1e-6)
+        span_x = int(math.ceil(radius_m * (self._cos_ref / cos_here) * 1.01 / self.cell_size_m))
+        span_y = int(math.ceil(radius_m * 1.01 / self.cell_size_m))
+        if (2 * span_x + 1) * (2 * span_y + 1) > len(self._cells):
+            # A wide radius covers more cells than are occupied: walk those instead.
+            buckets = [
+                bucket for (gx, gy), bucket in self._cells.items()
+                if abs(gx - cx) <= span_x and abs(gy - cy) <= span_y
+            ]
+        else:
+            buckets = []
+            for gx in range(cx - span_x, cx + span_x + 1):
+                for gy in range(cy - span_y, cy + span_y + 1):
+                    bucket = self._cells.get((gx, gy))
+                    if bucket is not None:
+                        buckets.append(bucket)
+        if not buckets:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(buckets) if len(buckets) > 1 else buckets[0]
+
+    def query_radius(self, lat, lng, radius_m):
+        """Indices of all points within radius_m of (lat, lng)."""
+        candidates = self._candidates(lat, lng, radius_m)
+        if not len(candidates):
+            return candidates
+        mask = within_radius_mask(lat, lng, self.lats[candidates], self.lngs[candidates], radius_m)
+        return candidates[mask]
+
+    def count_within(self, lat, lng, radius_m):
+        return int(len(self.query_radius(lat, lng, radius_m)))
+
+    def any_within(self, lat, lng, radius_m):
+        return self.count_within(lat, lng, radius_m) > 0
+
+    def nearest(self, lat, lng, max_radius_m):
+        """(index, distance_m) of the closest point within max_radius_m, or None."""
+        radius = min(self.cell_size_m, max_radius_m)
+        while True:
+            candidates = self.query_radius(lat, lng, radius)
+            if len(candidates):
+                dists = haversine_one_to_many(lat, lng, self.lats[candidates], self.lngs[candidates])
+                best = int(np.argmin(dists))
+                return int(candidates[best]), float(dists[best])
+            if radius >= max_radius_m:
+                return None
+            radius = min(radius * 2, max_radius_m)
@@ -0,0 +1,149 @@
+"""
+Persistent geocoding cache in SQLite.
+
+Keys are a normalized place name plus the geohash cell of the caller's
+location, since the same name resolves differently per city. Misses and
+results rejected by the distance filter are cached too ("negative"
+entries) with their own, shorter TTL. Upstream errors are never cached.
+
+    python geocache.py warm names.txt --near 15.85,74.50
+    python geocache.py stats
+"""
+import argparse
+import json
+import re
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock
+
+from geo import geohash_encode
+
+STATUS_HIT = "hit"
+STATUS_MISS = "miss"
+STATUS_REJECTED = "rejected"
+
+
+def normalize_name(name):
+    cleaned = re.sub(r"[^\w\s]", " ", (name or "").lower())
+    return " ".join(cleaned.split())
+
+
+class GeocodeCache:
+    def __init__(self, path, hit_ttl=30 * 86400, miss_ttl=86400, precision=5, clock=time.time):
+        self.path = Path(path)
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        self.precision = precision
+        self.clock = clock
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocode (
+                name TEXT NOT NULL,
+                cell TEXT NOT NULL,
+                status TEXT NOT NULL,
+                place TEXT,
+                stored_at REAL NOT NULL,
+                PRIMARY KEY (name, cell)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def key(self, name, lat=None, lng=None):
+        cell = "" if lat is None or lng is None else geohash_encode(float(lat), float(lng), self.precision)
+        return normalize_name(name), cell
+
+    def get(self, name, lat=None, lng=None):
+        """
+        Returns (cached, place). cached is False when the caller must ask
+        upstream; place is None for cached misses and rejections.
+        """
+        key = self.key(name, lat, lng)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, place, stored_at FROM geocode WHERE name = ? AND cell = ?", key
+            ).fetchone()
+            if row is not None:
+                status, place, stored_at = row
+                ttl = self.hit_ttl if status == STATUS_HIT else self.miss_ttl
+                if self.clock() - stored_at <= ttl:
+                    if status == STATUS_HIT:
+                        self.hits += 1
+                        return True, json.loads(place)
+                    self.negative_hits += 1
+                    return True, None
+            self.misses += 1
+        return False, None
+
+    def put(self, name, lat, lng, status, place=None):
+        key = self.key(name, lat, lng)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (name, cell, status, place, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (*key, status, json.dumps(place) if place is not None else None, self.clock()),
+            )
+            self._conn.commit()
+
+    def purge_expired(self):
+        now = self.clock()
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM geocode WHERE (status = ? AND stored_at < ?) OR (status != ? AND stored_at < ?)",
+                (STATUS_HIT, now - self.hit_ttl, STATUS_HIT, now - self.miss_ttl),
+            )
+            self._conn.commit()
+            return cur.rowcount
+
+    def stats(self):
+        with self._lock:
+            rows = dict(self._conn.execute("SELECT status, COUNT(*) FROM geocode GROUP BY status").fetchall())
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "entries": rows,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the persistent geocoding cache.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    warm_cmd = sub.add_parser("warm", help="Geocode a list of place names (one per line) into the cache")
+    warm_cmd.add_argument("names")
+    warm_cmd.add_argument("--near", help="lat,lng the names should be resolved around")
+    sub.add_parser("stats", help="Show cached entries by status")
+    sub.add_parser("purge", help="Delete expired entries")
+    args = parser.parse_args()
+
+    # The app module owns the upstream client and cache configuration.
+    import app
+
+    if args.command == "stats":
+        print(json.dumps(app.geocode_cache.stats(), indent=2))
+        return
+    if args.command == "purge":
+        print(f"Deleted {app.geocode_cache.purge_expired()} expired entries.")
+        return
+
+    lat = lng = None
+    if args.near:
+        lat, lng = (float(v) for v in args.near.split(","))
+    names = [line.strip() for line in Path(args.names).read_text(encoding="utf-8").splitlines() if line.strip()]
+    futures = [app.upstream_pool.submit(app.geocode_place, name, lat, lng) for name in names]
+    found = sum(1 for future in futures if future.result())
+    stats = app.geocode_cache.stats()
+    print(f"Warmed {len(names)} names: {found} resolved, hit ratio {stats['hit_ratio']:.1%} during warm-up.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+Precomputed citywide safety raster, built offline from the feature store.
+
+The raster reuses the feature store's tiling: every store tile becomes a
+(layers, pixels, pixels) uint8 .npy file, north-up, with one pixel per
+tile_deg / pixels degrees. Layer "area" holds the get_safety_score heuristic
+and layer "segment" the per-chunk route heuristic. manifest.json keeps a
+fingerprint of the store tiles each raster tile was computed from, so a
+rebuild only recomputes tiles whose inputs changed.
+
+    python heatmap.py build --bbox 15.80,74.45,15.92,74.57
+    python heatmap.py build --bbox 15.80,74.45,15.92,74.57 --force
+"""
+import argparse
+import base64
+import hashlib
+import json
+import math
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+
+from feature_store import (
+    KIND_BAD_ROAD,
+    KIND_HOSPITAL,
+    KIND_LAMP,
+    KIND_PHARMACY,
+    KIND_POLICE,
+    TILE_EPSILON,
+    FeatureStore,
+)
+from geo import EARTH_RADIUS_M, radius_bbox, within_radius_matrix
+from scoring import AREA_RADIUS_M, SEGMENT_RADIUS_M, area_score, segment_score
+
+LAYERS = ("area", "segment")
+DEFAULT_PIXELS = 64
+MANIFEST_NAME = "manifest.json"
+MAX_VIEWPORT_TILES = 64
+# Bump whenever the scoring heuristics change so every tile is rebuilt.
+HEURISTIC_VERSION = 1
+
+
+def _count_rows(pixel_lats, pixel_lngs, points, radius_m):
+    """Per-pixel count of points within radius_m, one raster row at a time."""
+    counts = np.zeros(pixel_lats.shape, dtype=np.int64)
+    if not len(points):
+        return counts
+    order = np.argsort(points[:, 0])
+    lats, lngs = points[order, 0], points[order, 1]
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    for row in range(pixel_lats.shape[0]):
+        row_lat = pixel_lats[row, 0]
+        lo, hi = np.searchsorted(lats, [row_lat - dlat, row_lat + dlat])
+        if lo == hi:
+            continue
+        mask = within_radius_matrix(pixel_lats[row], pixel_lngs[row], lats[lo:hi], lngs[lo:hi], radius_m)
+        counts[row] = mask.sum(axis=1)
+    return counts
+
+
+class SafetyHeatmap:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.tile_deg = None
+        self.pixels = DEFAULT_PIXELS
+        self.tiles = {}
+        self._open = {}
+        self._lock = Lock()
+        self.reload()
+
+    def reload(self):
+        self.tiles = {}
+        self._open = {}
+        manifest_path = self.root / MANIFEST_NAME
+        if not manifest_path.exists():
+            return
+        with manifest_path.open("r", encoding="utf-8") as fh:
+            manifest = json.load(fh)
+        self.tile_deg = manifest["tile_deg"]
+        self.pixels = manifest["pixels"]
+        for key, fingerprint in manifest.get("tiles", {}).items():
+            ti, tj = (int(part) for part in key.split("_"))
+            self.tiles[(ti, tj)] = fingerprint
+
+    def __bool__(self):
+        return bool(self.tiles)
+
+    def tile_path(self, tile):
+        return self.root / "tiles" / f"{tile[0]}_{tile[1]}.npy"
+
+    def _raster(self, tile):
+        if tile not in self.tiles:
+            return None
+        with self._lock:
+            raster = self._open.get(tile)
+            if raster is None:
+                raster = np.load(self.tile_path(tile), mmap_mode="r")
+                self._open[tile] = raster
+        return raster
+
+    def _tile_of(self, lat, lng):
+        return (
+            int(math.floor(lat / self.tile_deg + TILE_EPSILON)),
+            int(math.floor(lng / self.tile_deg + TILE_EPSILON)),
+        )
+
+    def lookup(self, lat, lng, layer="area"):
+        """Score of the pixel containing the point, or None if it is not mapped."""
+        if not self.tiles:
+            return None
+        tile = self._tile_of(lat, lng)
+        raster = self._raster(tile)
+        if raster is None:
+            return None
+        px = self.tile_deg / self.pixels
+        north = (tile[0] + 1) * self.tile_deg
+        west = tile[1] * self.tile_deg
+        row = min(self.pixels - 1, max(0, int((north - lat) / px)))
+        col = min(self.pixels - 1, max(0, int((lng - west) / px)))
+        return int(raster[LAYERS.index(layer), row, col])
+
+    def viewport(self, south, west, north, east, layer="area"):
+        """Raster tiles intersecting the viewport, base64-encoded row-major uint8."""
+        if not self.tiles:
+            return []
+        ti0, tj0 = self._tile_of(south, west)
+        ti1, tj1 = self._tile_of(north, east)
+        span = (ti1 - ti0 + 1) * (tj1 - tj0 + 1)
+        if span > MAX_VIEWPORT_TILES:
+            raise ValueError(f"Viewport spans {span} tiles; zoom in (max {MAX_VIEWPORT_TILES}).")
+        wanted = [(ti, tj) for ti in range(ti0, ti1 + 1) for tj in range(tj0, tj1 + 1)]
+        px = self.tile_deg / self.pixels
+        tiles = []
+        for tile in wanted:
+            raster = self._raster(tile)
+            if raster is None:
+                continue
+            tile_south, tile_west = tile[0] * self.tile_deg, tile[1] * self.tile_deg
+            tiles.append({
+                "tile": f"{tile[0]}_{tile[1]}",
+                "bounds": [tile_south, tile_west, tile_south + self.tile_deg, tile_west + self.tile_deg],
+                # GDAL-style geo-transform: x = west + col * px, y = north - row * px
+                "transform": [tile_west, px, 0.0, tile_south + self.tile_deg, 0.0, -px],
+                "width": self.pixels,
+                "height": self.pixels,
+                "data": base64.b64encode(np.ascontiguousarray(raster[LAYERS.index(layer)]).tobytes()).decode("ascii"),
+            })
+        return tiles
+
+    def _padded_bounds(self, tile, radius_m):
+        """Tile bounds grown by radius_m, using the tile edge where degrees of longitude are shortest."""
+        south, west = tile[0] * self.tile_deg, tile[1] * self.tile_deg
+        north, east = south + self.tile_deg, west + self.tile_deg
+        widest = south if abs(south) > abs(north) else north
+        pad_s, pad_w, _, _ = radius_bbox(widest, west, radius_m)
+        dlat, dlng = widest - pad_s, west - pad_w
+        return south - dlat, west - dlng, north + dlat, east + dlng
+
+    def _fingerprint(self, store, tile, ring, digests):
+        sha = hashlib.sha1(f"v{HEURISTIC_VERSION}:{store.tile_deg}:{self.pixels}".encode())
+        for ti in range(tile[0] - ring, tile[0] + ring + 1):
+            for tj in range(tile[1] - ring, tile[1] + ring + 1):
+                key = (ti, tj)
+                if key not in digests:
+                    path = store.tile_path(key)
+                    digests[key] = hashlib.sha1(path.read_bytes()).hexdigest() if store.tiles.get(key) else "empty"
+                sha.update(f"{ti}_{tj}:{digests[key]};".encode())
+        return sha.hexdigest()
+
+    def _compute_tile(self, store, tile):
+        px = self.tile_deg / self.pixels
+        north = (tile[0] + 1) * self.tile_deg
+        west = tile[1] * self.tile_deg
+        offsets = (np.arange(self.pixels) + 0.5) * px
+        pixel_lats, pixel_lngs = np.meshgrid(north - offsets, west + offsets, indexing="ij")
+
+        bbox = self._padded_bounds(tile, AREA_RADIUS_M)
+
+        area_points = store.features_in_bbox(*bbox, {KIND_LAMP, KIND_POLICE})
+        area = np.vectorize(area_score, otypes=[np.int64])(
+            _count_rows(pixel_lats, pixel_lngs, area_points, AREA_RADIUS_M)
+        )
+
+        lamps = _count_rows(pixel_lats, pixel_lngs, store.features_in_bbox(*bbox, {KIND_LAMP}), SEGMENT_RADIUS_M)
+        amenities = _count_rows(
+            pixel_lats, pixel_lngs,
+            store.features_in_bbox(*bbox, {KIND_POLICE, KIND_HOSPITAL, KIND_PHARMACY}),
+            SEGMENT_RADIUS_M,
+        )
+        bad = _count_rows(pixel_lats, pixel_lngs, store.features_in_bbox(*bbox, {KIND_BAD_ROAD}), SEGMENT_RADIUS_M) > 0
+        segment = np.vectorize(segment_score, otypes=[np.int64])(lamps, amenities, bad)
+
+        return np.stack([area, segment]).astype(np.uint8)
+
+    def build(self, store, bbox, force=False):
+        """
+        (Re)computes every store tile inside bbox whose neighbourhood is fully
+        ingested. Tiles whose input fingerprint is unchanged are skipped.
+        Returns (rebuilt, unchanged, skipped).
+        """
+        if self.tile_deg is None:
+            self.tile_deg = store.tile_deg
+        if self.tile_deg != store.tile_deg:
+            raise ValueError("Heatmap and feature store use different tile sizes; rebuild with --force into a new directory.")
+        # How many store tiles around each raster tile can hold features in range.
+        widest_lat = max(abs(bbox[0]), abs(bbox[2]))
+        _, pad_w, _, _ = radius_bbox(widest_lat, 0.0, AREA_RADIUS_M)
+        ring = int(math.ceil(-pad_w / self.tile_deg))
+        digests = {}
+        rebuilt = unchanged = skipped = 0
+        (self.root / "tiles").mkdir(parents=True, exist_ok=True)
+        for tile in store.tiles_for_bbox(*bbox):
+            if not store.covers(*self._padded_bounds(tile, AREA_RADIUS_M)):
+                skipped += 1
+                continue
+            fingerprint = self._fingerprint(store, tile, ring, digests)
+            if not force and self.tiles.get(tile) == fingerprint and self.tile_path(tile).exists():
+                unchanged += 1
+                continue
+            np.save(self.tile_path(tile), self._compute_tile(store, tile))
+            self.tiles[tile] = fingerprint
+            rebuilt += 1
+
+        manifest = {
+            "tile_deg": self.tile_deg,
+            "pixels": self.pixels,
+            "layers": list(LAYERS),
+            "tiles": {f"{ti}_{tj}": fp for (ti, tj), fp in sorted(self.tiles.items())},
+        }
+        with (self.root / MANIFEST_NAME).open("w", encoding="utf-8") as fh:
+            json.dump(manifest, fh, indent=2)
+        self._open = {}
+        return rebuilt, unchanged, skipped
+
+
+def main():
+    data_dir = Path(__file__).resolve().parent / "data"
+    parser = argparse.ArgumentParser(description="Build the precomputed safety heatmap raster.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="Compute raster tiles for a city bbox")
+    build_cmd.add_argument("--bbox", required=True, help="south,west,north,east")
+    build_cmd.add_argument("--store", default=str(data_dir / "osm_store"))
+    build_cmd.add_argument("--out", default=str(data_dir / "heatmap"))
+    build_cmd.add_argument("--force", action="store_true", help="Recompute every tile")
+    args = parser.parse_args()
+
+    store = FeatureStore(args.store)
+    if not store:
+        raise SystemExit(f"No feature store at {args.store}; run feature_store.py ingest first.")
+    heatmap = SafetyHeatmap(args.out)
+    bbox = tuple(float(v) for v in args.bbox.split(","))
+    rebuilt, unchanged, skipped = heatmap.build(store, bbox, force=args.force)
+    print(f"Rebuilt {rebuilt} tiles, {unchanged} unchanged, {skipped} skipped (store does not cover them).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+In-memory hidden-gem leaderboards, updated incrementally from the unlock log.
+
+Every worker keeps its own boards and catches up with storage.unlocks_since,
+which only returns rows it has not seen, so unlocks made on other workers
+show up on the next sync. Boards exist for all time, per gem region (the
+gem's "city", else a ~20 km geohash cell) and per ISO week and calendar
+month; window boards older than the previous period are dropped.
+"""
+import time
+
+from metrics import TimedLock
+
+WINDOWS = {
+    "week": lambda ts: time.strftime("%G-W%V", time.gmtime(ts)),
+    "month": lambda ts: time.strftime("%Y-%m", time.gmtime(ts)),
+}
+WINDOW_PERIOD_S = {"week": 7 * 86400, "month": 31 * 86400}
+
+
+class Board:
+    """
+    Unlock counts bucketed by value. Moving a user up one count is O(1), and
+    top(k) walks the buckets down from the highest count, so neither depends
+    on how many users there are. Within a count, whoever got there first
+    ranks first.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.buckets = {}
+        self.max_count = 0
+        self.version = 0
+        self._snapshot = (None, 0, [])
+
+    def __len__(self):
+        return len(self.counts)
+
+    def increment(self, user_id):
+        old = self.counts.get(user_id, 0)
+        if old:
+            bucket = self.buckets[old]
+            del bucket[user_id]
+            if not bucket:
+                del self.buckets[old]
+        new = old + 1
+        # dicts keep insertion order, which is the tie-break.
+        self.buckets.setdefault(new, {})[user_id] = None
+        self.counts[user_id] = new
+        self.max_count = max(self.max_count, new)
+        self.version += 1
+
+    def top(self, k):
+        """[(user_id, count)] for the k best users, cached until the next change."""
+        version, cached_k, entries = self._snapshot
+        if version == self.version and k <= cached_k:
+            return entries[:k]
+        entries = []
+        count = self.max_count
+        while count > 0 and len(entries) < k:
+            for user_id in self.buckets.get(count, ()):
+                entries.append((user_id, count))
+                if len(entries) == k:
+                    break
+            count -= 1
+        self._snapshot = (self.version, k, entries)
+        return entries
+
+
+class Leaderboards:
+    def __init__(self, region_of_gem, clock=time.time):
+        self.region_of_gem = region_of_gem
+        self.clock = clock
+        self.boards = {}
+        self.cursor = None
+        self._lock = TimedLock("leaderboard")
+        self._sync_lock = TimedLock("leaderboard_sync")
+
+    def _keys(self, gem_id, unlocked_at):
+        keys = [("all", None)]
+        region = self.region_of_gem(gem_id)
+        if region:
+            keys.append(("city", region))
+        for window, label in WINDOWS.items():
+            keys.append((window, label(unlocked_at)))
+        return keys
+
+    def record(self, user_id, gem_id, unlocked_at):
+        with self._lock:
+            self._record(user_id, gem_id, unlocked_at)
+
+    def _record(self, user_id, gem_id, unlocked_at):
+        for key in self._keys(gem_id, unlocked_at):
+            board = self.boards.get(key)
+            if board is None:
+                board = self.boards[key] = Board()
+            board.increment(user_id)
+
+    def _prune(self):
+        now = self.clock()
+        for window, label in WINDOWS.items():
+            oldest = label(now - WINDOW_PERIOD_S[window])
+            for key in [key for key in self.boards if key[0] == window and key[1] < oldest]:
+                del self.boards[key]
+
+    def sync(self, storage):
+        """Applies unlocks recorded since the last sync (by any worker)."""
+        # One reader at a time so rows are applied once and in order; the
+        # storage query runs outside the board lock.
+        with self._sync_lock:
+            rows, cursor = storage.unlocks_since(self.cursor)
+            if rows:
+                with self._lock:
+                    for user_id, gem_id, unlocked_at in rows:
+                        self._record(user_id, gem_id, unlocked_at)
+                    self._prune()
+            self.cursor = cursor
+
+    def top(self, k=5, city=None, window=None):
+        """[(user_id, count)] for one board: all time, a region, or the current week / month."""
+        if window is not None:
+            key = (window, WINDOWS[window](self.clock()))
+        elif city is not None:
+            key = ("city", city)
+        else:
+            key = ("all", None)
+        with self._lock:
+            board = self.boards.get(key)
+            return board.top(k) if board is not None else []
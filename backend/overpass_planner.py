@@ -0,0 +1,322 @@
+"""
+Overpass query planner for route safety.
+
+Instead of one bounding box around the whole route, the route corridor
+(the path buffered by buffer_m) is covered with fixed tile_deg tiles.
+Tiles already in the tile cache are reused; the missing ones are merged
+into a few rectangles, each fetched with one Overpass query, split back
+into tiles and cached (empty tiles included). Only features inside the
+corridor are returned. A diagonal corridor's staggered rows may share one
+bounding rectangle, over-fetching by at most max_overfetch.
+
+Batches are fetched one after another: the public Overpass instance only
+grants a couple of concurrent slots per client. Callers cap the number of
+batches and the total time; tiles not reached leave the result "partial".
+"""
+import math
+import time
+
+import numpy as np
+
+from feature_store import TILE_EPSILON, parse_overpass_elements
+from geo import EARTH_RADIUS_M, polyline_distance_m, radius_bbox
+
+OVERPASS_URL = "http://overpass-api.de/api/interpreter"
+
+SOURCE_OVERPASS = "overpass"
+SOURCE_PARTIAL = "partial"
+SOURCE_UNAVAILABLE = "unavailable"
+
+
+def merge_tiles(tiles, max_batch_tiles=16, max_overfetch=1.0):
+    """
+    Greedily merges (row, col) tiles into rectangles (row0, col0, row1, col1),
+    inclusive: runs of adjacent columns in a row, then identical runs stacked
+    over consecutive rows, capped at max_batch_tiles tiles per rectangle.
+    With max_overfetch above 1, rectangles in neighbouring rows (e.g. the
+    staggered runs of a diagonal corridor) are then combined into their
+    bounding box while it holds at most max_batch_tiles wanted tiles and at
+    most max_overfetch times as many tiles in total.
+    """
+    runs = []
+    by_row = {}
+    for row, col in tiles:
+        by_row.setdefault(row, []).append(col)
+    for row in sorted(by_row):
+        cols = sorted(by_row[row])
+        start = prev = cols[0]
+        for col in cols[1:] + [None]:
+            if col is not None and col == prev + 1 and col - start < max_batch_tiles:
+                prev = col
+                continue
+            runs.append((row, start, prev))
+            if col is not None:
+                start = prev = col
+
+    rects = []
+    open_rects = {}
+    for row, c0, c1 in runs:
+        rect = open_rects.pop((c0, c1), None)
+        width = c1 - c0 + 1
+        if rect is not None and rect[2] == row - 1 and (rect[2] - rect[0] + 2) * width <= max_batch_tiles:
+            rect[2] = row
+        else:
+            if rect is not None:
+                rects.append(rect)
+            rect = [row, c0, row, c1]
+        open_rects[(c0, c1)] = rect
+    rects.extend(open_rects.values())
+    rects = sorted(tuple(rect) for rect in rects)
+    if max_overfetch > 1:
+        rects = _coalesce(rects, max_batch_tiles, max_overfetch)
+    return rects
+
+
+def _area(rect):
+    return (rect[2] - rect[0] + 1) * (rect[3] - rect[1] + 1)
+
+
+def _coalesce(rects, max_batch_tiles, max_overfetch):
+    """
+    Repeatedly replaces two row-adjacent rectangles (and anything inside
+    their bounding box) with that box, picking the merge that over-fetches
+    least. A box that cuts through another rectangle is never used, so no
+    tile is fetched twice.
+    """
+    wanted = {rect: _area(rect) for rect in rects}
+    while True:
+        best = None
+        for i, a in enumerate(rects):
+            for b in rects[i + 1:]:
+                if b[0] > a[2] + 1:
+                    break
+                box = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                inside = []
+                for rect in rects:
+                    if rect[0] > box[2] or rect[2] < box[0] or rect[1] > box[3] or rect[3] < box[1]:
+                        continue
+                    if rect[0] < box[0] or rect[2] > box[2] or rect[1] < box[1] or rect[3] > box[3]:
+                        break
+                    inside.append(rect)
+                else:
+                    count = sum(wanted[rect] for rect in inside)
+                    waste = _area(box) - count
+                    if count <= max_batch_tiles and _area(box) <= max_overfetch * count:
+                        if best is None or waste < best[0]:
+                            best = (waste, box, inside, count)
+        if best is None:
+            return rects
+        _, box, inside, count = best
+        wanted[box] = count
+        rects = sorted([rect for rect in rects if rect not in inside] + [box])
+
+
+class OverpassPlanner:
+    def __init__(self, upstream, tile_cache, tile_deg=0.01, buffer_m=200.0, max_batch_tiles=16,
+                 max_overfetch=1.0, url=OVERPASS_URL, timeout=25):
+        self.upstream = upstream
+        self.tile_cache = tile_cache
+        self.tile_deg = tile_deg
+        self.buffer_m = buffer_m
+        self.max_batch_tiles = max_batch_tiles
+        self.max_overfetch = max_overfetch
+        self.url = url
+        self.timeout = timeout
+
+    def tile_of(self, lat, lng):
+        return (
+            math.floor(lat / self.tile_deg + TILE_EPSILON),
+            math.floor(lng / self.tile_deg + TILE_EPSILON),
+        )
+
+    def corridor_tiles(self, coords):
+        """
+        Tiles touched by the corridor around a list of [lng, lat] pairs.
+        The path is sampled every buffer_m / 2 and each sample claims the
+        tiles under a slightly widened box, so no covered tile is missed.
+        """
+        step_m = self.buffer_m / 2
+        reach_m = self.buffer_m + step_m
+        deg_per_m = math.degrees(1 / EARTH_RADIUS_M)
+        tiles = set()
+        for i in range(len(coords)):
+            lng0, lat0 = coords[i]
+            lng1, lat1 = coords[i + 1] if i + 1 < len(coords) else coords[i]
+            cos_lat = max(math.cos(math.radians(lat0)), 1e-6)
+            span_m = math.hypot((lat1 - lat0) / deg_per_m, (lng1 - lng0) * cos_lat / deg_per_m)
+            samples = max(1, int(math.ceil(span_m / step_m)))
+            for k in range(samples):
+                t = k / samples
+                south, west, north, east = radius_bbox(lat0 + t * (lat1 - lat0), lng0 + t * (lng1 - lng0), reach_m)
+                r0, c0 = self.tile_of(south, west)
+                r1, c1 = self.tile_of(north, east)
+                for row in range(r0, r1 + 1):
+                    for col in range(c0, c1 + 1):
+                        tiles.add((row, col))
+        return tiles
+
+    def point_tiles(self, lat, lng, radius_m):
+        """Tiles touched by the radius_m box around a point."""
+        south, west, north, east = radius_bbox(lat, lng, radius_m)
+        r0, c0 = self.tile_of(south, west)
+        r1, c1 = self.tile_of(north, east)
+        return [(row, col) for row in range(r0, r1 + 1) for col in range(c0, c1 + 1)]
+
+    def build_query(self, rect):
+        row0, col0, row1, col1 = rect
+        south, west = row0 * self.tile_deg, col0 * self.tile_deg
+        north, east = (row1 + 1) * self.tile_deg, (col1 + 1) * self.tile_deg
+        bbox = f"{south:.6f},{west:.6f},{north:.6f},{east:.6f}"
+        return f"""
+    [out:json][timeout:{self.timeout}];
+    (
+      node["highway"="street_lamp"]({bbox});
+      node["amenity"~"police|hospital|pharmacy"]({bbox});
+      way["highway"~"service|unclassified"]({bbox});
+    );
+    out center;
+    """
+
+    def split_rect(self, rect, data):
+        """
+        Splits one rectangle's Overpass response into {tile: (n, 3) array of
+        kind, lat, lng} for every tile in it. Ways are filed under the tile of
+        their center, and centers outside the rectangle are dropped so every
+        tile's contents come from a query over that tile.
+        """
+        row0, col0, row1, col1 = rect
+        per_tile = {(row, col): [] for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)}
+        for kind, lat, lng in parse_overpass_elements(data.get("elements", [])):
+            bucket = per_tile.get(self.tile_of(lat, lng))
+            if bucket is not None:
+                bucket.append((kind, lat, lng))
+        return {tile: np.array(rows, dtype=np.float64).reshape(-1, 3) for tile, rows in per_tile.items()}
+
+    def plan(self, coords):
+        """(tiles, found, batches): corridor tiles, cached tile contents and rectangles to fetch."""
+        tiles = self.corridor_tiles(coords)
+        return (tiles,) + self.plan_tiles(tiles)
+
+    def plan_tiles(self, tiles):
+        """(found, batches) for a set of tiles: cached contents and rectangles to fetch."""
+        found = {}
+        missing = []
+        for tile in tiles:
+            cached = self.tile_cache.get(tile)
+            if cached is None:
+                missing.append(tile)
+            else:
+                found[tile] = cached
+        return found, merge_tiles(missing, self.max_batch_tiles, self.max_overfetch)
+
+    def absorb(self, rect, data, tiles, found):
+        """Caches a fetched rectangle and adds its corridor tiles to found."""
+        for tile, rows in self.split_rect(rect, data).items():
+            self.tile_cache.set(tile, rows)
+            if tile in tiles:
+                found[tile] = rows
+
+    def finish(self, coords, tiles, found, cached_tiles, batches, failed):
+        if failed == 0:
+            source = SOURCE_OVERPASS
+        elif found:
+            source = SOURCE_PARTIAL
+        else:
+            source = SOURCE_UNAVAILABLE
+        info = {
+            "source": source,
+            "tiles": len(tiles),
+            "cached_tiles": cached_tiles,
+            "batches": len(batches),
+            "failed_batches": failed,
+        }
+        features = np.concatenate(list(found.values())) if found else np.empty((0, 3))
+        if len(features):
+            path = np.asarray(coords, dtype=np.float64)
+            dist = polyline_distance_m(features[:, 1], features[:, 2], path[:, 1], path[:, 0])
+            features = features[dist <= self.buffer_m]
+        return features, info
+
+    def request_kwargs(self, rect, deadline=None):
+        """
+        Request arguments for one rectangle, with the timeout clamped to the
+        time left before a time.monotonic() deadline; None once it has passed.
+        """
+        timeout = self.timeout
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                return None
+        return {"params": {"data": self.build_query(rect)}, "timeout": timeout}
+
+    def fetch_batches(self, batches, tiles, found, max_batches=None, deadline_s=None):
+        """
+        Fetches and absorbs each rectangle in turn; returns how many failed.
+        At most max_batches are fetched, within deadline_s seconds overall;
+        batches not reached count as failed.
+        """
+        deadline = time.monotonic() + deadline_s if deadline_s is not None else None
+        failed = len(batches[max_batches:]) if max_batches is not None else 0
+        for i, rect in enumerate(batches[:max_batches]):
+            kwargs = self.request_kwargs(rect, deadline)
+            if kwargs is None:
+                return failed + len(batches[:max_batches]) - i
+            try:
+                resp = self.upstream.get(self.url, **kwargs)
+                resp.raise_for_status()
+                self.absorb(rect, resp.json(), tiles, found)
+            except Exception as e:
+                print(f"Overpass batch error: {e}")
+                failed += 1
+        return failed
+
+    async def fetch_batches_async(self, batches, tiles, found, upstream, max_batches=None, deadline_s=None):
+        """fetch_batches for the async server, fetching through an AsyncUpstream."""
+        deadline = time.monotonic() + deadline_s if deadline_s is not None else None
+        failed = len(batches[max_batches:]) if max_batches is not None else 0
+        for i, rect in enumerate(batches[:max_batches]):
+            kwargs = self.request_kwargs(rect, deadline)
+            if kwargs is None:
+                return failed + len(batches[:max_batches]) - i
+            try:
+                resp = await upstream.get(self.url, **kwargs)
+                resp.raise_for_status()
+                self.absorb(rect, resp.json(), tiles, found)
+            except Exception as e:
+                print(f"Overpass batch error: {e}")
+                failed += 1
+        return failed
+
+    def tiles_near(self, points, radius_m, max_batches=None, deadline_s=None):
+        """
+        ([tiles per point], found) for (lat, lng) points: every tile within
+        radius_m of any point is loaded through one plan, so nearby points
+        share tiles and batches. At most max_batches rectangles are fetched,
+        within deadline_s seconds overall. Tiles whose batch failed or was
+        not reached are absent from found.
+        """
+        per_point = [self.point_tiles(lat, lng, radius_m) for lat, lng in points]
+        tiles = set().union(*per_point) if per_point else set()
+        found, batches = self.plan_tiles(tiles)
+        self.fetch_batches(batches, tiles, found, max_batches, deadline_s)
+        return per_point, found
+
+    def features_along(self, coords, max_batches=None, deadline_s=None):
+        """
+        Returns (features, info): features is an (n, 3) array of kind, lat,
+        lng inside the corridor; info reports tile counts, batches and the
+        source ("overpass", "partial" when some batches failed or were not
+        reached within max_batches / deadline_s, or "unavailable" when
+        nothing could be loaded).
+        """
+        tiles, found, batches = self.plan(coords)
+        cached_tiles = len(found)
+        failed = self.fetch_batches(batches, tiles, found, max_batches, deadline_s)
+        return self.finish(coords, tiles, found, cached_tiles, batches, failed)
+
+    async def features_along_async(self, coords, upstream, max_batches=None, deadline_s=None):
+        """features_along for the async server, fetching through an AsyncUpstream."""
+        tiles, found, batches = self.plan(coords)
+        cached_tiles = len(found)
+        failed = await self.fetch_batches_async(batches, tiles, found, upstream, max_batches, deadline_s)
+        return self.finish(coords, tiles, found, cached_tiles, batches, failed)
@@ -0,0 +1,178 @@
+"""
+Ranked fuzzy lookup of place names.
+
+Names are normalized to lowercase word tokens. An inverted index maps each
+token to the places that contain it, and a trigram index over the token
+vocabulary maps misspelled query words ("belgavi") to the words they most
+likely mean. A lookup only touches the postings of the query's words, so it
+does not depend on how many places are indexed, only on how common those
+words are.
+
+Candidates are scored by IDF-weighted overlap between query and name:
+matched / (query + name - matched), where a fuzzy word counts by its
+trigram similarity. Names that contain every query word, or whose words all
+appear in the query, always qualify (the old substring behaviour); anything
+else needs MIN_SCORE. Ties go, in order, to more words matched exactly, the
+shorter name, then the alphabetically first name, so results never depend
+on insertion order.
+"""
+import bisect
+import math
+import re
+from collections import defaultdict
+
+TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+MIN_SCORE = 0.5
+FUZZY_MIN_SIMILARITY = 0.5
+FUZZY_MIN_LENGTH = 4
+FUZZY_CHOICES = 3
+# Words in more places than this only re-score candidates found through
+# rarer words. A query made only of such words is answered from the
+# SHORTEST_PER_WORD shortest names holding each word, which are also the
+# ones that score best for it.
+COMMON_POSTING_LIMIT = 10000
+SHORTEST_PER_WORD = 50
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or "").lower())
+
+
+def trigrams(token):
+    padded = f"${token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class PlaceNameIndex:
+    def __init__(self, names=()):
+        self.names = []
+        self.ids = {}
+        self.name_tokens = []
+        self.postings = defaultdict(set)
+        self.vocab_trigrams = defaultdict(set)
+        self.shortest = defaultdict(list)
+        # place id -> summed IDF of its words, rebuilt once the catalog has
+        # grown by a quarter since they were computed.
+        self._name_weights = {}
+        self._weights_size = 0
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        """Indexes a place name; adding one twice is a no-op."""
+        if name in self.ids:
+            return
+        place_id = len(self.names)
+        self.ids[name] = place_id
+        self.names.append(name)
+        tokens = set(tokenize(name))
+        self.name_tokens.append(tokens)
+        for token in tokens:
+            if token not in self.postings:
+                for gram in trigrams(token):
+                    self.vocab_trigrams[gram].add(token)
+            self.postings[token].add(place_id)
+            shortest = self.shortest[token]
+            entry = (len(tokens), name, place_id)
+            if len(shortest) < SHORTEST_PER_WORD or entry < shortest[-1]:
+                bisect.insort(shortest, entry)
+                del shortest[SHORTEST_PER_WORD:]
+
+    def _idf(self, token):
+        return math.log(1 + len(self.names) / (1 + len(self.postings.get(token, ()))))
+
+    def _name_weight(self, place_id):
+        if len(self.names) > self._weights_size * 1.25:
+            self._name_weights = {}
+            self._weights_size = len(self.names)
+        weight = self._name_weights.get(place_id)
+        if weight is None:
+            weight = self._name_weights[place_id] = sum(self._idf(token) for token in self.name_tokens[place_id])
+        return weight
+
+    def _similar_tokens(self, token):
+        """[(vocabulary word, similarity)] for a word missing from the vocabulary."""
+        if len(token) < FUZZY_MIN_LENGTH:
+            return []
+        grams = trigrams(token)
+        shared = defaultdict(int)
+        for gram in grams:
+            for word in self.vocab_trigrams.get(gram, ()):
+                shared[word] += 1
+        scored = []
+        for word, count in shared.items():
+            similarity = count / (len(grams) + len(trigrams(word)) - count)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                scored.append((similarity, word))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(word, similarity) for similarity, word in scored[:FUZZY_CHOICES]]
+
+    def _query_weight(self, token, expansions):
+        """IDF of a query word, or of its rarest fuzzy match when it is not indexed."""
+        if token in self.postings or not expansions:
+            return self._idf(token)
+        return max(self._idf(word) for word, _ in expansions)
+
+    def search(self, query, limit=5):
+        """[(name, score)] best first; an exact (normalized) name scores 1.0."""
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return []
+        # query word -> [(indexed word, similarity)]
+        expansions = {}
+        for token in query_tokens:
+            if token in self.postings:
+                expansions[token] = [(token, 1.0)]
+            else:
+                expansions[token] = self._similar_tokens(token)
+
+        # Rarest words first, so common words can be limited to re-scoring.
+        order = sorted(query_tokens, key=lambda t: min(
+            (len(self.postings[word]) for word, _ in expansions[t]), default=0
+        ))
+        matched = defaultdict(float)
+        exact = defaultdict(int)
+        covered = defaultdict(set)
+        weights = {token: self._query_weight(token, expansions[token]) for token in query_tokens}
+        for token in order:
+            weight = weights[token]
+            best = {}
+            for word, similarity in expansions[token]:
+                posting = self.postings[word]
+                if len(posting) > COMMON_POSTING_LIMIT:
+                    if matched:
+                        posting = [place_id for place_id in matched if place_id in posting]
+                    else:
+                        posting = [place_id for _, _, place_id in self.shortest[word]]
+                for place_id in posting:
+                    if similarity > best.get(place_id, (0.0, None))[0]:
+                        best[place_id] = (similarity, word)
+            for place_id, (similarity, word) in best.items():
+                matched[place_id] += weight * similarity
+                covered[place_id].add(word)
+                if similarity == 1.0:
+                    exact[place_id] += 1
+
+        query_weight = sum(weights.values())
+        ranked = []
+        for place_id, overlap in matched.items():
+            tokens = self.name_tokens[place_id]
+            score = overlap / (query_weight + self._name_weight(place_id) - overlap)
+            contains_query = exact[place_id] == len(query_tokens)
+            within_query = covered[place_id] >= tokens
+            if score < MIN_SCORE and not (contains_query or within_query):
+                continue
+            name = self.names[place_id]
+            ranked.append((-round(score, 6), -exact[place_id], len(tokens), name))
+        ranked.sort()
+        return [(name, -neg_score) for neg_score, _, _, name in ranked[:limit]]
+
+    def best(self, query):
+        """The single best match for query, else None."""
+        if query in self.ids:
+            return query
+        results = self.search(query, limit=1)
+        return results[0][0] if results else None
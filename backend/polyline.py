@@ -0,0 +1,121 @@
+"""
+Compact route geometry: encoded polylines and Douglas–Peucker simplification.
+
+Polylines use the Google encoded polyline algorithm (lat, lng order, 1e-5
+degrees by default), which Leaflet, MapLibre plugins and most mobile SDKs
+decode natively. Coordinates in and out of this module are [lng, lat] pairs,
+like the rest of the route code.
+
+Simplification tolerance follows the map zoom: a vertex is dropped when it
+lies within SIMPLIFY_PIXELS screen pixels of the simplified line at that
+zoom, so the drawn route does not change visibly.
+"""
+import math
+
+import numpy as np
+
+from geo import EARTH_RADIUS_M
+
+# Ground meters per pixel at the equator for zoom 0 on 256px web mercator tiles.
+METERS_PER_PIXEL_Z0 = 2 * math.pi * EARTH_RADIUS_M / 256
+SIMPLIFY_PIXELS = 0.5
+MAX_ZOOM = 22
+
+
+def _encode_value(value, out):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode(coords, precision=5):
+    """Encoded polyline string for a list of [lng, lat] pairs."""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lng = 0
+    for lng, lat in coords:
+        lat_i = int(math.floor(lat * factor + 0.5))
+        lng_i = int(math.floor(lng * factor + 0.5))
+        _encode_value(lat_i - prev_lat, out)
+        _encode_value(lng_i - prev_lng, out)
+        prev_lat, prev_lng = lat_i, lng_i
+    return "".join(out)
+
+
+def decode(text, precision=5):
+    """[[lng, lat]] pairs from an encoded polyline string."""
+    factor = 10 ** precision
+    coords = []
+    index = lat = lng = 0
+    while index < len(text):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(text[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coords.append([lng / factor, lat / factor])
+    return coords
+
+
+def tolerance_for_zoom(zoom, lat):
+    """Simplification tolerance in meters for a map zoom level at latitude lat."""
+    zoom = min(max(float(zoom), 0.0), MAX_ZOOM)
+    return SIMPLIFY_PIXELS * METERS_PER_PIXEL_Z0 * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def _keep_span(x, y, start, end, tolerance_m, keep):
+    stack = [(start, end)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        px, py = x[first + 1:last], y[first + 1:last]
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        length_sq = dx * dx + dy * dy
+        if length_sq > 0:
+            t = np.clip(((px - x[first]) * dx + (py - y[first]) * dy) / length_sq, 0.0, 1.0)
+        else:
+            t = np.zeros(len(px))
+        dists = np.hypot(px - (x[first] + t * dx), py - (y[first] + t * dy))
+        worst = int(np.argmax(dists))
+        if dists[worst] > tolerance_m:
+            mid = first + 1 + worst
+            keep[mid] = True
+            stack.append((first, mid))
+            stack.append((mid, last))
+
+
+def simplify(coords, tolerance_m, keep_indices=()):
+    """
+    Indices of the vertices of coords ([lng, lat] pairs) that survive
+    Douglas–Peucker at tolerance_m meters, ascending. The ends and every
+    index in keep_indices are always kept, and each stretch between kept
+    indices is simplified on its own.
+    """
+    n = len(coords)
+    if n <= 2 or tolerance_m <= 0:
+        return np.arange(n)
+    points = np.asarray(coords, dtype=np.float64)
+    lats = np.radians(points[:, 1])
+    # Local equirectangular projection in meters; plenty for route-sized extents.
+    x = EARTH_RADIUS_M * np.radians(points[:, 0]) * math.cos(float(lats.mean()))
+    y = EARTH_RADIUS_M * lats
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, n - 1]] = True
+    for index in keep_indices:
+        if 0 <= index < n:
+            keep[index] = True
+    anchors = np.flatnonzero(keep)
+    for start, end in zip(anchors[:-1], anchors[1:]):
+        _keep_span(x, y, int(start), int(end), tolerance_m, keep)
+    return np.flatnonzero(keep)
@@ -0,0 +1,89 @@
+"""
+Helpers for the streaming /api/query variant: server-sent-event framing and
+an incremental splitter that separates the markdown answer from the
+trailing POI_CANDIDATES line while the model output is still arriving.
+"""
+import json
+
+POI_MARKER = "POI_CANDIDATES:"
+
+
+def sse_event(event, data):
+    """One server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def parse_poi_entry(entry):
+    """'name|note' (or just 'name') -> {"name", "note"} with '-' for no note."""
+    if "|" in entry:
+        name, note = entry.split("|", 1)
+    else:
+        name, note = entry, "-"
+    return {"name": name.strip(), "note": note.strip()}
+
+
+class AnswerStreamSplitter:
+    """
+    Feed model text chunks in; get back the markdown that is safe to show
+    and any POI candidates whose entry has been fully received.
+
+    Text that could still turn out to be the start of POI_MARKER is held
+    back until the next chunk decides it. After the marker, each
+    ';'-terminated entry is released as soon as its terminator arrives.
+    """
+
+    def __init__(self):
+        self.answer = ""
+        self._held = ""
+        self._trailer = None
+        self._released = 0
+
+    def feed(self, text):
+        """Returns (markdown_delta, new_candidates)."""
+        if self._trailer is not None:
+            self._trailer += text
+            return "", self._take_candidates(final=False)
+
+        buffer = self._held + text
+        marker_at = buffer.find(POI_MARKER)
+        if marker_at >= 0:
+            delta = buffer[:marker_at]
+            self._held = ""
+            self._trailer = buffer[marker_at + len(POI_MARKER):]
+            self.answer += delta
+            return delta, self._take_candidates(final=False)
+
+        keep = 0
+        for size in range(min(len(POI_MARKER) - 1, len(buffer)), 0, -1):
+            if POI_MARKER.startswith(buffer[-size:]):
+                keep = size
+                break
+        delta = buffer[:len(buffer) - keep]
+        self._held = buffer[len(buffer) - keep:]
+        self.answer += delta
+        return delta, []
+
+    def finish(self):
+        """Flushes held text and the last candidate once the stream ends."""
+        delta = ""
+        if self._trailer is None:
+            delta = self._held
+            self.answer += delta
+            self._held = ""
+            return delta, []
+        return delta, self._take_candidates(final=True)
+
+    def _take_candidates(self, final):
+        line = self._trailer.lstrip()
+        line_done = final or "\n" in line
+        line = line.split("\n", 1)[0]
+        if line.strip().lower() == "none":
+            return []
+        pieces = line.split(";")
+        if not line_done:
+            # The last piece may still be growing.
+            pieces = pieces[:-1]
+        entries = [piece.strip() for piece in pieces if piece.strip()]
+        fresh = entries[self._released:]
+        self._released = len(entries)
+        return [parse_poi_entry(entry) for entry in fresh]
@@ -0,0 +1,314 @@
+"""
+In-process walking router with a safety-weighted cost.
+
+The walking graph is built offline from an OSM extract and stored as a
+compressed-sparse-row adjacency in one .npz file: node coordinates,
+indptr/indices, and two per-edge weights. "length_m" is plain distance and
+"safe_cost" is length scaled up on edges the route scorer would call
+moderate or risky (few lamps or amenities, service/unclassified roads).
+Queries run bidirectional A* with a haversine potential, which stays
+admissible for both weights because no edge costs less than its length.
+
+    python router.py build belagavi.osm --out data/walk_graph.npz
+    python router.py build overpass_ways.json
+"""
+import argparse
+import heapq
+import json
+import math
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import numpy as np
+
+from feature_store import (
+    KIND_BAD_ROAD,
+    KIND_HOSPITAL,
+    KIND_LAMP,
+    KIND_PHARMACY,
+    KIND_POLICE,
+    read_extract,
+)
+from geo import GridIndex, haversine_distance_m, haversine_pairwise
+from scoring import SEGMENT_RADIUS_M, segment_score
+
+WALKABLE_HIGHWAYS = {
+    "footway", "path", "pedestrian", "steps", "living_street", "residential",
+    "service", "unclassified", "tertiary", "tertiary_link", "secondary",
+    "secondary_link", "primary", "primary_link", "track", "cycleway", "road",
+}
+# A segment scored 0 costs (1 + SAFETY_WEIGHT) times its length; 100 costs its length.
+SAFETY_WEIGHT = 2.0
+WALKING_SPEED_MPS = 1.39
+SNAP_RADIUS_M = 250.0
+
+
+def is_walkable(tags):
+    if tags.get("highway") not in WALKABLE_HIGHWAYS:
+        return False
+    return tags.get("foot") != "no" and tags.get("access") not in {"private", "no"}
+
+
+def read_walk_ways(path):
+    """Returns (node_coords, ways): {node_id: (lat, lng)} and walkable ways as node-id lists."""
+    path = Path(path)
+    name = path.name.lower()
+    if name.endswith(".pbf"):
+        return _read_walk_ways_pbf(path)
+    if name.endswith(".json"):
+        return _read_walk_ways_json(path)
+    node_coords = {}
+    ways = []
+    for _, elem in ET.iterparse(str(path), events=("end",)):
+        if elem.tag == "node":
+            node_coords[elem.get("id")] = (float(elem.get("lat")), float(elem.get("lon")))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {t.get("k"): t.get("v") for t in elem.findall("tag")}
+            if is_walkable(tags):
+                ways.append([nd.get("ref") for nd in elem.findall("nd")])
+            elem.clear()
+    return node_coords, ways
+
+
+def _read_walk_ways_json(path):
+    """Overpass JSON with full way bodies and their nodes (`out body; >; out skel qt;`)."""
+    with path.open("r", encoding="utf-8") as fh:
+        data = json.load(fh)
+    node_coords = {}
+    ways = []
+    for el in data.get("elements", []):
+        if el.get("type") == "node" and el.get("lat") is not None:
+            node_coords[el["id"]] = (float(el["lat"]), float(el["lon"]))
+        elif el.get("type") == "way" and is_walkable(el.get("tags") or {}):
+            ways.append(el.get("nodes") or [])
+    return node_coords, ways
+
+
+def _read_walk_ways_pbf(path):
+    try:
+        import osmium  # type: ignore
+    except ImportError as exc:
+        raise RuntimeError("Reading .pbf extracts needs `pip install osmium`.") from exc
+
+    node_coords = {}
+    ways = []
+
+    class Handler(osmium.SimpleHandler):
+        def way(self, w):
+            if not is_walkable(dict(w.tags)):
+                return
+            refs = []
+            for nd in w.nodes:
+                if nd.location.valid():
+                    node_coords[nd.ref] = (nd.lat, nd.lon)
+                    refs.append(nd.ref)
+            ways.append(refs)
+
+    Handler().apply_file(str(path), locations=True)
+    return node_coords, ways
+
+
+def build_graph(node_coords, ways, lamps, amenities, bad_centers):
+    """Builds the CSR arrays for an undirected walking graph."""
+    ids = {}
+    lats = []
+    lngs = []
+    src = []
+    dst = []
+    for refs in ways:
+        refs = [ref for ref in refs if ref in node_coords]
+        for a, b in zip(refs, refs[1:]):
+            if a == b:
+                continue
+            for ref in (a, b):
+                if ref not in ids:
+                    ids[ref] = len(lats)
+                    lat, lng = node_coords[ref]
+                    lats.append(lat)
+                    lngs.append(lng)
+            src.append(ids[a])
+            dst.append(ids[b])
+
+    lats = np.array(lats, dtype=np.float64)
+    lngs = np.array(lngs, dtype=np.float64)
+    src = np.array(src, dtype=np.int64)
+    dst = np.array(dst, dtype=np.int64)
+
+    lengths = haversine_pairwise(lats[src], lngs[src], lats[dst], lngs[dst])
+
+    mid_lats = (lats[src] + lats[dst]) / 2
+    mid_lngs = (lngs[src] + lngs[dst]) / 2
+    lamp_index = GridIndex(lamps, cell_size_m=SEGMENT_RADIUS_M)
+    amenity_index = GridIndex(amenities, cell_size_m=SEGMENT_RADIUS_M)
+    bad_index = GridIndex(bad_centers, cell_size_m=SEGMENT_RADIUS_M)
+    scores = np.array([
+        segment_score(
+            lamp_index.count_within(lat, lng, SEGMENT_RADIUS_M),
+            amenity_index.count_within(lat, lng, SEGMENT_RADIUS_M),
+            bad_index.any_within(lat, lng, SEGMENT_RADIUS_M),
+        )
+        for lat, lng in zip(mid_lats, mid_lngs)
+    ], dtype=np.float64)
+    safe_cost = lengths * (1 + SAFETY_WEIGHT * (100 - scores) / 100)
+
+    # Both directions of every edge, grouped by source node.
+    all_src = np.concatenate([src, dst])
+    all_dst = np.concatenate([dst, src])
+    order = np.argsort(all_src, kind="stable")
+    indptr = np.zeros(len(lats) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(all_src, minlength=len(lats)), out=indptr[1:])
+    return {
+        "lats": lats,
+        "lngs": lngs,
+        "indptr": indptr,
+        "indices": all_dst[order].astype(np.int32),
+        "length_m": np.concatenate([lengths, lengths])[order],
+        "safe_cost": np.concatenate([safe_cost, safe_cost])[order],
+    }
+
+
+class WalkingRouter:
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.lats = data["lats"]
+            self.lngs = data["lngs"]
+            indptr = data["indptr"]
+            indices = data["indices"]
+            length_m = data["length_m"]
+            safe_cost = data["safe_cost"]
+        # Plain lists keep the per-edge work in the search loop cheap.
+        self._lat = self.lats.tolist()
+        self._lng = self.lngs.tolist()
+        self._indptr = indptr.tolist()
+        self._indices = indices.tolist()
+        self._weights = {"fast": length_m.tolist(), "safe": safe_cost.tolist()}
+        self._lengths = self._weights["fast"]
+        self._node_index = GridIndex(np.stack([self.lats, self.lngs], axis=1), cell_size_m=SNAP_RADIUS_M)
+
+    def __len__(self):
+        return len(self._lat)
+
+    def snap(self, lat, lng):
+        hit = self._node_index.nearest(lat, lng, SNAP_RADIUS_M)
+        return None if hit is None else hit[0]
+
+    def _distance(self, a, b):
+        return haversine_distance_m(self._lat[a], self._lng[a], self._lat[b], self._lng[b])
+
+    def shortest_path(self, source, target, mode="fast"):
+        """
+        Bidirectional A* between two node ids. Both searches share the
+        average potential p(v) = (d(v, target) - d(v, source)) / 2, which
+        keeps reduced costs non-negative in both directions, so the search
+        can stop once the two frontier keys sum past the best meeting cost.
+        Returns the node id list, or None if the nodes are disconnected.
+        """
+        if source == target:
+            return [source]
+        weights = self._weights[mode]
+        indptr, indices = self._indptr, self._indices
+        potentials = {}
+
+        def potential(v):
+            p = potentials.get(v)
+            if p is None:
+                p = (self._distance(v, target) - self._distance(v, source)) / 2
+                potentials[v] = p
+            return p
+
+        dist = ({source: 0.0}, {target: 0.0})
+        parent = ({source: -1}, {target: -1})
+        settled = (set(), set())
+        heaps = ([(potential(source), source)], [(-potential(target), target)])
+        best, meet = math.inf, None
+
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            sign = 1 if side == 0 else -1
+            _, u = heapq.heappop(heaps[side])
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+            near, far = dist[side], dist[1 - side]
+            du = near[u]
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = du + weights[e]
+                if nd < near.get(v, math.inf):
+                    near[v] = nd
+                    parent[side][v] = u
+                    heapq.heappush(heaps[side], (nd + sign * potential(v), v))
+                    other = far.get(v)
+                    if other is not None and nd + other < best:
+                        best, meet = nd + other, v
+
+        if meet is None:
+            return None
+        path = []
+        node = meet
+        while node != -1:
+            path.append(node)
+            node = parent[0][node]
+        path.reverse()
+        node = parent[1][meet]
+        while node != -1:
+            path.append(node)
+            node = parent[1][node]
+        return path
+
+    def path_length_m(self, path):
+        total = 0.0
+        for a, b in zip(path, path[1:]):
+            for e in range(self._indptr[a], self._indptr[a + 1]):
+                if self._indices[e] == b:
+                    total += self._lengths[e]
+                    break
+        return total
+
+    def route(self, origin, destination, mode="fast"):
+        """
+        Walking route between two {lat, lng} dicts in the same shape as
+        fetch_fast_route, or None when either end is off the graph.
+        """
+        source = self.snap(origin["lat"], origin["lng"])
+        target = self.snap(destination["lat"], destination["lng"])
+        if source is None or target is None:
+            return None
+        path = self.shortest_path(source, target, mode)
+        if path is None:
+            return None
+        distance = self.path_length_m(path)
+        return {
+            "coordinates": [[self._lng[n], self._lat[n]] for n in path],
+            "distance_m": round(distance, 1),
+            "duration_s": round(distance / WALKING_SPEED_MPS, 1),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local walking graph.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="Build a CSR walking graph from an .osm / .osm.pbf / Overpass .json extract")
+    build_cmd.add_argument("extract")
+    build_cmd.add_argument("--out", default=str(Path(__file__).resolve().parent / "data" / "walk_graph.npz"))
+    args = parser.parse_args()
+
+    node_coords, ways = read_walk_ways(args.extract)
+    features, _ = read_extract(args.extract)
+    lamps = [(lat, lng) for kind, lat, lng in features if kind == KIND_LAMP]
+    amenities = [
+        (lat, lng) for kind, lat, lng in features
+        if kind in {KIND_POLICE, KIND_HOSPITAL, KIND_PHARMACY}
+    ]
+    bad_centers = [(lat, lng) for kind, lat, lng in features if kind == KIND_BAD_ROAD]
+    graph = build_graph(node_coords, ways, lamps, amenities, bad_centers)
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(args.out, **graph)
+    print(f"Wrote {len(graph['lats'])} nodes and {len(graph['indices'])} directed edges to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+Safety scoring heuristics shared by the live endpoints and the offline
+heatmap builder, so both always agree on what a score means.
+"""
+
+AREA_RADIUS_M = 500.0
+SEGMENT_RADIUS_M = 120.0
+
+
+def area_score(element_count):
+    """get_safety_score heuristic: street lights + police within 500m."""
+    base_score = 20
+    safety_points = min(element_count * 1.5, 75)
+    return int(base_score + safety_points)
+
+
+def area_label(score):
+    if score > 85:
+        return "Very Well Lit"
+    if score > 60:
+        return "Well Lit"
+    if score > 40:
+        return "Moderately Lit"
+    return "Poorly Lit"
+
+
+def segment_score(lamp_count, amenity_count, bad_road):
+    """Route chunk heuristic: base 50, reward lights/amenities, penalize bad roads."""
+    score = 50 + 10 * lamp_count + 20 * amenity_count - (30 if bad_road else 0)
+    return int(max(0, min(100, score)))
+
+
+def segment_label(score):
+    if score >= 75:
+        return "safe"
+    if score >= 45:
+        return "moderate"
+    return "risky"
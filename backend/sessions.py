@@ -0,0 +1,189 @@
+"""
+Login session backends.
+
+  MemorySessions  - in-process dict with expiry; one worker only.
+  SQLiteSessions  - a WAL-mode table every worker on the host shares.
+  SignedTokens    - stateless HMAC-signed tokens that carry the user's id,
+                    name and email, so verifying one needs no lookup at all.
+                    They cannot be revoked before they expire; keep the TTL
+                    short when using them.
+
+Store-backed sessions expire after ttl seconds; start_sweeper() deletes
+expired rows in the background so the store does not grow without bound.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from threading import Thread
+
+from metrics import TimedLock
+
+
+class MemorySessions:
+    self_contained = False
+
+    def __init__(self, ttl=7 * 86400, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self._sessions = {}
+        self._lock = TimedLock("sessions")
+
+    def create(self, user):
+        token = str(uuid.uuid4())
+        with self._lock:
+            self._sessions[token] = (user["id"], self.clock() + self.ttl)
+        return token
+
+    def resolve(self, token):
+        """The user id for a live token, else None."""
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            if entry[1] < self.clock():
+                del self._sessions[token]
+                return None
+            return entry[0]
+
+    def revoke(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def sweep(self):
+        now = self.clock()
+        with self._lock:
+            expired = [token for token, (_, expires_at) in self._sessions.items() if expires_at < now]
+            for token in expired:
+                del self._sessions[token]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessions:
+    self_contained = False
+
+    def __init__(self, path, ttl=7 * 86400, clock=time.time):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = TimedLock("sessions")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                token TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
+            """
+        )
+        self._conn.commit()
+
+    def create(self, user):
+        token = str(uuid.uuid4())
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sessions (token, user_id, expires_at) VALUES (?, ?, ?)",
+                (token, user["id"], self.clock() + self.ttl),
+            )
+        return token
+
+    def resolve(self, token):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT user_id FROM sessions WHERE token = ? AND expires_at >= ?", (token, self.clock())
+            ).fetchone()
+        return row[0] if row else None
+
+    def revoke(self, token):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+    def sweep(self):
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM sessions WHERE expires_at < ?", (self.clock(),)).rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class SignedTokens:
+    """Tokens are base64url(JSON claims) + "." + base64url(HMAC-SHA256 of the claims part)."""
+
+    self_contained = True
+
+    def __init__(self, secret, ttl=86400, clock=time.time):
+        if not secret:
+            raise ValueError("SignedTokens needs a non-empty secret")
+        self.secret = secret.encode("utf-8")
+        self.ttl = ttl
+        self.clock = clock
+
+    def _sign(self, body):
+        return _b64encode(hmac.new(self.secret, body.encode("utf-8"), hashlib.sha256).digest())
+
+    def create(self, user):
+        claims = {
+            "id": user["id"],
+            "name": user.get("name"),
+            "email": user.get("email"),
+            "exp": int(self.clock() + self.ttl),
+        }
+        body = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return f"{body}.{self._sign(body)}"
+
+    def resolve(self, token):
+        """The user profile {"id", "name", "email"} from a valid, unexpired token, else None."""
+        body, _, signature = (token or "").partition(".")
+        if not body or not hmac.compare_digest(signature.encode("utf-8"), self._sign(body).encode("ascii")):
+            return None
+        try:
+            claims = json.loads(_b64decode(body))
+        except ValueError:
+            return None
+        if claims.get("exp", 0) < self.clock():
+            return None
+        return {"id": claims["id"], "name": claims.get("name"), "email": claims.get("email")}
+
+    def revoke(self, token):
+        # Nothing to delete, so logout does not invalidate the token; it
+        # stays valid until it expires.
+        pass
+
+    def sweep(self):
+        return 0
+
+
+def start_sweeper(sessions, interval_s=300.0):
+    """Deletes expired sessions every interval_s seconds on a daemon thread."""
+    def loop():
+        while True:
+            time.sleep(interval_s)
+            try:
+                sessions.sweep()
+            except Exception as exc:
+                print(f"Session sweep failed: {exc}")
+
+    thread = Thread(target=loop, name="session-sweeper", daemon=True)
+    thread.start()
+    return thread
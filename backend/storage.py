@@ -0,0 +1,272 @@
+"""
+Storage for user accounts and hidden-gem progress.
+
+SQLiteStorage (the default) keeps one row per user, unlock and badge in a
+WAL-mode database with indexed lookups by id and email, so a registration
+or unlock writes a single row in its own transaction. JsonStorage keeps the
+original users.json / gem_progress.json layout for small setups; it still
+rewrites the whole file per change, but atomically.
+
+Both expose the same methods; app.py picks one with STORAGE_BACKEND.
+
+    python storage.py migrate --users data/users.json --progress data/gem_progress.json --db data/app.sqlite3
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from metrics import TimedLock
+
+
+class EmailTaken(ValueError):
+    """Raised by create_user when the email is already registered."""
+
+
+def _normalize_email(email):
+    return (email or "").lower().strip()
+
+
+class SQLiteStorage:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = TimedLock("storage")
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                email TEXT NOT NULL UNIQUE,
+                password_hash TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS unlocks (
+                user_id TEXT NOT NULL,
+                gem_id TEXT NOT NULL,
+                unlocked_at REAL NOT NULL,
+                PRIMARY KEY (user_id, gem_id)
+            );
+            CREATE TABLE IF NOT EXISTS badges (
+                user_id TEXT NOT NULL,
+                badge TEXT NOT NULL,
+                earned_at REAL NOT NULL,
+                PRIMARY KEY (user_id, badge)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+
+    @staticmethod
+    def _user(row):
+        if row is None:
+            return None
+        return {"id": row[0], "name": row[1], "email": row[2], "password_hash": row[3]}
+
+    def get_user_by_id(self, user_id):
+        if not user_id:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, name, email, password_hash FROM users WHERE id = ?", (user_id,)
+            ).fetchone()
+        return self._user(row)
+
+    def get_user_by_email(self, email):
+        if not email:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, name, email, password_hash FROM users WHERE email = ?", (_normalize_email(email),)
+            ).fetchone()
+        return self._user(row)
+
+    def create_user(self, user):
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO users (id, name, email, password_hash, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (user["id"], user["name"], _normalize_email(user["email"]), user["password_hash"], time.time()),
+                )
+        except sqlite3.IntegrityError as exc:
+            raise EmailTaken(user["email"]) from exc
+        return user
+
+    def get_progress(self, user_id):
+        """{"badges": [...], "unlocked": [...]} in the order they were earned."""
+        with self._lock:
+            unlocked = [row[0] for row in self._conn.execute(
+                "SELECT gem_id FROM unlocks WHERE user_id = ? ORDER BY unlocked_at, rowid", (user_id,)
+            )]
+            badges = [row[0] for row in self._conn.execute(
+                "SELECT badge FROM badges WHERE user_id = ? ORDER BY earned_at, rowid", (user_id,)
+            )]
+        return {"badges": badges, "unlocked": unlocked}
+
+    def unlock_gem(self, user_id, gem_id, badge=None):
+        """Records an unlock (and its badge) in one transaction; False if it was already unlocked."""
+        now = time.time()
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO unlocks (user_id, gem_id, unlocked_at) VALUES (?, ?, ?)",
+                (user_id, gem_id, now),
+            )
+            if cur.rowcount == 0:
+                return False
+            if badge:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO badges (user_id, badge, earned_at) VALUES (?, ?, ?)",
+                    (user_id, badge, now),
+                )
+        return True
+
+    def unlocks_since(self, cursor=None):
+        """
+        ([(user_id, gem_id, unlocked_at)], cursor) for unlocks recorded after
+        cursor, in insertion order; pass the returned cursor next time.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid, user_id, gem_id, unlocked_at FROM unlocks WHERE rowid > ? ORDER BY rowid",
+                (cursor or 0,),
+            ).fetchall()
+        if not rows:
+            return [], cursor
+        return [row[1:] for row in rows], rows[-1][0]
+
+    def import_json(self, users, progress):
+        """
+        Copies users.json / gem_progress.json contents in one transaction.
+        Existing rows win, so the import can be re-run safely. Returns
+        (users, unlocks) inserted.
+        """
+        now = time.time()
+        added_users = added_unlocks = 0
+        with self._lock, self._conn:
+            for user in users.get("users", []):
+                cur = self._conn.execute(
+                    "INSERT OR IGNORE INTO users (id, name, email, password_hash, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (user["id"], user.get("name", ""), _normalize_email(user.get("email")),
+                     user.get("password_hash", ""), now),
+                )
+                added_users += cur.rowcount
+            for user_id, profile in progress.get("users", {}).items():
+                # The JSON carries no unlock times. As in JsonStorage they count
+                # as time 0, so they stay out of the week / month boards, with
+                # strictly increasing offsets to keep the JSON list order.
+                for offset, gem_id in enumerate(profile.get("unlocked", [])):
+                    cur = self._conn.execute(
+                        "INSERT OR IGNORE INTO unlocks (user_id, gem_id, unlocked_at) VALUES (?, ?, ?)",
+                        (user_id, gem_id, offset * 1e-3),
+                    )
+                    added_unlocks += cur.rowcount
+                for offset, badge in enumerate(profile.get("badges", [])):
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO badges (user_id, badge, earned_at) VALUES (?, ?, ?)",
+                        (user_id, badge, offset * 1e-3),
+                    )
+        return added_users, added_unlocks
+
+
+def _write_json_atomic(path, data):
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as fh:
+        json.dump(data, fh, indent=2)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def load_json(path, default):
+    path = Path(path)
+    if path.exists():
+        try:
+            with path.open("r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except Exception as exc:
+            print(f"Failed to parse {path}: {exc}. Starting from defaults.")
+    return default
+
+
+class JsonStorage:
+    def __init__(self, users_path, progress_path):
+        self.users_path = Path(users_path)
+        self.progress_path = Path(progress_path)
+        self.users_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = TimedLock("storage")
+        self.users_data = load_json(self.users_path, {"users": []})
+        self.progress_data = load_json(self.progress_path, {"users": {}})
+        self._by_id = {user["id"]: user for user in self.users_data.get("users", [])}
+        self._by_email = {_normalize_email(user.get("email")): user for user in self.users_data.get("users", [])}
+        # The JSON files carry no unlock times; those unlocks count as time 0.
+        self._unlock_log = [
+            (user_id, gem_id, 0.0)
+            for user_id, profile in self.progress_data.get("users", {}).items()
+            for gem_id in profile.get("unlocked", [])
+        ]
+
+    def get_user_by_id(self, user_id):
+        return self._by_id.get(user_id) if user_id else None
+
+    def get_user_by_email(self, email):
+        return self._by_email.get(_normalize_email(email)) if email else None
+
+    def create_user(self, user):
+        with self._lock:
+            email = _normalize_email(user["email"])
+            if email in self._by_email:
+                raise EmailTaken(user["email"])
+            self.users_data.setdefault("users", []).append(user)
+            self._by_id[user["id"]] = user
+            self._by_email[email] = user
+            _write_json_atomic(self.users_path, self.users_data)
+        return user
+
+    def get_progress(self, user_id):
+        with self._lock:
+            profile = self.progress_data["users"].get(user_id) or {}
+            return {"badges": list(profile.get("badges", [])), "unlocked": list(profile.get("unlocked", []))}
+
+    def unlock_gem(self, user_id, gem_id, badge=None):
+        with self._lock:
+            profile = self.progress_data["users"].setdefault(user_id, {"badges": [], "unlocked": []})
+            if gem_id in profile["unlocked"]:
+                return False
+            profile["unlocked"].append(gem_id)
+            if badge and badge not in profile["badges"]:
+                profile["badges"].append(badge)
+            _write_json_atomic(self.progress_path, self.progress_data)
+            self._unlock_log.append((user_id, gem_id, time.time()))
+        return True
+
+    def unlocks_since(self, cursor=None):
+        with self._lock:
+            start = cursor or 0
+            return self._unlock_log[start:], len(self._unlock_log)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the user / progress database.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="Copy users.json and gem_progress.json into SQLite")
+    migrate.add_argument("--users", default="data/users.json")
+    migrate.add_argument("--progress", default="data/gem_progress.json")
+    migrate.add_argument("--db", default="data/app.sqlite3")
+    args = parser.parse_args()
+
+    store = SQLiteStorage(args.db)
+    users, unlocks = store.import_json(load_json(args.users, {"users": []}), load_json(args.progress, {"users": {}}))
+    print(f"Imported {users} users and {unlocks} unlocks into {args.db}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Backend modules import each other by name; app writes under DATA_DIR on import.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="backend-tests-"))
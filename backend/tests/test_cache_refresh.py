@@ -0,0 +1,98 @@
+"""Stale-while-revalidate and refresh-ahead behave the same on the Flask and async paths."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def aged_cache(mode):
+    """A cache holding "old" under key 1, aged so the next lookup should refresh it."""
+    clock = Clock()
+    if mode == "stale":
+        cache = TTLCache(ttl=10, stale_ttl=10, clock=clock)
+    else:
+        cache = TTLCache(ttl=10, refresh_ahead=0.5, refresh_min_hits=1, clock=clock)
+    cache.set(1, "old")
+    clock.now = 15 if mode == "stale" else 6
+    return cache
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("mode", ["stale", "refresh_ahead"])
+def test_sync_serves_old_value_and_refreshes_in_background(mode):
+    cache = aged_cache(mode)
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(2)
+        return "new"
+
+    assert cache.get_or_compute(1, compute) == "old"
+    assert cache.get_or_compute(1, compute) == "old"
+    release.set()
+    wait_for(lambda: cache.stats()["refreshes"] == 1)
+    assert cache.get(1) == "new"
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("mode", ["stale", "refresh_ahead"])
+def test_async_serves_old_value_and_refreshes_in_background(mode):
+    import asgi
+
+    cache = aged_cache(mode)
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def compute():
+            calls.append(1)
+            await release.wait()
+            return "new"
+
+        assert await asgi.single_flight(cache, 1, compute) == "old"
+        assert await asgi.single_flight(cache, 1, compute) == "old"
+        release.set()
+        while cache.stats()["refreshes"] == 0:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(asyncio.wait_for(main(), 2))
+    assert cache.get(1) == "new"
+    assert len(calls) == 1
+
+
+def test_async_miss_is_computed_once():
+    import asgi
+
+    cache = TTLCache(ttl=10)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(asgi.single_flight(cache, 1, compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["value"] * 5
+    assert len(calls) == 1
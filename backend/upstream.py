@@ -0,0 +1,325 @@
+"""
+Shared client for third-party HTTP APIs.
+
+Each upstream gets its own requests.Session (keep-alive connection pool),
+a bounded retry policy with jittered exponential backoff, a circuit
+breaker, and latency / error counters. Callers keep their existing
+fallbacks: an open breaker raises UpstreamUnavailable immediately instead
+of letting a worker thread sit on a dead upstream.
+
+AsyncUpstream is the asyncio counterpart used by the ASGI server (asgi.py).
+It shares its Upstream's breaker and counters, so both serving modes see
+the same circuit state and /api/upstreams reports one set of numbers.
+"""
+import asyncio
+import json
+import random
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import REGISTRY
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    "upstream_request_duration_seconds",
+    "Latency of each upstream call attempt, by outcome (ok / error).",
+    ("upstream", "outcome"),
+)
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    "upstream_requests_in_flight", "Upstream calls currently waiting on a response.", ("upstream",)
+)
+UPSTREAM_SHORT_CIRCUITS = REGISTRY.counter(
+    "upstream_short_circuits_total", "Calls rejected by an open circuit breaker.", ("upstream",)
+)
+
+
+@contextmanager
+def track_call(name):
+    """
+    Times a call made outside Upstream (e.g. the Gemini SDK) into the same
+    upstream metrics; an exception counts as an error.
+    """
+    UPSTREAM_IN_FLIGHT.inc(upstream=name)
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        UPSTREAM_IN_FLIGHT.dec(upstream=name)
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, upstream=name, outcome=outcome)
+
+
+class UpstreamUnavailable(RuntimeError):
+    """Raised without a network call while an upstream's circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures, rejects calls for
+    reset_after seconds, then lets a single trial call through (half-open).
+    A successful trial closes the circuit; a failed one reopens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_after=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_after:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def release(self):
+        """Frees a half-open trial slot without counting a result, e.g. when the caller gave up."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._trial_in_flight = False
+
+
+class Upstream:
+    def __init__(self, name, retries=2, backoff=0.2, pool_size=20,
+                 failure_threshold=5, reset_after=30.0):
+        self.name = name
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_after)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = Lock()
+        self.calls = 0
+        self.errors = 0
+        self.retried = 0
+        self.short_circuits = 0
+        self.latency_total_s = 0.0
+        self.latency_max_s = 0.0
+
+    def _record(self, elapsed, failed):
+        UPSTREAM_LATENCY.observe(elapsed, upstream=self.name, outcome="error" if failed else "ok")
+        with self._lock:
+            self.calls += 1
+            self.latency_total_s += elapsed
+            self.latency_max_s = max(self.latency_max_s, elapsed)
+            if failed:
+                self.errors += 1
+
+    def _admit(self):
+        if not self.breaker.allow():
+            with self._lock:
+                self.short_circuits += 1
+            UPSTREAM_SHORT_CIRCUITS.inc(upstream=self.name)
+            raise UpstreamUnavailable(f"{self.name} circuit open; skipping call")
+
+    def _settle(self, resp, elapsed, attempt):
+        """Records a response; True when it is final rather than retried."""
+        failed = resp.status_code >= 500 or resp.status_code == 429
+        self._record(elapsed, failed=failed)
+        if resp.status_code not in RETRY_STATUSES or attempt >= self.retries:
+            if failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return True
+        return False
+
+    def _next_backoff(self, attempt):
+        with self._lock:
+            self.retried += 1
+        # Full jitter keeps concurrent retries from arriving in lockstep.
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends the request, retrying connection errors and 429/502/503/504 up
+        to `retries` times. Read timeouts are not retried: a slow upstream
+        would only double the wait. Returns the final response (callers still
+        call raise_for_status) or raises the last error.
+        """
+        self._admit()
+        UPSTREAM_IN_FLIGHT.inc(upstream=self.name)
+        try:
+            return self._request(method, url, **kwargs)
+        finally:
+            UPSTREAM_IN_FLIGHT.dec(upstream=self.name)
+
+    def _request(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                self._record(time.perf_counter() - start, failed=True)
+                # ConnectTimeout is a ConnectionError; ReadTimeout is not.
+                if not isinstance(exc, requests.ConnectionError) or attempt >= self.retries:
+                    self.breaker.record_failure()
+                    raise
+            except BaseException:
+                # Anything else (e.g. a broken chunked body) must still settle
+                # the breaker, or a half-open trial would never finish.
+                self._record(time.perf_counter() - start, failed=True)
+                self.breaker.record_failure()
+                raise
+            else:
+                if self._settle(resp, time.perf_counter() - start, attempt):
+                    return resp
+            attempt += 1
+            time.sleep(self._next_backoff(attempt))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "retries": self.retried,
+                "short_circuits": self.short_circuits,
+                "latency_avg_ms": round(1000 * self.latency_total_s / self.calls, 1) if self.calls else 0.0,
+                "latency_max_ms": round(1000 * self.latency_max_s, 1),
+                "circuit": self.breaker.state,
+            }
+
+
+class UpstreamHTTPError(RuntimeError):
+    """Raised by AsyncResponse.raise_for_status for 4xx / 5xx responses."""
+
+
+class AsyncResponse:
+    """Fully read aiohttp response with the requests-style surface callers use."""
+
+    def __init__(self, status_code, body, url):
+        self.status_code = status_code
+        self.content = body
+        self.url = url
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise UpstreamHTTPError(f"{self.status_code} error for {self.url}")
+
+
+class AsyncUpstream:
+    """
+    Same request policy as Upstream on an aiohttp session, so a waiting
+    call costs a coroutine rather than a thread. aiohttp is only needed by
+    the async server and is imported here on first use. Accepts the
+    requests-style params / json / headers / timeout (seconds) arguments.
+    """
+
+    def __init__(self, upstream, max_connections=1000):
+        self.upstream = upstream
+        self.max_connections = max_connections
+        self._session = None
+
+    def _client(self):
+        # aiohttp sessions belong to the running loop, so create on first use.
+        if self._session is None:
+            import aiohttp
+
+            self._aiohttp = aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+            )
+        return self._session
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        self.upstream._admit()
+        UPSTREAM_IN_FLIGHT.inc(upstream=self.upstream.name)
+        try:
+            return await self._request(method, url, timeout, **kwargs)
+        finally:
+            UPSTREAM_IN_FLIGHT.dec(upstream=self.upstream.name)
+
+    async def _request(self, method, url, timeout, **kwargs):
+        session = self._client()
+        aiohttp = self._aiohttp
+        upstream = self.upstream
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                async with session.request(method, url, **kwargs) as raw:
+                    resp = AsyncResponse(raw.status, await raw.read(), url)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+                upstream._record(time.perf_counter() - start, failed=True)
+                # Only failures to connect are retried, as in Upstream.request.
+                retryable = isinstance(exc, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError))
+                if not retryable or attempt >= upstream.retries:
+                    upstream.breaker.record_failure()
+                    raise
+            except asyncio.CancelledError:
+                # The caller gave up (a geocode deadline or the request's
+                # wait_for); that says nothing about the upstream's health.
+                upstream.breaker.release()
+                raise
+            except BaseException:
+                # Payload errors and the like settle the breaker, as in Upstream._request.
+                upstream._record(time.perf_counter() - start, failed=True)
+                upstream.breaker.record_failure()
+                raise
+            else:
+                if upstream._settle(resp, time.perf_counter() - start, attempt):
+                    return resp
+            attempt += 1
+            try:
+                await asyncio.sleep(upstream._next_backoff(attempt))
+            except asyncio.CancelledError:
+                upstream.breaker.release()
+                raise
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
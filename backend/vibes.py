@@ -0,0 +1,206 @@
+"""
+Per-place review sentiment kept as running aggregates.
+
+Every review is scored with VADER once: at load, by the rescore command, or
+when it is appended. A place keeps only the compound-score sum, how many
+reviews were positive, the sample size and a few snippets, so a vibe lookup
+is a dict access instead of a pass over its reviews.
+
+Appended reviews go to a JSONL log together with their scores. Each worker
+tails the log from its own offset, so appends made on one worker reach the
+others on their next sync without anything being re-scored.
+
+Large review dumps can be scored across processes ahead of time:
+
+    python vibes.py rescore --reviews data/review_samples.json --out data/vibe_aggregates.json --workers 4
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from threading import Lock
+
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer  # type: ignore
+
+POSITIVE_THRESHOLD = 0.05
+SNIPPET_COUNT = 5
+
+_analyzer = None
+
+
+def score_texts(texts):
+    """VADER compound scores, one per text."""
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = SentimentIntensityAnalyzer()
+    return [_analyzer.polarity_scores(text)["compound"] for text in texts]
+
+
+def place_key(name):
+    return " ".join((name or "").lower().split())
+
+
+def new_aggregate():
+    return {"sum": 0.0, "positive": 0, "count": 0, "snippets": [], "updated_at": time.time()}
+
+
+def add_scores(aggregate, texts, compounds):
+    aggregate["sum"] += sum(compounds)
+    aggregate["positive"] += sum(1 for score in compounds if score >= POSITIVE_THRESHOLD)
+    aggregate["count"] += len(compounds)
+    room = SNIPPET_COUNT - len(aggregate["snippets"])
+    if room > 0:
+        aggregate["snippets"].extend(texts[:room])
+    aggregate["updated_at"] = time.time()
+    return aggregate
+
+
+def _score_place(item):
+    key, texts = item
+    return key, add_scores(new_aggregate(), texts, score_texts(texts))
+
+
+def rescore(reviews, workers=1, chunksize=32):
+    """{place key: aggregate} for a {place name: [review text]} mapping."""
+    items = [(place_key(name), list(texts)) for name, texts in reviews.items() if texts]
+    if workers <= 1:
+        return dict(map(_score_place, items))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(_score_place, items, chunksize=chunksize))
+
+
+def _write_json_atomic(path, data):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp.open("w", encoding="utf-8") as fh:
+        json.dump(data, fh)
+    os.replace(tmp, path)
+
+
+def load_aggregates(reviews_path, aggregates_path, workers=1):
+    """
+    Aggregates for reviews_path, read from aggregates_path when it was built
+    from the current file and rebuilt (and saved) otherwise.
+    """
+    reviews_path, aggregates_path = Path(reviews_path), Path(aggregates_path)
+    source_mtime = reviews_path.stat().st_mtime if reviews_path.exists() else None
+    if aggregates_path.exists():
+        try:
+            with aggregates_path.open("r", encoding="utf-8") as fh:
+                saved = json.load(fh)
+            if saved.get("source_mtime") == source_mtime:
+                return saved["places"]
+        except Exception as exc:
+            print(f"Failed to read {aggregates_path}: {exc}. Rescoring reviews.")
+    reviews = {}
+    if source_mtime is not None:
+        with reviews_path.open("r", encoding="utf-8") as fh:
+            reviews = json.load(fh)
+    places = rescore(reviews, workers=workers)
+    try:
+        _write_json_atomic(aggregates_path, {"source_mtime": source_mtime, "places": places})
+    except OSError as exc:
+        print(f"Failed to save {aggregates_path}: {exc}")
+    return places
+
+
+class VibeIndex:
+    def __init__(self, aggregates, appends_path):
+        self.aggregates = aggregates
+        self.appends_path = Path(appends_path)
+        self._offset = 0
+        self._lock = Lock()
+        self._sync_lock = Lock()
+
+    def __len__(self):
+        return len(self.aggregates)
+
+    def __contains__(self, key):
+        return key in self.aggregates
+
+    def get(self, key):
+        return self.aggregates.get(key)
+
+    def summary(self, key):
+        """{"score", "positive_pct", "sample_size", "snippets", "refreshed_at"} for a place, else None."""
+        aggregate = self.aggregates.get(key)
+        if not aggregate or not aggregate["count"]:
+            return None
+        count = aggregate["count"]
+        return {
+            "score": round(aggregate["sum"] / count, 3),
+            "positive_pct": int(aggregate["positive"] / count * 100),
+            "snippets": list(aggregate["snippets"]),
+            "sample_size": count,
+            "refreshed_at": aggregate["updated_at"],
+        }
+
+    def _apply(self, key, texts, compounds):
+        with self._lock:
+            aggregate = self.aggregates.get(key)
+            if aggregate is None:
+                aggregate = self.aggregates[key] = new_aggregate()
+            add_scores(aggregate, texts, compounds)
+
+    def append(self, name, texts):
+        """Scores new reviews for a place and logs them; returns the place key."""
+        key = place_key(name)
+        line = json.dumps({"place": key, "reviews": texts, "compounds": score_texts(texts)}) + "\n"
+        self.appends_path.parent.mkdir(parents=True, exist_ok=True)
+        # One write() on an O_APPEND file, so lines from several workers never interleave.
+        fd = os.open(self.appends_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+        self.sync()
+        return key
+
+    def sync(self):
+        """Applies log lines written since the last sync; returns the place keys they touched."""
+        try:
+            size = self.appends_path.stat().st_size
+        except FileNotFoundError:
+            return set()
+        if size <= self._offset:
+            return set()
+        touched = set()
+        with self._sync_lock:
+            with self.appends_path.open("rb") as fh:
+                fh.seek(self._offset)
+                for raw in fh:
+                    if not raw.endswith(b"\n"):
+                        break  # a write still in progress; read it next time
+                    self._offset += len(raw)
+                    try:
+                        entry = json.loads(raw)
+                        self._apply(entry["place"], entry["reviews"], entry["compounds"])
+                    except (ValueError, KeyError) as exc:
+                        print(f"Skipping bad review log line: {exc}")
+                        continue
+                    touched.add(entry["place"])
+        return touched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute per-place review sentiment.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("rescore", help="Score every review and write the aggregates file")
+    cmd.add_argument("--reviews", default="data/review_samples.json")
+    cmd.add_argument("--out", default="data/vibe_aggregates.json")
+    cmd.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    reviews_path, out = Path(args.reviews), Path(args.out)
+    with reviews_path.open("r", encoding="utf-8") as fh:
+        reviews = json.load(fh)
+    start = time.perf_counter()
+    places = rescore(reviews, workers=args.workers)
+    _write_json_atomic(out, {"source_mtime": reviews_path.stat().st_mtime, "places": places})
+    total = sum(aggregate["count"] for aggregate in places.values())
+    print(f"Scored {total} reviews for {len(places)} places in {time.perf_counter() - start:.1f}s -> {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Checks the batched NumPy haversine kernels in backend/geo.py against the
+scalar haversine_distance_m and times both.
+
+    python scripts/bench_geodesic.py
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import numpy as np  # noqa: E402
+
+from geo import (  # noqa: E402
+    BATCH_TOLERANCE_M,
+    haversine_distance_m,
+    haversine_matrix,
+    haversine_one_to_many,
+)
+
+
+def main():
+    rng = random.Random(11)
+    origin = (15.8497, 74.4977)
+    for n in (1_000, 10_000, 100_000):
+        lats = np.array([rng.uniform(-89.0, 89.0) for _ in range(n)])
+        lngs = np.array([rng.uniform(-180.0, 180.0) for _ in range(n)])
+
+        start = time.perf_counter()
+        scalar = [haversine_distance_m(origin[0], origin[1], la, lo) for la, lo in zip(lats, lngs)]
+        scalar_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched = haversine_one_to_many(origin[0], origin[1], lats, lngs)
+        batched_s = time.perf_counter() - start
+
+        err = float(np.max(np.abs(batched - np.array(scalar))))
+        assert err <= BATCH_TOLERANCE_M, f"max error {err} m exceeds {BATCH_TOLERANCE_M} m"
+        print(
+            f"one-to-many n={n:>7}: scalar {scalar_s:.4f}s, batched {batched_s:.4f}s, "
+            f"{scalar_s / batched_s:.0f}x, max err {err:.2e} m"
+        )
+
+    lats = np.array([rng.uniform(15.7, 16.0) for _ in range(300)])
+    lngs = np.array([rng.uniform(74.4, 74.6) for _ in range(300)])
+    matrix = haversine_matrix(lats, lngs, lats, lngs)
+    spot = [
+        (i, j, haversine_distance_m(lats[i], lngs[i], lats[j], lngs[j]))
+        for i, j in ((0, 1), (17, 250), (299, 3))
+    ]
+    for i, j, expected in spot:
+        assert abs(matrix[i, j] - expected) <= BATCH_TOLERANCE_M
+    print(f"many-to-many {matrix.shape}: spot checks within {BATCH_TOLERANCE_M} m")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Compares per-segment feature counting in analyze_route_safety against the
+old full-scan loop, for a synthetic 5 km route over growing lamp counts.
+
+    python scripts/bench_route_safety.py
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from geo import GridIndex, haversine_distance_m  # noqa: E402
+
+RADIUS_M = 120.0
+CENTER = (15.8497, 74.4977)
+
+
+def make_route(n_points=250, length_deg=0.045):
+    lat0, lng0 = CENTER
+    return [
+        [lng0 + length_deg * i / n_points, lat0 + 0.3 * length_deg * i / n_points]
+        for i in range(n_points)
+    ]
+
+
+def make_features(n, rng):
+    lat0, lng0 = CENTER
+    return [(lat0 + rng.uniform(-0.03, 0.03), lng0 + rng.uniform(-0.03, 0.06)) for _ in range(n)]
+
+
+def midpoints(coords):
+    chunk_size = max(2, min(8, len(coords) // 20 or 3))
+    mids = []
+    for i in range(0, len(coords) - 1, chunk_size):
+        group = coords[i : min(i + chunk_size, len(coords))]
+        if len(group) < 2:
+            continue
+        mid_lng, mid_lat = group[len(group) // 2]
+        mids.append((mid_lat, mid_lng))
+    return mids
+
+
+def scan_counts(mids, lamps):
+    return [
+        sum(1 for (la, lo) in lamps if haversine_distance_m(lat, lng, la, lo) <= RADIUS_M)
+        for lat, lng in mids
+    ]
+
+
+def grid_counts(mids, lamps):
+    index = GridIndex(lamps, cell_size_m=RADIUS_M)
+    return [index.count_within(lat, lng, RADIUS_M) for lat, lng in mids]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    rng = random.Random(7)
+    mids = midpoints(make_route())
+    print(f"{len(mids)} segments, radius {RADIUS_M:.0f} m")
+    print(f"{'lamps':>8} {'scan (s)':>10} {'grid (s)':>10} {'speedup':>8}")
+    for n in (1_000, 5_000, 20_000, 50_000):
+        lamps = make_features(n, rng)
+        scan, scan_s = timed(scan_counts, mids, lamps)
+        grid, grid_s = timed(grid_counts, mids, lamps)
+        assert scan == grid, "grid index disagrees with full scan"
+        print(f"{n:>8} {scan_s:>10.3f} {grid_s:>10.3f} {scan_s / grid_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,557 @@
+"""
+Reproducible benchmarks for the backend, with no live third-party calls.
+
+  micro    Times hot paths in-process at synthetic data sizes:
+           haversine_distance_m (and the batched kernel), analyze_route_safety
+           over cached corridor tiles, compute_leaderboard over a bulk-loaded
+           user database, and the /api/vibe handler over a synthetic place
+           catalog. Upstream endpoints point at a closed local port.
+  load     Starts the upstream stand-ins (scripts/stand_ins.py) and a server
+           (threaded Flask or the ASGI app), drives a weighted endpoint mix
+           for --duration seconds and reports throughput and p50/p95/p99 per
+           endpoint.
+  compare  Diffs two result files and exits 1 when any metric regressed by
+           more than --threshold.
+
+    python scripts/bench_suite.py micro --out micro.json
+    python scripts/bench_suite.py load --server threaded --concurrency 32 --duration 20 \\
+        --latency 0.2 --latency overpass=0.8 --error-rate ors=0.05 --out load.json
+    python scripts/bench_suite.py compare baseline.json micro.json
+
+Every run writes to a throwaway DATA_DIR seeded from backend/data, so real
+data and caches are never touched.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = SCRIPTS_DIR.parent / "backend"
+SEED_FILES = ("hidden_gems.json", "review_samples.json")
+CENTER = (15.8497, 74.4977)
+CLOSED_PORT_URL = "http://127.0.0.1:9"
+# Questions are paired with landmarks so /api/query mostly exercises the
+# model, weather and geocoding path instead of settling into answer_cache hits.
+QUERIES = (
+    "quiet cafe to read in",
+    "where can I get street food tonight",
+    "best park for an evening walk",
+    "is it a good day to visit the fort",
+    "cheap places to eat near the bus stand",
+    "temples worth seeing nearby",
+    "where to buy fresh fruit this morning",
+    "rooftop spots with a view",
+)
+LANDMARKS = ("the fort", "the lake", "the station", "the market", "the university", "the old town", "the stadium", "the hospital")
+
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+import stand_ins  # noqa: E402
+
+
+def seed_data_dir(path):
+    for name in SEED_FILES:
+        source = BACKEND_DIR / "data" / name
+        if source.exists():
+            shutil.copy(source, Path(path) / name)
+
+
+def run_meta():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+
+
+def write_results(results, out):
+    text = json.dumps(results, indent=2)
+    if out:
+        Path(out).write_text(text + "\n", encoding="utf-8")
+        print(f"Saved results to {out}")
+
+
+# --- micro-benchmarks ---
+
+def measure(fn, repeat=5, min_time_s=0.05, max_number=1_000_000):
+    """Per-call timings of fn: the loop count is doubled until one repeat takes min_time_s."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time_s or number >= max_number:
+            break
+        number *= 2
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    median = statistics.median(samples)
+    return {
+        "calls_per_repeat": number,
+        "repeat": repeat,
+        "median_s": median,
+        "min_s": min(samples),
+        "max_s": max(samples),
+        "ops_per_s": 1 / median if median else None,
+    }
+
+
+def import_backend(data_dir):
+    os.environ.update({
+        "DATA_DIR": str(data_dir),
+        "SESSION_BACKEND": "memory",
+        "ORS_API_KEY": "bench",
+        "ORS_ENDPOINT": f"{CLOSED_PORT_URL}/ors",
+        "OVERPASS_ENDPOINT": f"{CLOSED_PORT_URL}/overpass",
+        "OVERPASS_MIRROR_ENDPOINT": f"{CLOSED_PORT_URL}/overpass",
+        "GEOCODER_ENDPOINT": f"{CLOSED_PORT_URL}/photon",
+        "WEATHER_ENDPOINT": f"{CLOSED_PORT_URL}/open-meteo",
+        "GEMINI_API_KEY": "",
+    })
+    sys.path.insert(0, str(BACKEND_DIR))
+    import app
+
+    return app
+
+
+def make_route(n_points=250, length_deg=0.045):
+    lat0, lng0 = CENTER
+    return [[lng0 + length_deg * i / n_points, lat0 + 0.3 * length_deg * i / n_points] for i in range(n_points)]
+
+
+def bench_haversine(app, rng, sizes):
+    import numpy as np
+    from geo import haversine_distance_m, haversine_one_to_many
+
+    results = {}
+    pairs = [(rng.uniform(-80, 80), rng.uniform(-180, 180)) for _ in range(1024)]
+    state = {"i": 0}
+
+    def scalar():
+        lat, lng = pairs[state["i"] & 1023]
+        state["i"] += 1
+        haversine_distance_m(CENTER[0], CENTER[1], lat, lng)
+
+    results["haversine_distance_m"] = measure(scalar)
+    for n in sizes:
+        lats = np.array([rng.uniform(-80, 80) for _ in range(n)])
+        lngs = np.array([rng.uniform(-180, 180) for _ in range(n)])
+        results[f"haversine_one_to_many[n={n}]"] = measure(lambda: haversine_one_to_many(CENTER[0], CENTER[1], lats, lngs))
+    return results
+
+
+def bench_route_safety(app, rng, sizes):
+    """analyze_route_safety on a 5 km route, with n features spread over its cached corridor tiles."""
+    import numpy as np
+    from feature_store import KIND_BAD_ROAD, KIND_LAMP, KIND_POLICE
+
+    results = {}
+    coords = make_route()
+    planner = app.overpass_planner
+    tiles = sorted(planner.corridor_tiles(coords))
+    for n in sizes:
+        app.overpass_tile_cache._data.clear()
+        kinds = rng.choices([KIND_LAMP, KIND_POLICE, KIND_BAD_ROAD], weights=[85, 3, 12], k=n)
+        per_tile = {tile: [] for tile in tiles}
+        for kind in kinds:
+            row, col = rng.choice(tiles)
+            lat = (row + rng.random()) * planner.tile_deg
+            lng = (col + rng.random()) * planner.tile_deg
+            per_tile[(row, col)].append((kind, lat, lng))
+        for tile, rows in per_tile.items():
+            app.overpass_tile_cache.set(tile, np.array(rows, dtype=np.float64).reshape(-1, 3))
+        results[f"analyze_route_safety[features={n}]"] = measure(lambda: app.analyze_route_safety(coords), repeat=3)
+    return results
+
+
+def bench_leaderboard(app, rng, sizes, data_dir):
+    """compute_leaderboard over n users with ~5 unlocks each: first (full) sync, then warm calls."""
+    from leaderboard import Leaderboards
+    from storage import SQLiteStorage
+
+    results = {}
+    gem_ids = list(app.gem_catalog.by_id) or ["gem"]
+    saved = app.storage, app.leaderboards
+    try:
+        for n in sizes:
+            store = SQLiteStorage(Path(data_dir) / f"bench-leaderboard-{n}.sqlite3")
+            now = time.time()
+            users = [(f"user-{i}", f"User {i}", f"user{i}@bench.test", "-", now) for i in range(n)]
+            unlocks = {
+                (f"user-{rng.randrange(n)}", rng.choice(gem_ids), now - rng.uniform(0, 60 * 86400))
+                for _ in range(5 * n)
+            }
+            # Bulk load straight into the tables; going through unlock_gem would time SQLite commits.
+            with store._conn:
+                store._conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?)", users)
+                store._conn.executemany("INSERT OR IGNORE INTO unlocks VALUES (?, ?, ?)", sorted(unlocks, key=lambda u: u[2]))
+            app.storage = store
+            app.leaderboards = Leaderboards(app.gem_region)
+            start = time.perf_counter()
+            app.compute_leaderboard(limit=10)
+            results[f"compute_leaderboard[users={n}].first_sync"] = {"median_s": time.perf_counter() - start}
+            results[f"compute_leaderboard[users={n}]"] = measure(lambda: app.compute_leaderboard(limit=10))
+            results[f"compute_leaderboard[users={n},window=week]"] = measure(
+                lambda: app.compute_leaderboard(limit=10, window="week")
+            )
+    finally:
+        app.storage, app.leaderboards = saved
+    return results
+
+
+def bench_vibe(app, rng, sizes, data_dir):
+    """GET /api/vibe through the Flask test client over n synthetic places: cache hits and fuzzy misses."""
+    from cache import TTLCache
+    from place_index import PlaceNameIndex
+    from vibes import VibeIndex, add_scores, new_aggregate
+
+    results = {}
+    client = app.app.test_client()
+    # require_auth looks the user up in storage, so register a real one.
+    user = app.create_user("Bench", "bench@bench.test", "bench-password")
+    token = app.create_session(user)
+    headers = {"Authorization": f"Bearer {token}"}
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = ["".join(rng.choice(letters) for _ in range(rng.randint(4, 9))) for _ in range(5000)]
+    kinds = ["cafe", "park", "market", "temple", "bus stand", "library", "hotel"]
+    saved = app.vibe_index, app.place_names, app.vibe_cache
+    try:
+        for n in sizes:
+            aggregates = {}
+            while len(aggregates) < n:
+                name = f"{rng.choice(words)} {rng.choice(words)} {rng.choice(kinds)}"
+                compounds = [rng.uniform(-1, 1) for _ in range(rng.randint(3, 12))]
+                aggregates[name] = add_scores(new_aggregate(), [f"review of {name}"] * len(compounds), compounds)
+            names = list(aggregates)
+            app.vibe_index = VibeIndex(aggregates, Path(data_dir) / f"bench-appends-{n}.jsonl")
+            app.place_names = PlaceNameIndex(names)
+            # Misspell the first word so lookups go through the fuzzy path.
+            queries = [f"{name.split()[0][:-1]}x {' '.join(name.split()[1:])}" for name in rng.sample(names, min(n, 512))]
+            state = {"i": 0}
+
+            def hit():
+                resp = client.get("/api/vibe", query_string={"name": names[0]}, headers=headers)
+                assert resp.status_code == 200, resp.get_json()
+
+            def miss():
+                app.vibe_cache = TTLCache(max_entries=8, ttl=900)
+                query = queries[state["i"] % len(queries)]
+                state["i"] += 1
+                resp = client.get("/api/vibe", query_string={"name": query}, headers=headers)
+                assert resp.status_code == 200, resp.get_json()
+
+            app.vibe_cache = TTLCache(max_entries=1000, ttl=900)
+            results[f"handle_vibe[places={n}].cache_hit"] = measure(hit)
+            results[f"handle_vibe[places={n}].fuzzy_miss"] = measure(miss)
+    finally:
+        app.vibe_index, app.place_names, app.vibe_cache = saved
+    return results
+
+
+def run_micro(args):
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as data_dir:
+        seed_data_dir(data_dir)
+        app = import_backend(data_dir)
+        micro = {}
+        scale = {"small": 1, "full": 10}[args.scale]
+        micro.update(bench_haversine(app, rng, [1_000, 10_000 * scale, 100_000 * scale]))
+        micro.update(bench_route_safety(app, rng, [1_000, 10_000, 50_000 * scale]))
+        micro.update(bench_leaderboard(app, rng, [1_000, 10_000 * scale], data_dir))
+        micro.update(bench_vibe(app, rng, [1_000, 10_000 * scale], data_dir))
+    print(f"{'benchmark':<58} {'median':>12} {'ops/s':>12}")
+    for name, result in micro.items():
+        ops = result.get("ops_per_s")
+        print(f"{name:<58} {result['median_s'] * 1000:>10.3f}ms {'-' if ops is None else round(ops):>12}")
+    results = {"kind": "micro", "meta": run_meta(), "config": {"seed": args.seed, "scale": args.scale}, "micro": micro}
+    write_results(results, args.out)
+    return results
+
+
+# --- load driver ---
+
+def start_server(kind, port, data_dir, env):
+    env = {**os.environ, **env, "DATA_DIR": str(data_dir)}
+    if kind == "threaded":
+        cmd = [sys.executable, "-c", f"import app; app.app.run(port={port}, threaded=True)"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port),
+               "--log-level", "warning", "--backlog", "4096"]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return stand_ins.wait_for_port(proc, port, f"{kind} server", timeout_s=60)
+
+
+def jitter_point(rng, spread=0.05):
+    return {"lat": CENTER[0] + rng.uniform(-spread, spread), "lng": CENTER[1] + rng.uniform(-spread, spread)}
+
+
+def endpoint_requests(rng, place_names):
+    """name -> callable returning (method, path, json body or None, query params or None)."""
+    def safety():
+        return "POST", "/api/safety", jitter_point(rng), None
+
+    def safety_batch():
+        return "POST", "/api/safety/batch", {"points": [jitter_point(rng, 0.01) for _ in range(20)]}, None
+
+    def routes():
+        origin = jitter_point(rng)
+        dest = {"lat": origin["lat"] + rng.uniform(-0.01, 0.01), "lng": origin["lng"] + rng.uniform(-0.01, 0.01)}
+        return "POST", "/api/routes", {"origin": origin, "destination": dest}, None
+
+    def vibe():
+        return "GET", "/api/vibe", None, {"name": rng.choice(place_names)}
+
+    def gems_nearby():
+        point = jitter_point(rng)
+        return "GET", "/api/gems/nearby", None, {"lat": point["lat"], "lng": point["lng"], "limit": 10}
+
+    def leaderboard():
+        return "GET", "/api/gems/leaderboard", None, {"limit": 10}
+
+    def query():
+        body = {"query": f"{rng.choice(QUERIES)} near {rng.choice(LANDMARKS)}", "coordinates": jitter_point(rng)}
+        return "POST", "/api/query", body, None
+
+    return {
+        "safety": safety,
+        "safety_batch": safety_batch,
+        "routes": routes,
+        "vibe": vibe,
+        "gems_nearby": gems_nearby,
+        "leaderboard": leaderboard,
+        "query": query,
+    }
+
+
+def parse_mix(text, available):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in available:
+            raise SystemExit(f"unknown endpoint {name!r} in --mix; choose from {', '.join(available)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+async def drive(base_url, mix, requests_for, concurrency, duration_s, timeout_s, rng):
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=timeout_s)
+    samples = {name: [] for name in mix}
+    statuses = {name: {} for name in mix}
+    names, weights = list(mix), list(mix.values())
+    async with aiohttp.ClientSession(base_url, connector=connector, timeout=timeout) as client:
+        async with client.post("/api/auth/register", json={
+            "name": "Bench", "email": f"bench-{time.time_ns()}@bench.test", "password": "bench",
+        }) as resp:
+            resp.raise_for_status()
+            headers = {"Authorization": f"Bearer {(await resp.json())['token']}"}
+        deadline = time.perf_counter() + duration_s
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                method, path, body, params = requests_for[name]()
+                start = time.perf_counter()
+                try:
+                    async with client.request(method, path, json=body, params=params, headers=headers) as r:
+                        await r.read()
+                        status = r.status
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    status = "client_error"
+                samples[name].append((time.perf_counter() - start, status))
+                statuses[name][str(status)] = statuses[name].get(str(status), 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return samples, statuses, elapsed
+
+
+def summarize(samples, statuses, elapsed):
+    endpoints = {}
+    everything = []
+    for name, rows in samples.items():
+        ok = sorted(latency for latency, status in rows if status == 200)
+        everything.extend(ok)
+        endpoints[name] = {
+            "requests": len(rows),
+            "ok": len(ok),
+            "errors": len(rows) - len(ok),
+            "statuses": statuses[name],
+            "throughput_rps": len(ok) / elapsed,
+            **{f"p{p}_ms": (percentile(ok, p / 100) or 0) * 1000 for p in (50, 95, 99)},
+            "max_ms": (ok[-1] if ok else 0) * 1000,
+        }
+    everything.sort()
+    total = {
+        "requests": sum(e["requests"] for e in endpoints.values()),
+        "ok": len(everything),
+        "throughput_rps": len(everything) / elapsed,
+        **{f"p{p}_ms": (percentile(everything, p / 100) or 0) * 1000 for p in (50, 95, 99)},
+    }
+    return endpoints, total
+
+
+def run_load(args):
+    rng = random.Random(args.seed)
+    stand_in_port = stand_ins.free_port()
+    stand_in = stand_ins.start(
+        stand_in_port, latency=args.latency or (), jitter=args.jitter or (),
+        error_rate=args.error_rate or (), seed=args.seed,
+    )
+    base = f"http://127.0.0.1:{stand_in_port}"
+    try:
+        with tempfile.TemporaryDirectory() as data_dir:
+            seed_data_dir(data_dir)
+            reviews_path = Path(data_dir) / "review_samples.json"
+            place_names = list(json.loads(reviews_path.read_text(encoding="utf-8"))) if reviews_path.exists() else ["cafe"]
+            requests_for = endpoint_requests(rng, place_names)
+            mix = parse_mix(args.mix, requests_for)
+            port = stand_ins.free_port()
+            server = start_server(args.server, port, data_dir, stand_ins.backend_env(base))
+            try:
+                samples, statuses, elapsed = asyncio.run(drive(
+                    f"http://127.0.0.1:{port}", mix, requests_for, args.concurrency,
+                    args.duration, args.timeout, rng,
+                ))
+            finally:
+                server.terminate()
+                server.wait()
+        import urllib.request
+
+        with urllib.request.urlopen(f"{base}/stats", timeout=5) as resp:
+            upstream_calls = json.load(resp)
+    finally:
+        stand_in.terminate()
+        stand_in.wait()
+
+    endpoints, total = summarize(samples, statuses, elapsed)
+    print(f"{args.server} server, concurrency {args.concurrency}, {elapsed:.1f}s")
+    print(f"{'endpoint':<14} {'reqs':>6} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, e in list(endpoints.items()) + [("total", {**total, "errors": total["requests"] - total["ok"]})]:
+        print(f"{name:<14} {e['requests']:>6} {e['errors']:>7} {e['throughput_rps']:>8.1f} "
+              f"{e['p50_ms']:>9.1f} {e['p95_ms']:>9.1f} {e['p99_ms']:>9.1f}")
+    results = {
+        "kind": "load",
+        "meta": run_meta(),
+        "config": {
+            "server": args.server, "concurrency": args.concurrency, "duration_s": args.duration,
+            "mix": mix, "latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+            "seed": args.seed,
+        },
+        "endpoints": endpoints,
+        "total": total,
+        "upstream_calls": upstream_calls,
+    }
+    write_results(results, args.out)
+    return results
+
+
+# --- comparison ---
+
+def comparable_metrics(results):
+    """{metric: (value, higher_is_better)} from a micro or load result file."""
+    metrics = {}
+    for name, result in results.get("micro", {}).items():
+        metrics[name] = (result["median_s"], False)
+    for name, result in list(results.get("endpoints", {}).items()) + [("total", results.get("total"))]:
+        if not result:
+            continue
+        metrics[f"{name}.throughput_rps"] = (result["throughput_rps"], True)
+        for p in (50, 95, 99):
+            metrics[f"{name}.p{p}_ms"] = (result[f"p{p}_ms"], False)
+    return metrics
+
+
+def run_compare(args):
+    old = comparable_metrics(json.loads(Path(args.baseline).read_text(encoding="utf-8")))
+    new = comparable_metrics(json.loads(Path(args.candidate).read_text(encoding="utf-8")))
+    regressions = 0
+    print(f"{'metric':<58} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    for name in sorted(set(old) & set(new)):
+        (before, higher_is_better), (after, _) = old[name], new[name]
+        if not before:
+            continue
+        change = (after - before) / before
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:<58} {before:>12.4g} {after:>12.4g} {change:>+7.1%}{flag}")
+    for name in sorted(set(old) ^ set(new)):
+        print(f"{name:<58} only in {'baseline' if name in old else 'candidate'}")
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    micro = sub.add_parser("micro", help="In-process micro-benchmarks")
+    micro.add_argument("--scale", choices=("small", "full"), default="small",
+                       help="full runs the largest synthetic sizes 10x bigger")
+    micro.add_argument("--seed", type=int, default=7)
+    micro.add_argument("--out")
+
+    load = sub.add_parser("load", help="HTTP load test against local stand-ins")
+    load.add_argument("--server", choices=("threaded", "async"), default="threaded")
+    load.add_argument("--concurrency", type=int, default=32)
+    load.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    load.add_argument("--timeout", type=float, default=60.0, help="per-request client timeout")
+    load.add_argument("--mix", default="safety=3,safety_batch=1,routes=2,vibe=3,gems_nearby=2,leaderboard=1,query=1",
+                      help="endpoint=weight list")
+    load.add_argument("--latency", action="append", help="stand-in latency: seconds or upstream=seconds")
+    load.add_argument("--jitter", action="append", help="stand-in jitter: seconds or upstream=seconds")
+    load.add_argument("--error-rate", action="append", help="stand-in 503 rate: fraction or upstream=fraction")
+    load.add_argument("--seed", type=int, default=7)
+    load.add_argument("--out")
+
+    compare = sub.add_parser("compare", help="Compare two result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+    compare.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown")
+
+    args = parser.parse_args()
+    if args.command == "micro":
+        run_micro(args)
+    elif args.command == "load":
+        run_load(args)
+    else:
+        sys.exit(run_compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Load test: threaded Flask server vs the asyncio server (backend/asgi.py)
+on /api/routes while ORS and Overpass are slow.
+
+Both servers run as subprocesses against a local stand-in that answers
+ORS and Overpass after --delay seconds, with a throwaway DATA_DIR so no
+real data or caches are touched. Every request uses a fresh origin, so
+route and tile caches do not hide the upstream wait.
+
+    python scripts/load_test_async.py --concurrency 500 --requests 1000 --delay 2
+
+The servers share the machine with the stand-in and the load generator,
+so on small boxes both end up CPU-bound; compare threads and latency, and
+expect 504s from the async server once requests queue past
+ASYNC_REQUEST_TIMEOUT_S.
+
+Needs aiohttp, starlette and uvicorn (the async server's dependencies).
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+CENTER = (15.8497, 74.4977)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def stand_in_app(delay_s):
+    async def ors(request):
+        body = await request.json()
+        (lng0, lat0), (lng1, lat1) = body["coordinates"]
+        await asyncio.sleep(delay_s)
+        coords = [[lng0 + (lng1 - lng0) * i / 20, lat0 + (lat1 - lat0) * i / 20] for i in range(21)]
+        return JSONResponse({
+            "features": [{
+                "geometry": {"coordinates": coords},
+                "properties": {"summary": {"distance": 1500.0, "duration": 1080.0}},
+            }]
+        })
+
+    async def overpass(request):
+        await asyncio.sleep(delay_s)
+        return JSONResponse({"elements": []})
+
+    return Starlette(routes=[
+        Route("/ors", ors, methods=["POST"]),
+        Route("/overpass", overpass, methods=["GET"]),
+    ])
+
+
+def serve_stand_in(port, delay_s):
+    uvicorn.run(stand_in_app(delay_s), port=port, log_level="warning", backlog=4096)
+
+
+def wait_for_port(proc, port, label):
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{label} did not start on port {port}")
+
+
+def start_stand_in(port, delay_s):
+    # A separate process, so the stand-in and the load generator do not
+    # share one interpreter lock.
+    cmd = [sys.executable, __file__, "--serve-stand-in", str(port), "--delay", str(delay_s)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return wait_for_port(proc, port, "stand-in")
+
+
+def start_server(kind, port, stand_in_port, data_dir):
+    env = {
+        **os.environ,
+        "DATA_DIR": str(data_dir),
+        "ORS_API_KEY": "load-test",
+        "ORS_ENDPOINT": f"http://127.0.0.1:{stand_in_port}/ors",
+        "OVERPASS_ENDPOINT": f"http://127.0.0.1:{stand_in_port}/overpass",
+        "GEMINI_API_KEY": "",
+    }
+    if kind == "threaded":
+        cmd = [sys.executable, "-c", f"import app; app.app.run(port={port}, threaded=True)"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--port", str(port),
+               "--log-level", "warning", "--backlog", "4096"]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return wait_for_port(proc, port, f"{kind} server")
+
+
+def process_status(pid):
+    """(rss_mb, threads) of a process, from /proc (Linux only)."""
+    try:
+        fields = dict(
+            line.split(":", 1) for line in Path(f"/proc/{pid}/status").read_text().splitlines() if ":" in line
+        )
+        return int(fields["VmRSS"].split()[0]) / 1024, int(fields["Threads"])
+    except (OSError, KeyError, ValueError):
+        return float("nan"), 0
+
+
+async def run_load(base_url, concurrency, total, timeout_s, server_pid):
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=timeout_s)
+    async with aiohttp.ClientSession(base_url, connector=connector, timeout=timeout) as client:
+        async with client.post("/api/auth/register", json={
+            "name": "Load", "email": f"load-{time.time_ns()}@example.com", "password": "load-test",
+        }) as resp:
+            resp.raise_for_status()
+            headers = {"Authorization": f"Bearer {(await resp.json())['token']}"}
+        rng = random.Random(7)
+        bodies = []
+        for _ in range(total):
+            lat = CENTER[0] + rng.uniform(-0.2, 0.2)
+            lng = CENTER[1] + rng.uniform(-0.2, 0.2)
+            bodies.append({"origin": {"lat": lat, "lng": lng}, "destination": {"lat": lat + 0.01, "lng": lng + 0.01}})
+
+        latencies = []
+        errors = 0
+        queue = iter(bodies)
+
+        async def worker():
+            nonlocal errors
+            for body in queue:
+                start = time.perf_counter()
+                try:
+                    async with client.post("/api/routes", json=body, headers=headers) as r:
+                        await r.read()
+                        ok = r.status == 200
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        peak = [0.0, 0]
+
+        async def sample():
+            while True:
+                rss_mb, threads = process_status(server_pid)
+                peak[0] = max(peak[0], rss_mb)
+                peak[1] = max(peak[1], threads)
+                await asyncio.sleep(0.25)
+
+        sampler = asyncio.ensure_future(sample())
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        sampler.cancel()
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else float("nan")
+
+    return {
+        "ok": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+        "max": latencies[-1] if latencies else float("nan"),
+        "peak_rss_mb": peak[0],
+        "peak_threads": peak[1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--delay", type=float, default=1.0, help="stand-in upstream latency in seconds")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--servers", default="threaded,async")
+    parser.add_argument("--serve-stand-in", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve_stand_in:
+        serve_stand_in(args.serve_stand_in, args.delay)
+        return
+
+    stand_in_port = free_port()
+    stand_in = start_stand_in(stand_in_port, args.delay)
+    # Each /api/routes miss waits on ORS and then Overpass.
+    print(f"Upstream stand-in: {args.delay}s per call; best case ~{2 * args.delay:.1f}s per request.")
+    print(f"{'server':<10} {'ok':>6} {'errors':>7} {'req/s':>8} {'p50 s':>7} {'p95 s':>7} {'max s':>7} "
+          f"{'threads':>8} {'rss MB':>7}")
+    for kind in args.servers.split(","):
+        port = free_port()
+        with tempfile.TemporaryDirectory() as data_dir:
+            proc = start_server(kind, port, stand_in_port, Path(data_dir))
+            try:
+                result = asyncio.run(run_load(
+                    f"http://127.0.0.1:{port}", args.concurrency, args.requests, args.timeout, proc.pid
+                ))
+            finally:
+                proc.terminate()
+                proc.wait()
+        print(f"{kind:<10} {result['ok']:>6} {result['errors']:>7} {result['rps']:>8.1f} "
+              f"{result['p50']:>7.2f} {result['p95']:>7.2f} {result['max']:>7.2f} "
+              f"{result['peak_threads']:>8} {result['peak_rss_mb']:>7.0f}")
+    stand_in.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Local stand-ins for the upstream APIs the backend calls, for benchmarks and
+load tests that must not depend on the real services.
+
+One server answers for every upstream, replaying the responses saved in
+scripts/fixtures/ (replace a file with a fresh capture to change what is
+replayed):
+
+  /overpass    GET  Overpass; "out count" queries count, bbox queries list
+                    the recorded elements. The recorded area is repeated
+                    like a tiling, so every location has the same density.
+  /ors         POST ORS foot-walking; the recorded response with a
+                    straight-line geometry between the requested points.
+  /photon      GET  Photon; the recorded feature renamed to the query and
+                    placed within ~1 km of the location bias.
+  /open-meteo  GET  open-meteo current conditions, as recorded.
+  /gemini/...  POST Gemini generateContent / streamGenerateContent over
+                    REST, answering the recorded text.
+
+Latency and faults are set per upstream, or for all with a bare value:
+
+    python scripts/stand_ins.py --port 8900 --latency 0.2 --latency overpass=1.5 \\
+        --jitter 0.05 --error-rate ors=0.1
+
+backend_env() gives the environment variables that point the backend at a
+running stand-in.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+import zlib
+from pathlib import Path
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+UPSTREAMS = ("overpass", "ors", "photon", "open_meteo", "gemini")
+EARTH_RADIUS_M = 6371000.0
+
+AROUND_RE = re.compile(r"around:\s*([\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)")
+BBOX_RE = re.compile(r"\(\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*\)")
+
+
+def parse_per_upstream(values, default):
+    """["0.2", "ors=1.5"] -> {upstream: float}; a bare value applies to all."""
+    result = {name: default for name in UPSTREAMS}
+    for value in values or ():
+        name, _, number = value.rpartition("=")
+        if name and name not in UPSTREAMS:
+            raise ValueError(f"unknown upstream {name!r}; expected one of {', '.join(UPSTREAMS)}")
+        for target in ([name] if name else UPSTREAMS):
+            result[target] = float(number)
+    return result
+
+
+class Faults:
+    def __init__(self, latency, jitter, error_rate, seed=7):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.calls = {name: 0 for name in UPSTREAMS}
+        self.errors = {name: 0 for name in UPSTREAMS}
+
+    async def apply(self, name):
+        """Waits the configured latency; returns an error response to send instead, if injected."""
+        self.calls[name] += 1
+        delay = self.latency[name] + self.rng.uniform(0, self.jitter[name])
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.rng.random() < self.error_rate[name]:
+            self.errors[name] += 1
+            return JSONResponse({"error": f"injected {name} failure"}, status_code=503)
+        return None
+
+
+def load_fixture(name, fixtures_dir=FIXTURES_DIR):
+    with (Path(fixtures_dir) / f"{name}.json").open("r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+class OverpassReplay:
+    """The recorded elements, repeated with the recorded bbox as the period."""
+
+    def __init__(self, data):
+        self.south, self.west, self.north, self.east = data["bbox"]
+        self.elements = data["elements"]
+
+    @staticmethod
+    def position(el):
+        if el["type"] == "node":
+            return el["lat"], el["lon"]
+        return el["center"]["lat"], el["center"]["lon"]
+
+    def elements_in(self, south, west, north, east):
+        period_lat, period_lng = self.north - self.south, self.east - self.west
+        out = []
+        for i in range(math.floor((south - self.north) / period_lat), math.ceil((north - self.south) / period_lat) + 1):
+            for j in range(math.floor((west - self.east) / period_lng), math.ceil((east - self.west) / period_lng) + 1):
+                for el in self.elements:
+                    lat, lng = self.position(el)
+                    lat, lng = lat + i * period_lat, lng + j * period_lng
+                    if south <= lat <= north and west <= lng <= east:
+                        copy = dict(el, id=el["id"] + (i * 1000 + j) * 10_000_000)
+                        if el["type"] == "node":
+                            copy.update(lat=round(lat, 7), lon=round(lng, 7))
+                        else:
+                            copy["center"] = {"lat": round(lat, 7), "lon": round(lng, 7)}
+                        out.append(copy)
+        return out
+
+    def count_around(self, radius_m, lat, lng):
+        dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+        dlng = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        total = 0
+        for el in self.elements_in(lat - dlat, lng - dlng, lat + dlat, lng + dlng):
+            tags = el.get("tags", {})
+            if el["type"] != "node" or not (tags.get("highway") == "street_lamp" or tags.get("amenity") == "police"):
+                continue
+            elat, elng = self.position(el)
+            if haversine_m(lat, lng, elat, elng) <= radius_m:
+                total += 1
+        return total
+
+    def answer(self, query):
+        if "out count" in query:
+            match = AROUND_RE.search(query)
+            total = self.count_around(*(float(v) for v in match.groups())) if match else 0
+            return {"elements": [{"type": "count", "id": 0, "tags": {"total": str(total)}}]}
+        match = BBOX_RE.search(query)
+        if not match:
+            return {"elements": []}
+        return {"elements": self.elements_in(*(float(v) for v in match.groups()))}
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def make_app(faults, fixtures_dir=FIXTURES_DIR):
+    overpass_data = OverpassReplay(load_fixture("overpass", fixtures_dir))
+    ors_data = load_fixture("ors", fixtures_dir)
+    photon_data = load_fixture("photon", fixtures_dir)
+    weather_data = load_fixture("open_meteo", fixtures_dir)
+    gemini_data = load_fixture("gemini", fixtures_dir)
+
+    async def overpass(request):
+        error = await faults.apply("overpass")
+        if error is not None:
+            return error
+        query = request.query_params.get("data", "")
+        # Replaying a wide bbox is real work; keep it off the event loop.
+        return JSONResponse(await asyncio.to_thread(overpass_data.answer, query))
+
+    async def ors(request):
+        body = await request.json()
+        error = await faults.apply("ors")
+        if error is not None:
+            return error
+        (lng0, lat0), (lng1, lat1) = body["coordinates"][:2]
+        coords = [[lng0 + (lng1 - lng0) * i / 20, lat0 + (lat1 - lat0) * i / 20] for i in range(21)]
+        distance = haversine_m(lat0, lng0, lat1, lng1) * 1.25
+        payload = json.loads(json.dumps(ors_data))
+        feature = payload["features"][0]
+        feature["geometry"]["coordinates"] = coords
+        feature["properties"]["summary"] = {"distance": round(distance, 1), "duration": round(distance / 1.39, 1)}
+        return JSONResponse(payload)
+
+    async def photon(request):
+        error = await faults.apply("photon")
+        if error is not None:
+            return error
+        params = request.query_params
+        name = params.get("q", "")
+        lat = float(params.get("lat", 15.8497))
+        lng = float(params.get("lon", 74.4977))
+        # Stable per name, so repeated lookups land on the same spot.
+        seed = zlib.crc32(name.encode("utf-8"))
+        payload = json.loads(json.dumps(photon_data))
+        feature = payload["features"][0]
+        feature["geometry"]["coordinates"] = [
+            round(lng + ((seed & 0xFFFF) / 0xFFFF - 0.5) * 0.02, 6),
+            round(lat + ((seed >> 16) / 0xFFFF - 0.5) * 0.02, 6),
+        ]
+        feature["properties"]["name"] = name
+        return JSONResponse(payload)
+
+    async def open_meteo(request):
+        error = await faults.apply("open_meteo")
+        if error is not None:
+            return error
+        return JSONResponse(weather_data)
+
+    async def gemini(request):
+        error = await faults.apply("gemini")
+        if error is not None:
+            return error
+        if "streamGenerateContent" in request.url.path:
+            # The REST transport streams a JSON array of partial responses.
+            text = gemini_data["candidates"][0]["content"]["parts"][0]["text"]
+            size = max(1, len(text) // 6)
+            chunks = []
+            for start in range(0, len(text), size):
+                chunk = json.loads(json.dumps(gemini_data))
+                chunk["candidates"][0]["content"]["parts"][0]["text"] = text[start:start + size]
+                chunks.append(chunk)
+            return JSONResponse(chunks)
+        return JSONResponse(gemini_data)
+
+    async def stats(request):
+        return JSONResponse({"calls": faults.calls, "errors": faults.errors})
+
+    return Starlette(routes=[
+        Route("/overpass", overpass, methods=["GET", "POST"]),
+        Route("/ors", ors, methods=["POST"]),
+        Route("/photon", photon, methods=["GET"]),
+        Route("/open-meteo", open_meteo, methods=["GET"]),
+        Route("/gemini/{path:path}", gemini, methods=["POST"]),
+        Route("/stats", stats, methods=["GET"]),
+    ])
+
+
+def backend_env(base_url):
+    """Environment variables that send every backend upstream call to the stand-in at base_url."""
+    return {
+        "ORS_API_KEY": "stand-in",
+        "ORS_ENDPOINT": f"{base_url}/ors",
+        "OVERPASS_ENDPOINT": f"{base_url}/overpass",
+        "OVERPASS_MIRROR_ENDPOINT": f"{base_url}/overpass",
+        "GEOCODER_ENDPOINT": f"{base_url}/photon",
+        "WEATHER_ENDPOINT": f"{base_url}/open-meteo",
+        "GEMINI_API_KEY": "stand-in",
+        "GEMINI_ENDPOINT": f"{base_url}/gemini",
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(proc, port, label, timeout_s=30):
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{label} exited with status {proc.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{label} did not start on port {port}")
+
+
+def start(port, latency=(), jitter=(), error_rate=(), seed=7):
+    """Runs the stand-in in a subprocess (its own interpreter lock) and waits until it listens."""
+    cmd = [sys.executable, __file__, "--port", str(port), "--seed", str(seed)]
+    for flag, values in (("--latency", latency), ("--jitter", jitter), ("--error-rate", error_rate)):
+        for value in values:
+            cmd += [flag, str(value)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return wait_for_port(proc, port, "stand-in")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", action="append", help="seconds, or upstream=seconds (repeatable)")
+    parser.add_argument("--jitter", action="append", help="extra uniform random seconds, or upstream=seconds")
+    parser.add_argument("--error-rate", action="append", help="fraction of 503s, or upstream=fraction")
+    parser.add_argument("--fixtures", default=str(FIXTURES_DIR))
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    faults = Faults(
+        parse_per_upstream(args.latency, 0.0),
+        parse_per_upstream(args.jitter, 0.0),
+        parse_per_upstream(args.error_rate, 0.0),
+        seed=args.seed,
+    )
+    uvicorn.run(make_app(faults, args.fixtures), port=args.port, log_level="warning", backlog=4096)
+
+
+if __name__ == "__main__":
+    main()